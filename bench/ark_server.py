@@ -0,0 +1,185 @@
+# bench/ark_server.py
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for Ark's OpenAI-compatible chat completions endpoint.
+# Point openai.base_url at `ArkStandIn.base_url` (or run `python -m bench.ark_server`)
+# to exercise batch_api without credentials. Latency, error rate and an RPM limit
+# (answered with 429s) are configurable; answers are deterministic per prompt.
+
+PACKED_ID_PATTERN = re.compile(r"^### Post ID: (\S+)", re.MULTILINE)
+
+def _digest(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def filter_scores(text: str) -> dict:
+    value = _digest(text)
+    return {
+        "relevance_score": value % 11,
+        "emotional_intensity": (value >> 8) % 11,
+        "pain_point_clarity": (value >> 16) % 11,
+        "summary": "Synthetic summary.",
+    }
+
+def answer(messages: list) -> str:
+    """Content in the shape the pipeline expects for filter, packed filter, insight or cluster prompts."""
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    user = "\n".join(m.get("content") or "" for m in messages if m.get("role") != "system")
+    packed_ids = PACKED_ID_PATTERN.findall(user)
+    if packed_ids:
+        return json.dumps([{"id": post_id, **filter_scores(post_id)} for post_id in packed_ids])
+    if "clustering" in system:
+        return "- Synthetic merged pain point\n- Another merged pain point"
+    if "extracting pain points" in system:
+        value = _digest(user)
+        return json.dumps({
+            "pain_point": "Synthetic pain point",
+            "lead_type": ["Founder", "Developer", "Marketer"][value % 3],
+            "tags": ["automation", "reporting"],
+            "roi_weight": 1 + value % 5,
+            "justification": "Synthetic justification.",
+            "potential_solution": "Synthetic solution.",
+        })
+    return json.dumps(filter_scores(user))
+
+class ArkStandIn:
+    """
+    Threaded HTTP server answering POST .../chat/completions like Ark.
+
+    latency (+ uniform jitter) is slept per request; error_rate is the share of
+    requests answered with HTTP 500; rpm_limit turns requests beyond the per-minute
+    budget into HTTP 429s. `stats` counts requests, errors and throttled calls.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rpm_limit=None, host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rpm_limit = rpm_limit
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "prompt_tokens": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = []
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ark-stand-in", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self) -> str | None:
+        """None to serve the request, or "throttled"/"error" to fail it."""
+        with self._lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if self.rpm_limit:
+                self._window = [t for t in self._window if now - t < 60]
+                if len(self._window) >= self.rpm_limit:
+                    self.stats["throttled"] += 1
+                    return "throttled"
+                self._window.append(now)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass  # one line per request would dominate the benchmark
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"code": "NotFound", "message": f"unknown path {self.path}"}})
+                    return
+
+                delay = server.latency + (server._rng.uniform(0, server.jitter) if server.jitter else 0)
+                if delay:
+                    time.sleep(delay)
+                outcome = server._admit()
+                if outcome == "throttled":
+                    self._send(429, {"error": {"code": "RateLimitExceeded", "message": "rate limit exceeded (stand-in)"}})
+                    return
+                if outcome == "error":
+                    self._send(500, {"error": {"code": "InternalServiceError", "message": "injected failure (stand-in)"}})
+                    return
+
+                messages = request.get("messages", [])
+                content = answer(messages)
+                prompt_tokens = max(1, sum(len(m.get("content") or "") for m in messages) // 4)
+                completion_tokens = max(1, len(content) // 4)
+                with server._lock:
+                    server.stats["prompt_tokens"] += prompt_tokens
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", ""),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                        "prompt_tokens_details": {"cached_tokens": 0},
+                    },
+                })
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Ark chat-completions stand-in")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds slept per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra uniform random latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--rpm-limit", type=int, default=None, help="Requests per minute before HTTP 429s")
+    args = parser.parse_args()
+
+    stand_in = ArkStandIn(args.latency, args.jitter, args.error_rate, args.rpm_limit, port=args.port)
+    print(f"Ark stand-in listening on {stand_in.base_url} (set openai.base_url to this)")
+    try:
+        stand_in._server.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.stop()
@@ -0,0 +1,101 @@
+# bench/conftest.py
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# config/config.yaml and the prompt templates are read relative to the repository root
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+for name in ("ARK_API_KEY", "OPENAI_API_KEY", "REDDIT_CLIENT_ID", "REDDIT_CLIENT_SECRET",
+             "REDDIT_USER_AGENT", "REDDIT_USERNAME", "REDDIT_PASSWORD"):
+    os.environ.setdefault(name, "bench")
+
+import db.reader
+import db.writer
+import gpt.response_cache
+import scheduler.cost_tracker
+import reddit.scraper
+from bench.ark_server import ArkStandIn
+from bench.fake_reddit import FakeReddit
+from config.config_loader import get_config
+from db.schema import create_tables
+from reddit.rate_limiter import RedditRateLimiter
+
+SIZES = [1_000, 10_000, 100_000]
+
+def pytest_addoption(parser):
+    parser.addoption("--bench-max-items", type=int, default=10_000,
+                     help="Skip scenarios larger than this (100k runs take minutes)")
+    parser.addoption("--bench-latency", type=float, default=0.0, help="Stand-in seconds per LLM request")
+    parser.addoption("--bench-error-rate", type=float, default=0.0, help="Share of stand-in requests failing with 500")
+    parser.addoption("--bench-rpm-limit", type=int, default=None, help="Stand-in requests per minute before 429s")
+
+@pytest.fixture
+def items(request):
+    size = request.param
+    if size > request.config.getoption("--bench-max-items"):
+        pytest.skip(f"{size} items exceeds --bench-max-items")
+    return size
+
+@pytest.fixture(scope="session")
+def ark_stand_in(request):
+    stand_in = ArkStandIn(
+        latency=request.config.getoption("--bench-latency"),
+        error_rate=request.config.getoption("--bench-error-rate"),
+        rpm_limit=request.config.getoption("--bench-rpm-limit"),
+    )
+    with stand_in:
+        yield stand_in
+
+def _reset_connections():
+    for module in (db.reader, db.writer, scheduler.cost_tracker, gpt.response_cache):
+        if module._conn is not None:
+            module._conn.close()
+            module._conn = None
+    db.reader._history_cache = None
+
+@pytest.fixture
+def bench_env(tmp_path, monkeypatch, ark_stand_in):
+    """
+    Fresh data/ directory (SQLite DB, cost ledger, batch files) under tmp_path,
+    LLM calls routed to the stand-in, and client-side limits lifted so the
+    benchmark measures the pipeline rather than the configured quotas.
+    """
+    config = get_config()
+    openai_overrides = {
+        "base_url": ark_stand_in.base_url,
+        "cache_input": False,
+        "context_cache": False,
+        "monthly_budget_usd": 1_000_000,
+        "rpm_limit": 10**9,
+        "tpm_limit": 10**12,
+        "initial_concurrency": 64,
+        "request_retry_base_delay": 0.05,
+        "request_retry_max_delay": 1,
+    }
+    for key, value in openai_overrides.items():
+        monkeypatch.setitem(config["openai"], key, value)
+    monkeypatch.setitem(config["database"], "history_cache", False)
+
+    monkeypatch.chdir(tmp_path)
+    for folder in ("data/batch_responses", "data/deferred"):
+        (tmp_path / folder).mkdir(parents=True, exist_ok=True)
+    _reset_connections()
+    create_tables()
+    scheduler.cost_tracker.initialize_cost_tracking()
+    yield tmp_path
+    _reset_connections()
+
+@pytest.fixture
+def fake_reddit(monkeypatch):
+    """Route the scraper to a FakeReddit with an effectively unlimited rate limiter."""
+    def install(**kwargs):
+        source = FakeReddit(**kwargs)
+        monkeypatch.setattr(reddit.scraper, "get_reddit_client", lambda: source)
+        monkeypatch.setattr(reddit.scraper, "limiter", RedditRateLimiter(10**9, burst=10**9))
+        return source
+    return install
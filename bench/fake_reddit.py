@@ -0,0 +1,134 @@
+# bench/fake_reddit.py
+
+import random
+import time
+
+# Synthetic, praw-compatible Reddit source for offline benchmarks.
+# Posts and comment trees are generated deterministically from (seed, subreddit, index)
+# and only when a listing or `.comments` is read, so 100k-item scenarios stay cheap to set up.
+
+FILLER_WORDS = (
+    "the a we our team build deploy server queue report customer invoice weekly data "
+    "export import dashboard client api job task email backup database sync script tool"
+).split()
+PAIN_PHRASES = [
+    "I am so frustrated that",
+    "is there a tool that can",
+    "we still do this manually and",
+    "looking for an alternative to our",
+    "our cron jobs keep failing when",
+    "how do you automate the",
+]
+
+def synthetic_text(rng: random.Random, words: int, pain_ratio: float = 0.3) -> str:
+    parts = []
+    if rng.random() < pain_ratio:
+        parts.append(rng.choice(PAIN_PHRASES))
+    parts.extend(rng.choice(FILLER_WORDS) for _ in range(words))
+    return " ".join(parts)
+
+class FakeComment:
+    def __init__(self, comment_id, body, created_utc, permalink):
+        self.id = comment_id
+        self.body = body
+        self.created_utc = created_utc
+        self.permalink = permalink
+        self.replies = []
+
+class FakeCommentForest(list):
+    """Top-level comments; replace_more is a no-op because the tree is generated complete."""
+
+    def replace_more(self, limit=None, threshold=0):
+        return []
+
+    def list(self):
+        flat, queue = [], list(self)
+        while queue:
+            comment = queue.pop(0)
+            flat.append(comment)
+            queue.extend(comment.replies)
+        return flat
+
+class FakeSubmission:
+    def __init__(self, source, subreddit_name, index):
+        rng = random.Random(f"{source.seed}:{subreddit_name}:{index}")
+        self._source = source
+        self._comments = None
+        self.id = f"{subreddit_name}-{index}"
+        self.name = f"t3_{self.id}"
+        self.title = synthetic_text(rng, 8)
+        self.selftext = synthetic_text(rng, source.body_words)
+        self.created_utc = source.now - rng.uniform(source.min_age_days, source.max_age_days) * 86400
+        self.permalink = f"/r/{subreddit_name}/comments/{self.id}/"
+
+    @property
+    def comments(self) -> FakeCommentForest:
+        if self._comments is None:
+            self._comments = self._source.comment_tree(self)
+        return self._comments
+
+class FakeSubreddit:
+    def __init__(self, source, name):
+        self._source = source
+        self.display_name = name
+
+    def _posts(self, limit):
+        count = min(limit or self._source.posts_per_subreddit, self._source.posts_per_subreddit)
+        return (FakeSubmission(self._source, self.display_name, i) for i in range(count))
+
+    def top(self, time_filter="all", limit=None):
+        return self._posts(limit)
+
+    def hot(self, limit=None):
+        return self._posts(limit)
+
+    def new(self, limit=None):
+        return iter(sorted(self._posts(limit), key=lambda post: post.created_utc, reverse=True))
+
+class FakeReddit:
+    """
+    Stand-in for praw.Reddit: `subreddit(name)` returns listings of generated posts.
+
+    Each post carries `comments_per_post` comments spread over `comment_depth` levels,
+    written within a day of the post, with bodies of about `comment_words` words.
+    """
+
+    def __init__(self, posts_per_subreddit=100, comments_per_post=0, comment_depth=3,
+                 body_words=80, comment_words=30, min_age_days=6, max_age_days=25, seed=0):
+        self.posts_per_subreddit = posts_per_subreddit
+        self.comments_per_post = comments_per_post
+        self.comment_depth = max(1, comment_depth)
+        self.body_words = body_words
+        self.comment_words = comment_words
+        self.min_age_days = min_age_days
+        self.max_age_days = max_age_days
+        self.seed = seed
+        self.now = time.time()
+
+    def subreddit(self, name) -> FakeSubreddit:
+        return FakeSubreddit(self, name)
+
+    def submission(self, id) -> FakeSubmission:
+        subreddit_name, index = id.rsplit("-", 1)
+        return FakeSubmission(self, subreddit_name, int(index))
+
+    def comment_tree(self, post) -> FakeCommentForest:
+        rng = random.Random(f"{self.seed}:{post.id}:comments")
+        forest = FakeCommentForest()
+        levels = [[] for _ in range(self.comment_depth)]
+        for i in range(self.comments_per_post):
+            comment = FakeComment(
+                f"{post.id}c{i}",
+                synthetic_text(rng, self.comment_words),
+                rng.uniform(post.created_utc, post.created_utc + 86400),  # within a day, so still old enough
+                f"{post.permalink}c{i}/"
+            )
+            depth = rng.randrange(self.comment_depth) if levels[0] else 0
+            while depth and not levels[depth - 1]:
+                depth -= 1
+            if depth == 0:
+                forest.append(comment)
+            else:
+                rng.choice(levels[depth - 1]).replies.append(comment)
+            levels[depth].append(comment)
+        return forest
@@ -0,0 +1,128 @@
+# bench/test_pipeline_bench.py
+
+import asyncio
+import random
+import resource
+import time
+
+import pytest
+
+from bench.conftest import SIZES
+from bench.fake_reddit import synthetic_text
+from config.config_loader import get_config
+from db.reader import get_posts_by_ids, get_high_potential_ids
+from db.writer import insert_posts, update_posts_insight, mark_insights_processed
+from gpt.filters import prepare_batch_payload as prepare_filter_batch
+from gpt.insights import prepare_insight_batch
+from gpt.batch_api import generate_batch_payload
+from reddit.scraper import scrape_subreddits
+from scheduler.runner import (
+    submit_filter_batch, submit_with_backoff, ingest_filter_results, read_insight_results,
+    run_cluster_stage, split_batch_by_token_limit
+)
+
+# Run with: python -m pytest bench --benchmark-only [--bench-max-items 100000]
+# Each scenario is timed once per round on fresh state; items/s and peak RSS go into extra_info.
+
+SUBREDDITS = [f"bench{i}" for i in range(10)]
+COMMENTS_PER_POST = 10  # one comment chunk per post, so scraped items = 2 x posts
+CHUNKS_PER_THREAD = 10  # comment chunks sharing a title_id in the clustering scenario
+
+def run_scenario(benchmark, items, setup, run):
+    """Time `run(state)` on state from `setup()` and record throughput and memory."""
+    timings = []
+
+    def pedantic_setup():
+        return (setup(),), {}
+
+    def timed(state):
+        started = time.perf_counter()
+        try:
+            return run(state)
+        finally:
+            timings.append(time.perf_counter() - started)
+
+    result = benchmark.pedantic(timed, setup=pedantic_setup, rounds=1, iterations=1)
+    benchmark.extra_info["items"] = items
+    benchmark.extra_info["items_per_second"] = round(items / max(min(timings), 1e-9), 1)
+    benchmark.extra_info["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+def synthetic_posts(count, prefix="p", thread_size=1) -> list:
+    rng = random.Random(count)
+    created_utc = time.time() - 10 * 86400
+    posts = []
+    for i in range(count):
+        thread = f"{prefix}{i // thread_size}"
+        posts.append({
+            "id": f"{prefix}{i}",
+            "title": synthetic_text(rng, 8),
+            "title_id": thread,
+            "body": f"post: '''\n{synthetic_text(rng, 80)}'''",
+            "subreddit": "bench",
+            "url": f"https://www.reddit.com/r/bench/{i}",
+            "created_utc": created_utc,
+            "type": "post" if thread_size == 1 else "comment",
+        })
+    return posts
+
+@pytest.mark.parametrize("items", SIZES, indirect=True)
+def test_scrape(benchmark, bench_env, fake_reddit, monkeypatch, items):
+    posts_per_subreddit = items // (2 * len(SUBREDDITS))
+    fake_reddit(posts_per_subreddit=posts_per_subreddit, comments_per_post=COMMENTS_PER_POST)
+    monkeypatch.setitem(get_config()["scraper"], "include_comments", True)
+
+    scraped = run_scenario(
+        benchmark, items,
+        setup=lambda: None,
+        run=lambda _: scrape_subreddits(SUBREDDITS, posts_per_subreddit)
+    )
+    assert len(scraped) == items
+
+@pytest.mark.parametrize("items", SIZES, indirect=True)
+def test_filter(benchmark, bench_env, items):
+    model = get_config()["openai"]["model_filter"]
+    posts = synthetic_posts(items)
+    insert_posts(posts)
+
+    def run(batch):
+        for sub_batch in split_batch_by_token_limit(batch, model):
+            for path in asyncio.run(submit_filter_batch(sub_batch, model)):
+                ingest_filter_results(path, "bench", sub_batch)
+        return get_high_potential_ids("bench")
+
+    run_scenario(benchmark, items, setup=lambda: prepare_filter_batch(posts), run=run)
+    assert get_posts_by_ids({posts[0]["id"]})[0]["relevance_score"] is not None
+
+@pytest.mark.parametrize("items", SIZES, indirect=True)
+def test_insight(benchmark, bench_env, items):
+    model = get_config()["openai"]["model_deep"]
+    posts = synthetic_posts(items)
+    insert_posts(posts)
+
+    def run(batch):
+        paths = []
+        for sub_batch in split_batch_by_token_limit(batch, model):
+            path = asyncio.run(submit_with_backoff(
+                batch_items=sub_batch, model=model, generate_file_fn=generate_batch_payload, label="insight"
+            ))
+            if path:
+                paths.append(path)
+        insights, post_ids = read_insight_results(paths)
+        update_posts_insight(insights)
+        mark_insights_processed(post_ids)
+        return post_ids
+
+    post_ids = run_scenario(benchmark, items, setup=lambda: prepare_insight_batch(posts), run=run)
+    assert len(post_ids) == items
+
+@pytest.mark.parametrize("items", SIZES, indirect=True)
+def test_cluster(benchmark, bench_env, items):
+    posts = synthetic_posts(items, prefix="c", thread_size=CHUNKS_PER_THREAD)
+    insert_posts(posts)
+    update_posts_insight([(post["id"], {"pain_point": f"pain {i % 7}", "lead_type": "Founder", "tags": ["a"],
+                                        "roi_weight": 3}) for i, post in enumerate(posts)])
+    post_ids = [post["id"] for post in posts]
+
+    run_scenario(benchmark, items, setup=lambda: post_ids, run=run_cluster_stage)
+    assert get_posts_by_ids({posts[0]["title_id"]})[0]["pain_point"].startswith("- Synthetic")
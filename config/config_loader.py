@@ -1,12 +1,17 @@
 import yaml
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()  # Load .env file
 
 CONFIG_PATH = "config/config.yaml"
 
-def get_config():
+# Parsed once per process; modules share this dict (reload_config re-reads it in place)
+_config = None
+_config_lock = threading.Lock()
+
+def _load_config() -> dict:
     with open(CONFIG_PATH, "r") as f:
         raw_config = yaml.safe_load(f)
 
@@ -22,3 +27,32 @@ def get_config():
     raw_config["openai"]["api_key"] = os.getenv("OPENAI_API_KEY")
 
     return raw_config
+
+def get_config():
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = _load_config()
+    return _config
+
+def reload_config():
+    """
+    Re-read config.yaml and .env, updating the shared dict so existing references see the change.
+
+    Only code that reads the dict when it runs picks up new values. Module constants
+    derived from it at import time (MAX_WORKERS, FILTER_PACK_SIZE, PROMPT_LAYOUT,
+    QUEUE_SIZE, DB_PATH, the near_duplicates settings, ...) keep their old values until
+    the process restarts. Clients built from the old credentials stay cached until
+    utils.clients.reset_clients() is called.
+    """
+    global _config
+    with _config_lock:
+        load_dotenv(override=True)
+        fresh = _load_config()
+        if _config is None:
+            _config = fresh
+        else:
+            _config.clear()
+            _config.update(fresh)
+    return _config
@@ -31,6 +31,15 @@ def clean_old_entries():
     """, (cutoff_date,))
     history_deleted = c.rowcount
 
+    c.execute("""
+    DELETE FROM near_dup_buckets
+    WHERE id IN (SELECT id FROM near_dup_signatures WHERE processed_at < ?)
+    """, (cutoff_date,))
+    c.execute("""
+    DELETE FROM near_dup_signatures
+    WHERE processed_at < ?
+    """, (cutoff_date,))
+
     conn.commit()
     conn.close()
 
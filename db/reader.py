@@ -11,6 +11,12 @@ DB_PATH = config["database"]["path"]
 # Initialize shared read-only connection with WAL mode
 _conn = None
 
+# Optional in-memory copy of history IDs (see load_history_cache)
+_history_cache = None
+
+# Stay below SQLite's default limit on bound parameters per statement
+MAX_SQL_VARIABLES = 900
+
 def _get_connection():
     global _conn
     if _conn is None:
@@ -20,8 +26,45 @@ def _get_connection():
         _conn.execute("PRAGMA journal_mode=WAL;")
     return _conn
 
+def load_history_cache() -> int:
+    """Load all history IDs into memory so dedup checks no longer hit SQLite."""
+    global _history_cache
+    conn = _get_connection()
+    try:
+        rows = conn.execute("SELECT id FROM history").fetchall()
+    except sqlite3.Error as e:
+        print(f"[SQLite load_history_cache Error] {e}")
+        return 0
+    _history_cache = {row[0] for row in rows}
+    return len(_history_cache)
+
+def remember_processed(post_ids):
+    """Keep the in-memory history cache in sync with newly inserted IDs."""
+    if _history_cache is not None:
+        _history_cache.update(post_ids)
+
+def get_processed_ids(post_ids) -> set:
+    """Return the subset of IDs already in history, using one query per chunk."""
+    ids = list(set(post_ids))
+    if _history_cache is not None:
+        return {post_id for post_id in ids if post_id in _history_cache}
+
+    conn = _get_connection()
+    processed = set()
+    try:
+        for start in range(0, len(ids), MAX_SQL_VARIABLES):
+            chunk = ids[start:start + MAX_SQL_VARIABLES]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = conn.execute(f"SELECT id FROM history WHERE id IN ({placeholders})", chunk).fetchall()
+            processed.update(row[0] for row in rows)
+    except sqlite3.Error as e:
+        print(f"[SQLite get_processed_ids Error] {e}")
+    return processed
+
 def is_already_processed(post_id: str) -> bool:
     """Check if a post or comment has already been processed."""
+    if _history_cache is not None:
+        return post_id in _history_cache
     conn = _get_connection()
     try:
         result = conn.execute("SELECT 1 FROM history WHERE id = ?", (post_id,)).fetchone()
@@ -30,6 +73,19 @@ def is_already_processed(post_id: str) -> bool:
         print(f"SQLite error during is_already_processed: {e}")
         return False
 
+def get_subreddit_cursors(subreddit: str) -> dict:
+    """Return the stored high-water marks for a subreddit, keyed by listing name."""
+    conn = _get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT listing, newest_fullname, newest_created_utc FROM subreddit_cursors
+            WHERE subreddit = ?
+        """, (subreddit.lower(),)).fetchall()
+        return {row["listing"]: dict(row) for row in rows}
+    except sqlite3.Error as e:
+        print(f"[SQLite get_subreddit_cursors Error] {e}")
+        return {}
+
 def get_top_posts_for_today(limit=10) -> list:
     today = datetime.now(UTC).date().isoformat()
     conn = _get_connection()
@@ -68,6 +124,34 @@ def get_posts_by_ids(post_ids: set, require_unprocessed: bool = False) -> list:
         print(f"[SQLite get_posts_by_ids Error] {e}")
         return []
 
+def get_high_potential_ids(run_id: str, score_threshold: float = 7.0) -> set:
+    """IDs scored by the given run's filter stage at or above the threshold (indexed lookup)."""
+    conn = _get_connection()
+    try:
+        rows = conn.execute(
+            "SELECT id FROM posts WHERE filter_run_id = ? AND weighted_score >= ?",
+            (run_id, score_threshold)
+        ).fetchall()
+        return {row[0] for row in rows}
+    except sqlite3.Error as e:
+        print(f"[SQLite get_high_potential_ids Error] {e}")
+        return set()
+
+def get_scored_posts(limit: int = 50_000) -> list:
+    """(title, body, relevance_score) of the most recent posts the LLM filter has scored."""
+    conn = _get_connection()
+    try:
+        rows = conn.execute("""
+            SELECT title, body, relevance_score FROM posts
+            WHERE relevance_score IS NOT NULL
+            ORDER BY created_utc DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+        return [tuple(row) for row in rows]
+    except sqlite3.Error as e:
+        print(f"[SQLite get_scored_posts Error] {e}")
+        return []
+
 def get_top_insights_from_today(limit=10) -> list:
     today = datetime.now(UTC).date().isoformat()
     conn = _get_connection()
@@ -81,3 +165,38 @@ def get_top_insights_from_today(limit=10) -> list:
     except sqlite3.Error as e:
         print(f"[SQLite get_top_insights_from_today Error] {e}")
         return []
+
+def find_near_duplicate_candidates(band_buckets: list[tuple[int, int]]) -> dict:
+    """Signatures of indexed items sharing at least one LSH (band, bucket) with the query."""
+    if not band_buckets:
+        return {}
+    conn = _get_connection()
+    conditions = " OR ".join("(b.band = ? AND b.bucket = ?)" for _ in band_buckets)
+    params = [value for pair in band_buckets for value in pair]
+    try:
+        rows = conn.execute(f"""
+            SELECT DISTINCT s.id, s.signature FROM near_dup_buckets b
+            JOIN near_dup_signatures s ON s.id = b.id
+            WHERE {conditions}
+        """, params).fetchall()
+        return {row[0]: row[1] for row in rows}
+    except sqlite3.Error as e:
+        print(f"[SQLite find_near_duplicate_candidates Error] {e}")
+        return {}
+
+def get_filter_scored_ids(post_ids) -> set:
+    """Return the subset of IDs that already carry LLM filter scores."""
+    ids = list(set(post_ids))
+    conn = _get_connection()
+    scored = set()
+    try:
+        for start in range(0, len(ids), MAX_SQL_VARIABLES):
+            chunk = ids[start:start + MAX_SQL_VARIABLES]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = conn.execute(
+                f"SELECT id FROM posts WHERE id IN ({placeholders}) AND relevance_score IS NOT NULL", chunk
+            ).fetchall()
+            scored.update(row[0] for row in rows)
+    except sqlite3.Error as e:
+        print(f"[SQLite get_filter_scored_ids Error] {e}")
+    return scored
@@ -10,6 +10,13 @@ log = setup_logger()
 config = get_config()
 DB_PATH = config["database"]["path"]
 
+def _add_missing_columns(c, table, columns):
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns:
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+            log.info(f"Added column {table}.{name}")
+
 def create_tables():
     """Create the SQLite tables if they don't exist."""
     ensure_directory_exists(os.path.dirname(DB_PATH))
@@ -39,9 +46,13 @@ def create_tables():
         type TEXT,  -- 'post' or 'comment',
         insight_processed INTEGER DEFAULT 0,
         pain_point TEXT,
-        potential_solution TEXT
+        potential_solution TEXT,
+        weighted_score REAL,
+        filter_run_id TEXT  -- run whose filter stage scored the post
     );
     """)
+    # Databases created before these columns existed
+    _add_missing_columns(c, "posts", [("weighted_score", "REAL"), ("filter_run_id", "TEXT")])
 
     c.execute("""
     CREATE TABLE IF NOT EXISTS history (
@@ -50,10 +61,56 @@ def create_tables():
     );
     """)
 
+    # Near-duplicate index: MinHash signature per item plus one LSH bucket row per band
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS near_dup_signatures (
+        id TEXT PRIMARY KEY,
+        signature BLOB,
+        processed_at TEXT
+    );
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS near_dup_buckets (
+        band INTEGER,
+        bucket INTEGER,
+        id TEXT
+    );
+    """)
+
+    # One row per (run, stage, subreddit, metric); subreddit is '' for stage-wide values
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS metrics (
+        run_id TEXT,
+        stage TEXT,
+        subreddit TEXT,
+        name TEXT,
+        value REAL,
+        recorded_at TEXT
+    );
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS subreddit_cursors (
+        subreddit TEXT,
+        listing TEXT,  -- 'top', 'hot' or 'new'
+        newest_fullname TEXT,
+        newest_created_utc REAL,
+        updated_at TEXT,
+        PRIMARY KEY (subreddit, listing)
+    );
+    """)
+
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_processed_at ON posts(processed_at);")
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_relevance ON posts(relevance_score);")
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_roi ON posts(roi_weight);")
     c.execute("CREATE INDEX IF NOT EXISTS idx_posts_subreddit ON posts(subreddit);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_weighted_score ON posts(weighted_score);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_filter_run ON posts(filter_run_id, weighted_score);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_run ON metrics(run_id);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_stage ON metrics(stage, name, recorded_at);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_near_dup_buckets ON near_dup_buckets(band, bucket);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_near_dup_buckets_id ON near_dup_buckets(id);")
 
     conn.commit()
     conn.close()
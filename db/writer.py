@@ -1,12 +1,16 @@
 import sqlite3
+import threading
 from config.config_loader import get_config
 from datetime import datetime, UTC
 from pathlib import Path
+from db.reader import remember_processed, get_processed_ids
 
 config = get_config()
 DB_PATH = config["database"]["path"]
+WRITE_BATCH_SIZE = config["database"].get("write_batch_size", 500)
 
 _conn = None
+_write_lock = threading.Lock()  # Serialises transactions on the shared connection
 
 def _get_connection():
     global _conn
@@ -17,59 +21,123 @@ def _get_connection():
         _conn.execute("PRAGMA journal_mode=WAL;")
     return _conn
 
+INSERT_POST_SQL = """
+    INSERT OR IGNORE INTO posts (
+        id, url, title,title_id, body, subreddit, created_utc, last_active,
+        processed_at, community_type, type
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_HISTORY_SQL = """
+    INSERT OR IGNORE INTO history (id, processed_at)
+    VALUES (?, ?)
+"""
+
+UPDATE_FILTER_SCORES_SQL = """
+    UPDATE posts SET
+        relevance_score = ?,
+        emotion_score = ?,
+        pain_score = ?,
+        weighted_score = ?,
+        filter_run_id = ?,
+        processed_at = ?
+    WHERE id = ?
+"""
+
+# Single-post update of the raw scores only; weighted_score and filter_run_id are left as they are
+UPDATE_FILTER_COLUMNS_SQL = """
+    UPDATE posts SET
+        relevance_score = ?,
+        emotion_score = ?,
+        pain_score = ?,
+        processed_at = ?
+    WHERE id = ?
+"""
+
+# Copy the filter scores of a near-duplicate's source; no filter_run_id, so copies never reach insight
+INHERIT_FILTER_SCORES_SQL = """
+    UPDATE posts SET
+        (relevance_score, emotion_score, pain_score, weighted_score) = (
+            SELECT relevance_score, emotion_score, pain_score, weighted_score FROM posts WHERE id = ?
+        ),
+        processed_at = ?
+    WHERE id = ? AND EXISTS (SELECT 1 FROM posts WHERE id = ? AND relevance_score IS NOT NULL)
+"""
+
+# Advance a subreddit listing's high-water mark; never moves it backwards
+UPSERT_CURSOR_SQL = """
+    INSERT INTO subreddit_cursors (subreddit, listing, newest_fullname, newest_created_utc, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(subreddit, listing) DO UPDATE SET
+        newest_fullname = excluded.newest_fullname,
+        newest_created_utc = excluded.newest_created_utc,
+        updated_at = excluded.updated_at
+    WHERE excluded.newest_created_utc > subreddit_cursors.newest_created_utc
+"""
+
+def _post_row(post: dict, community_type: str) -> tuple:
+    return (
+        post["id"],
+        post["url"],
+        post["title"],
+        post["title_id"],
+        post.get("body", ""),
+        post["subreddit"],
+        post["created_utc"],
+        post["created_utc"],
+        datetime.now(UTC).date().isoformat(),
+        community_type,
+        post.get("type", "post")
+    )
+
+def _filter_scores_row(post_id: str, scores: dict, weighted_score: float = None, run_id: str = None) -> tuple:
+    return (
+        scores.get("relevance_score"),
+        scores.get("emotional_intensity"),
+        scores.get("pain_point_clarity"),
+        weighted_score,
+        run_id,
+        datetime.now(UTC).date().isoformat(),
+        post_id
+    )
+
 def insert_post(post: dict, community_type: str = "primary"):
     conn = _get_connection()
     try:
-        conn.execute("""
-        INSERT OR IGNORE INTO posts (
-            id, url, title,title_id, body, subreddit, created_utc, last_active,
-            processed_at, community_type, type
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            post["id"],
-            post["url"],
-            post["title"],
-            post["title_id"],
-            post.get("body", ""),
-            post["subreddit"],
-            post["created_utc"],
-            post["created_utc"],
-            datetime.now(UTC).date().isoformat(),
-            community_type,
-            post.get("type", "post")
-        ))
-
-        conn.execute("""
-        INSERT OR IGNORE INTO history (id, processed_at)
-        VALUES (?, ?)
-        """, (
-            post["id"],
-            datetime.utcnow().isoformat()
-        ))
-
-        conn.commit()
+        with _write_lock:
+            conn.execute(INSERT_POST_SQL, _post_row(post, community_type))
+            conn.execute(INSERT_HISTORY_SQL, (post["id"], datetime.utcnow().isoformat()))
+            conn.commit()
+        remember_processed([post["id"]])
     except sqlite3.Error as e:
         print(f"[SQLite Insert Error] {e}")
 
+def _cursor_row(subreddit: str, listing: str, fullname: str, created_utc: float) -> tuple:
+    return (subreddit.lower(), listing, fullname, created_utc, datetime.utcnow().isoformat())
+
+def update_subreddit_cursor(subreddit: str, listing: str, fullname: str, created_utc: float):
+    """Advance a subreddit listing's high-water mark. Never moves it backwards."""
+    conn = _get_connection()
+    try:
+        with _write_lock:
+            conn.execute(UPSERT_CURSOR_SQL, _cursor_row(subreddit, listing, fullname, created_utc))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"[SQLite update_subreddit_cursor Error] {e}")
+
 def update_post_filter_scores(post_id: str, scores: dict):
     """Update filtering phase scores only (relevance, emotion, pain)."""
     conn = _get_connection()
     try:
-        conn.execute("""
-        UPDATE posts SET
-            relevance_score = ?,
-            emotion_score = ?,
-            pain_score = ?,
-            processed_at = ?
-        WHERE id = ?
-        """, (
-            scores.get("relevance_score"),
-            scores.get("emotional_intensity"),
-            scores.get("pain_point_clarity"),
-            datetime.now(UTC).date().isoformat(),
-            post_id
-        ))
-        conn.commit()
+        with _write_lock:
+            conn.execute(UPDATE_FILTER_COLUMNS_SQL, (
+                scores.get("relevance_score"),
+                scores.get("emotional_intensity"),
+                scores.get("pain_point_clarity"),
+                datetime.now(UTC).date().isoformat(),
+                post_id
+            ))
+            conn.commit()
     except sqlite3.Error as e:
         print(f"[SQLite update_post_filter_scores Error] {e}")
 
@@ -101,8 +169,9 @@ def update_post_insight(post_id: str, insight: dict):
         WHERE id = ?
     """
     try:
-        cursor.execute(query, values + [post_id])
-        conn.commit()
+        with _write_lock:
+            cursor.execute(query, values + [post_id])
+            conn.commit()
     except sqlite3.Error as e:
         print(f"[SQLite update_post_insight Error] {e}")
 def update_post_cluster(post_id: str, cluster: str):
@@ -129,8 +198,9 @@ def update_post_cluster(post_id: str, cluster: str):
         WHERE id = ?
     """
     try:
-        cursor.execute(query, values + [post_id])
-        conn.commit()
+        with _write_lock:
+            cursor.execute(query, values + [post_id])
+            conn.commit()
     except sqlite3.Error as e:
         print(f"[SQLite update_post_insight Error] {e}")
 
@@ -139,10 +209,152 @@ def mark_insight_processed(post_id: str):
     """Mark a post as having been processed for deep insight."""
     conn = _get_connection()
     try:
-        conn.execute("""
-        UPDATE posts SET insight_processed = 1
-        WHERE id = ?
-        """, (post_id,))
-        conn.commit()
+        with _write_lock:
+            conn.execute("""
+            UPDATE posts SET insight_processed = 1
+            WHERE id = ?
+            """, (post_id,))
+            conn.commit()
     except sqlite3.Error as e:
         print(f"[SQLite mark_insight_processed Error] {e}")
+
+
+# Bulk writers: one executemany per statement and one transaction per chunk
+# of `database.write_batch_size` rows, instead of a commit per row.
+
+def _write_in_chunks(rows: list, write_chunk, label: str, batch_size: int = None) -> int:
+    """Run `write_chunk(conn, chunk)` in its own transaction for each chunk of rows."""
+    conn = _get_connection()
+    size = batch_size or WRITE_BATCH_SIZE
+    written = 0
+    with _write_lock:
+        for start in range(0, len(rows), size):
+            chunk = rows[start:start + size]
+            try:
+                with conn:  # commits on success, rolls back the chunk on error
+                    write_chunk(conn, chunk)
+                written += len(chunk)
+            except sqlite3.Error as e:
+                print(f"[SQLite {label} Error] {e}")
+    return written
+
+def insert_posts(posts: list[dict], community_type: str = "primary", batch_size: int = None,
+                 cursors: list[tuple] = None) -> int:
+    """
+    Bulk version of insert_post. Returns the number of rows written.
+
+    `cursors` are (subreddit, listing, fullname, created_utc) high-water marks for the
+    listings these posts came from; they only advance once every post has been stored,
+    so a failed write never lets the next run skip past unstored posts.
+    """
+    def write_chunk(conn, chunk):
+        processed_at = datetime.utcnow().isoformat()
+        conn.executemany(INSERT_POST_SQL, [_post_row(post, community_type) for post in chunk])
+        conn.executemany(INSERT_HISTORY_SQL, [(post["id"], processed_at) for post in chunk])
+
+    written = _write_in_chunks(posts, write_chunk, "insert_posts", batch_size)
+    if written == len(posts):
+        remember_processed(post["id"] for post in posts)
+        if cursors:
+            _write_in_chunks(
+                [_cursor_row(*cursor) for cursor in cursors],
+                lambda conn, chunk: conn.executemany(UPSERT_CURSOR_SQL, chunk),
+                "update_subreddit_cursors"
+            )
+    else:
+        # Some chunks rolled back; keep the dedup cache to what actually landed
+        remember_processed(get_processed_ids(post["id"] for post in posts))
+    return written
+
+def update_posts_filter_scores(scored: list[tuple[str, dict, float]], run_id: str = None, batch_size: int = None) -> int:
+    """Store (post_id, scores, weighted_score) filter results, stamped with the run that scored them."""
+    def write_chunk(conn, chunk):
+        conn.executemany(UPDATE_FILTER_SCORES_SQL, [
+            _filter_scores_row(post_id, scores, weighted_score, run_id) for post_id, scores, weighted_score in chunk
+        ])
+
+    return _write_in_chunks(scored, write_chunk, "update_posts_filter_scores", batch_size)
+
+def update_posts_insight(insights: list[tuple[str, dict]], batch_size: int = None) -> int:
+    """Bulk version of update_post_insight for (post_id, insight) pairs. Null fields keep their value."""
+    rows = []
+    for post_id, insight in insights:
+        fields = (
+            insight.get("lead_type"),
+            ", ".join(insight["tags"]) if "tags" in insight else None,
+            insight.get("roi_weight"),
+            insight.get("pain_point"),
+            insight.get("potential_solution"),
+        )
+        if all(value is None for value in fields):
+            continue  # No valid fields to update
+        rows.append(fields + (post_id,))
+
+    def write_chunk(conn, chunk):
+        conn.executemany("""
+        UPDATE posts SET
+            lead_type = COALESCE(?, lead_type),
+            tags = COALESCE(?, tags),
+            roi_weight = COALESCE(?, roi_weight),
+            pain_point = COALESCE(?, pain_point),
+            potential_solution = COALESCE(?, potential_solution),
+            insight_processed = 1
+        WHERE id = ?
+        """, chunk)
+
+    return _write_in_chunks(rows, write_chunk, "update_posts_insight", batch_size)
+
+def update_posts_cluster(clusters: list[tuple[str, str]], batch_size: int = None) -> int:
+    """Bulk version of update_post_cluster for (post_id, cluster) pairs."""
+    rows = [(cluster, post_id) for post_id, cluster in clusters if cluster is not None]
+
+    def write_chunk(conn, chunk):
+        conn.executemany("UPDATE posts SET pain_point = ?, insight_processed = 1 WHERE id = ?", chunk)
+
+    return _write_in_chunks(rows, write_chunk, "update_posts_cluster", batch_size)
+
+def mark_insights_processed(post_ids: list[str], batch_size: int = None) -> int:
+    """Bulk version of mark_insight_processed."""
+    rows = [(post_id,) for post_id in post_ids]
+
+    def write_chunk(conn, chunk):
+        conn.executemany("UPDATE posts SET insight_processed = 1 WHERE id = ?", chunk)
+
+    return _write_in_chunks(rows, write_chunk, "mark_insights_processed", batch_size)
+
+
+def insert_near_dup_signatures(rows: list[tuple[str, bytes, list[tuple[int, int]]]], batch_size: int = None) -> int:
+    """Index (post_id, signature, [(band, bucket), ...]) rows for near-duplicate lookups."""
+    processed_at = datetime.now(UTC).isoformat()
+
+    def write_chunk(conn, chunk):
+        conn.executemany(
+            "INSERT OR IGNORE INTO near_dup_signatures (id, signature, processed_at) VALUES (?, ?, ?)",
+            [(post_id, signature, processed_at) for post_id, signature, _ in chunk]
+        )
+        conn.executemany(
+            "INSERT INTO near_dup_buckets (band, bucket, id) VALUES (?, ?, ?)",
+            [(band, bucket, post_id) for post_id, _, band_buckets in chunk for band, bucket in band_buckets]
+        )
+
+    return _write_in_chunks(rows, write_chunk, "insert_near_dup_signatures", batch_size)
+
+def inherit_filter_scores(pairs: list[tuple[str, str]], batch_size: int = None) -> int:
+    """Copy filter scores onto (duplicate_id, source_id) pairs whose source has been scored."""
+    today = datetime.now(UTC).date().isoformat()
+    rows = [(source_id, today, duplicate_id, source_id) for duplicate_id, source_id in pairs]
+
+    def write_chunk(conn, chunk):
+        conn.executemany(INHERIT_FILTER_SCORES_SQL, chunk)
+
+    return _write_in_chunks(rows, write_chunk, "inherit_filter_scores", batch_size)
+
+def insert_metrics(rows: list[tuple[str, str, str, str, float, str]], batch_size: int = None) -> int:
+    """Store (run_id, stage, subreddit, name, value, recorded_at) metric rows."""
+    def write_chunk(conn, chunk):
+        conn.executemany(
+            "INSERT INTO metrics (run_id, stage, subreddit, name, value, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            chunk
+        )
+
+    return _write_in_chunks(rows, write_chunk, "insert_metrics", batch_size)
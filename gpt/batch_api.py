@@ -1,18 +1,20 @@
 import json
+import math
 import uuid
 import time
 import os
-import openai
-import requests
 from config.config_loader import get_config
-from scheduler.cost_tracker import add_cost
-from utils.logger import setup_logger
-import os
+from scheduler.cost_tracker import track_api_usage, estimate_cost
+from gpt.response_cache import get_cached_responses, store_responses, prune_cache, get_cache_stats, CACHE_WRITE_BATCH
+from utils.logger import setup_logger, ProgressCounter
+from utils.metrics import record as record_metric, observe_latency
+from utils.helpers import record_token_usage, chars_per_token
 import asyncio
+import random
 import sys
+from collections import deque
 from datetime import datetime
-from volcenginesdkarkruntime import AsyncArk
-from tqdm.asyncio import tqdm 
+from utils.clients import create_async_ark
 log = setup_logger()
 config = get_config()
 
@@ -20,74 +22,454 @@ BATCH_FILE_PATH = "data/batch_requests.jsonl"
 RESPONSE_DIR = "data/batch_responses"
 
 def generate_batch_payload(requests: list[dict], model: str) -> list[dict]:
-    """生成符合AsyncArk格式的请求列表"""
+    """
+    生成符合AsyncArk格式的请求列表
+
+    `estimated_tokens` is the builders' estimate of the post text (what cost calibration
+    compares against measured usage); `request_tokens` covers the whole prompt, rubric and
+    system prompt included, and is what the limiter's TPM window counts.
+    """
+    ratio = chars_per_token(model)
     return [{
         "custom_id": prompt.get("id", str(uuid.uuid4())),
         "model": model,
         "messages": prompt["messages"],
         "temperature": 0,
-        "thinking": {"type": "disabled"}
+        "thinking": {"type": "disabled"},
+        "estimated_tokens": prompt.get("meta", {}).get("estimated_tokens", 300),
+        "request_tokens": math.ceil(sum(len(message.get("content") or "") for message in prompt["messages"]) / ratio),
+        "answers": expected_answers(prompt)
     } for prompt in requests]
+
+def expected_answers(item: dict) -> int:
+    """Answers one request produces: a packed filter request scores each of its meta.posts."""
+    return len(item.get("meta", {}).get("posts") or [item])
+
+def is_throttle_error(error: Exception) -> bool:
+    """True for 429s and timeouts, the signals the concurrency limiter backs off on."""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    if getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "timed out" in message or "timeout" in message
+
+class ResultStreamWriter:
+    """Append-only JSONL writer that flushes every record and fsyncs periodically."""
+
+    def __init__(self, path: str, fsync_every: int = None, fsync_seconds: float = None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every or config["openai"].get("result_fsync_every", 50)
+        self.fsync_seconds = fsync_seconds or config["openai"].get("result_fsync_seconds", 5)
+        self._file = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.written = 0
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.written += 1
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_seconds:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+def is_retryable_error(error: Exception) -> bool:
+    """Throttling, timeouts, server and network errors are retried; other 4xx are not."""
+    if is_throttle_error(error):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is None or status == 409 or status >= 500
+
+def common_prefix(requests: list[dict]) -> list[dict]:
+    """Leading messages shared by every request of a batch; each request keeps at least one of its own."""
+    prefix = requests[0]["messages"]
+    for req in requests:
+        shared = 0
+        for ours, theirs in zip(prefix, req["messages"]):
+            if ours != theirs:
+                break
+            shared += 1
+        prefix = prefix[:min(shared, len(req["messages"]) - 1)]
+        if not prefix:
+            break
+    return prefix
+
+async def create_prefix_context(client, model: str, prefix: list[dict]) -> str | None:
+    """Register a batch's shared prefix with Ark's context cache; None if the endpoint does not support it."""
+    try:
+        context = await client.context.create(
+            model=model,
+            messages=prefix,
+            mode="common_prefix",
+            ttl=config["openai"].get("context_cache_ttl", 3600)
+        )
+    except Exception as e:
+        log.warning(f"Context cache unavailable for {model} ({e}); sending plain requests")
+        return None
+    log.info(f"Cached a {len(prefix)}-message prompt prefix for {model} as context {context.id}")
+    return context.id
+
+def retry_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for a request's next attempt."""
+    base = config["openai"].get("request_retry_base_delay", 2)
+    cap = config["openai"].get("request_retry_max_delay", 120)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limiter for Ark requests.
+
+    Concurrency starts at `initial` and grows by one after a full window of
+    successes whose latency stays within `latency_tolerance` x the best latency
+    seen. It halves on a 429 or timeout, at most once per observed latency.
+    Independently, requests and estimated tokens are held under the endpoint's
+    RPM/TPM budget over a sliding 60-second window.
+    """
+
+    def __init__(self, rpm: int, tpm: int, initial: int, minimum: int = 1, maximum: int = 256,
+                 latency_tolerance: float = 1.5):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+
+        self._in_flight = 0
+        self._window = deque()  # (timestamp, estimated tokens) of requests started in the last 60s
+        self._window_tokens = 0
+        self._condition = asyncio.Condition()
+        self._successes_since_increase = 0
+        self._best_latency = None
+        self._last_decrease = 0.0
+
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.throttled = 0
+        self.tokens = 0
+        self.peak_limit = int(self.limit)
+        self.latencies = []
+
+    def _expire_window(self, now):
+        while self._window and now - self._window[0][0] >= 60:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _budget_wait(self, estimated_tokens, now) -> float:
+        """Seconds until the RPM/TPM window has room for this request (0 if it fits now)."""
+        self._expire_window(now)
+        if not self._window:
+            return 0.0
+        over_rpm = self.rpm and len(self._window) >= self.rpm
+        over_tpm = self.tpm and self._window_tokens + estimated_tokens > self.tpm
+        if not over_rpm and not over_tpm:
+            return 0.0
+        return max(0.01, 60 - (now - self._window[0][0]))
+
+    async def acquire(self, estimated_tokens: int = 0):
+        async with self._condition:
+            while True:
+                if self._in_flight < int(self.limit):
+                    wait_time = self._budget_wait(estimated_tokens, time.monotonic())
+                    if wait_time <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=wait_time)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._condition.wait()
+            self._in_flight += 1
+            self._window.append((time.monotonic(), estimated_tokens))
+            self._window_tokens += estimated_tokens
+
+    async def release(self, latency: float, throttled: bool = False, tokens: int = 0):
+        async with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttled += 1
+                # One multiplicative decrease per latency period, not per failed request
+                if now - self._last_decrease > (self._best_latency or latency):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+                    self._successes_since_increase = 0
+                    log.info(f"Throttled by Ark; concurrency reduced to {int(self.limit)}")
+            else:
+                self.completed += 1
+                self.tokens += tokens
+                self.latencies.append(latency)
+                if self._best_latency is None or latency < self._best_latency:
+                    self._best_latency = latency
+                if latency <= self._best_latency * self.latency_tolerance:
+                    self._successes_since_increase += 1
+                    if self._successes_since_increase >= int(self.limit) and self.limit < self.maximum:
+                        self.limit += 1
+                        self.peak_limit = max(self.peak_limit, int(self.limit))
+                        self._successes_since_increase = 0
+            self._condition.notify_all()
+
+    def stats(self, since: dict = None) -> dict:
+        """Throughput since the limiter was built, or since an earlier stats() snapshot when it is shared."""
+        since = since or {"completed": 0, "throttled": 0, "tokens": 0, "elapsed_seconds": 0}
+        elapsed = max(time.monotonic() - self.started_at - since["elapsed_seconds"], 1e-6)
+        completed = self.completed - since["completed"]
+        tokens = self.tokens - since["tokens"]
+        return {
+            "completed": completed,
+            "throttled": self.throttled - since["throttled"],
+            "tokens": tokens,
+            "elapsed_seconds": round(elapsed, 2),
+            "requests_per_minute": round(completed / elapsed * 60, 1),
+            "tokens_per_minute": round(tokens / elapsed * 60, 1),
+            "final_concurrency": int(self.limit),
+            "peak_concurrency": self.peak_limit,
+        }
+
+def create_concurrency_limiter() -> AdaptiveConcurrencyLimiter:
+    """Build a limiter from the openai.* RPM/TPM and concurrency settings."""
+    openai_config = config["openai"]
+    return AdaptiveConcurrencyLimiter(
+        rpm=openai_config.get("rpm_limit", 1000),
+        tpm=openai_config.get("tpm_limit", 1_000_000),
+        initial=openai_config.get("initial_concurrency", 16),
+        minimum=openai_config.get("min_concurrency", 1),
+        maximum=openai_config.get("max_concurrency", 256),
+    )
+
+def create_batch_client():
+    """AsyncArk client for batch requests; long-running stages build one and share it across batches."""
+    return create_async_ark(timeout=24 * 3600)
 async def process_batch_async(
     requests: list[dict], 
     model: str, 
-    max_workers: int = 1000
+    max_workers: int = None,
+    use_cache: bool = None,
+    result_path: str = None,
+    stage: str = "other",
+    client=None,
+    limiter: AdaptiveConcurrencyLimiter = None
 ) -> tuple[list[dict], list[dict]]:
-    #使用AsyncArk worker队列处理批量请求"
-    client = AsyncArk(
-        api_key=os.getenv("ARK_API_KEY"),
-        timeout=24 * 3600
-    )
-    request_queue = asyncio.Queue()
+    """
+    使用AsyncArk worker队列处理批量请求。
+    If `result_path` is given, each result is appended to it as soon as it completes,
+    so an interrupted batch keeps everything already paid for.
+    The usage blocks of the answered requests are recorded in cost_tracker under `stage`.
+    A stage that submits many batches passes its own `client` and `limiter` so the
+    connection pool and the learned concurrency carry over from one batch to the next.
+    """
+    if use_cache is None:
+        use_cache = config["openai"].get("cache_input", False)
+    writer = ResultStreamWriter(result_path) if result_path else None
+    try:
+        return await _run_batch(requests, model, max_workers, use_cache, writer, stage, client, limiter)
+    finally:
+        if writer:
+            writer.close()
+
+async def _run_batch(requests, model, max_workers, use_cache, writer, stage, client, limiter) -> tuple[list[dict], list[dict]]:
+    loop = asyncio.get_running_loop()
     results = []
+
+    def add_result(record: dict):
+        results.append(record)
+        if writer:
+            writer.write(record)
+
+    if use_cache:
+        # Serve identical prompts from the local response cache
+        pending = []
+        cached_responses = await loop.run_in_executor(None, get_cached_responses, model, requests)
+        for req in requests:
+            cached = cached_responses.get(req["custom_id"])
+            if cached is None:
+                pending.append(req)
+            else:
+                add_result({"custom_id": req["custom_id"], "response": cached, "cached": True})
+        if results:
+            log.info(f"LLM cache: {len(results)}/{len(requests)} requests served from cache")
+            record_metric(stage, "llm_cache_hits", len(results))
+        requests = pending
+        if not requests:
+            return results, []
+
+    owns_client = client is None
+    client = client or create_batch_client()
+    limiter = limiter or create_concurrency_limiter()
+    limiter_before = limiter.stats()
+    request_queue = asyncio.Queue()
     errors = []
     total_tasks = len(requests)
-    # 初始化进度条
-    # pbar = tqdm(total=total_tasks, desc=f"Processing {model} batch", unit="task")
+    request_timeout = config["openai"].get("request_timeout_seconds", 300)
+    max_retries = config["openai"].get("request_max_retries", 5)
+    retried = 0
+    measured_chars = measured_prompt_tokens = 0  # Calibration sample for fast token estimation
+    usage_totals = {"requests": 0, "answers": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0, "estimated_input_tokens": 0}
+    context = {"id": None, "prefix_length": 0}
+    if config["openai"].get("context_cache", False):
+        prefix = common_prefix(requests)
+        if prefix:
+            context["id"] = await create_prefix_context(client, model, prefix)
+            context["prefix_length"] = len(prefix)
+    to_cache = []  # Answered responses waiting for the next cache write
+    retry_tasks = set()  # Strong references so pending retries are not garbage collected
+    # Enough worker tasks for the limiter's ceiling; the limiter decides how many run at once
+    max_workers = min(max_workers or limiter.maximum, max(1, total_tasks))
+    # 进度按时间间隔汇总成一行日志，而不是每个请求打印一次
+    progress = ProgressCounter(f"{stage} batch on {model}", total=total_tasks)
 
     # 填充请求队列
     for req in requests:
-        await request_queue.put((req["custom_id"], req))
+        await request_queue.put((req["custom_id"], req, 0))
+
+    async def requeue_later(item, delay):
+        # The failed attempt stays unfinished until its retry is queued, so join() keeps waiting
+        await asyncio.sleep(delay)
+        await request_queue.put(item)
+        request_queue.task_done()
 
     # 定义worker协程
     async def worker(worker_id: int):
-        nonlocal results, errors
+        nonlocal results, errors, retried, measured_chars, measured_prompt_tokens
         while True:
+            # Taken outside the try: a worker cancelled while idle has no task to mark done
+            custom_id, req, attempt = await request_queue.get()
+            requeued = False
+            context_id = None
             try:
-                custom_id, req = await request_queue.get()
-                response = await client.chat.completions.create(
-                    model=model,
-                    messages=req["messages"],
-                    temperature=req["temperature"],
-                    thinking=req["thinking"]
-                )
-                print(custom_id)
-                results.append({
+                await limiter.acquire(req.get("request_tokens", req.get("estimated_tokens", 0)))
+                started = time.monotonic()
+                context_id = context["id"]
+                try:
+                    if context_id:
+                        # Only the request's own messages are sent; the prefix is served from the context cache
+                        call = client.context.completions.create(
+                            context_id=context_id,
+                            model=model,
+                            messages=req["messages"][context["prefix_length"]:],
+                            temperature=req["temperature"],
+                            extra_body={"thinking": req["thinking"]}
+                        )
+                    else:
+                        call = client.chat.completions.create(
+                            model=model,
+                            messages=req["messages"],
+                            temperature=req["temperature"],
+                            thinking=req["thinking"]
+                        )
+                    response = await asyncio.wait_for(call, timeout=request_timeout)
+                except Exception as e:
+                    throttled = is_throttle_error(e)
+                    await limiter.release(time.monotonic() - started, throttled=throttled)
+                    if context_id and not throttled and context["id"] == context_id:
+                        # Expired or rejected context: finish the batch with plain requests
+                        log.warning(f"Context request failed ({e}); falling back to plain requests")
+                        context["id"] = None
+                    raise
+                response_dict = response.dict()
+                usage = response_dict.get("usage") or {}
+                observe_latency(stage, time.monotonic() - started)
+                await limiter.release(time.monotonic() - started, tokens=usage.get("total_tokens", 0))
+                usage_totals["requests"] += 1
+                usage_totals["answers"] += req.get("answers", 1)
+                usage_totals["input_tokens"] += usage.get("prompt_tokens", 0)
+                usage_totals["cached_input_tokens"] += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+                usage_totals["output_tokens"] += usage.get("completion_tokens", 0)
+                usage_totals["estimated_input_tokens"] += req.get("estimated_tokens", 0)
+                if usage.get("prompt_tokens"):
+                    measured_chars += sum(len(message.get("content") or "") for message in req["messages"])
+                    measured_prompt_tokens += usage["prompt_tokens"]
+                add_result({
                     "custom_id": custom_id,
-                    "response": response.dict()
+                    "response": response_dict
                 })
-                # pbar.update(1)
-                # pbar.set_postfix_str(f"Completed: {len(results)}/{total_tasks}")
+                if use_cache:
+                    to_cache.append((req["messages"], req["temperature"], response_dict))
+                    if len(to_cache) >= CACHE_WRITE_BATCH:
+                        entries = to_cache[:]
+                        to_cache.clear()
+                        await loop.run_in_executor(None, store_responses, model, entries)
+                progress.add("processed")
             except Exception as e:
+                fell_back = context_id is not None and context["id"] is None
+                if attempt < max_retries and (is_retryable_error(e) or fell_back):
+                    delay = retry_delay(attempt)
+                    progress.add("retried", note=f"{custom_id}: {e}")
+                    retried += 1
+                    requeued = True
+                    task = asyncio.create_task(requeue_later((custom_id, req, attempt + 1), delay))
+                    retry_tasks.add(task)
+                    task.add_done_callback(retry_tasks.discard)
+                    continue
                 errors.append({
                     "custom_id": custom_id,
                     "error": str(e)
                 })
-                log.error(f"Worker {worker_id} failed: {str(e)}")
-                # pbar.update(1)  # 即使出错也更新进度
+                log.error(f"Worker {worker_id} failed on {custom_id} after {attempt + 1} attempts: {str(e)}")
+                progress.add("failed")
             finally:
-                request_queue.task_done()
+                if not requeued:
+                    request_queue.task_done()
 
     # 创建并启动worker
     workers = [asyncio.create_task(worker(i)) for i in range(max_workers)]
-    await request_queue.join()
+    try:
+        await request_queue.join()
+    finally:
+        # 取消worker任务 (also when the batch itself is cancelled, e.g. Ctrl-C)
+        progress.flush()
+        for worker_task in workers:
+            worker_task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await loop.run_in_executor(None, store_responses, model, to_cache)
+        if usage_totals["requests"]:
+            # Answered requests are paid for even when the batch is interrupted; keep the ledger complete
+            await loop.run_in_executor(None, lambda: track_api_usage(
+                usage_totals["input_tokens"], usage_totals["output_tokens"], model, stage=stage,
+                requests=usage_totals["answers"], estimated_input_tokens=usage_totals["estimated_input_tokens"],
+                cached_input_tokens=usage_totals["cached_input_tokens"]
+            ))
+        if owns_client:
+            await client.close()
+
+    stats = limiter.stats(since=limiter_before)
+    log.info(
+        f"Batch throughput for {model}: {stats['completed']} requests in {stats['elapsed_seconds']}s "
+        f"({stats['requests_per_minute']} req/min, {stats['tokens_per_minute']} tokens/min), "
+        f"concurrency {stats['final_concurrency']} (peak {stats['peak_concurrency']}), {stats['throttled']} throttled, "
+        f"{retried} retries, {len(errors)} failed"
+    )
+    record_token_usage(model, measured_chars, measured_prompt_tokens)
+    record_metric(stage, "llm_requests", usage_totals["requests"])
+    record_metric(stage, "llm_retries", retried)
+    record_metric(stage, "llm_errors", len(errors))
+    record_metric(stage, "llm_throttled", stats["throttled"])
+    for name in ("input_tokens", "cached_input_tokens", "output_tokens"):
+        record_metric(stage, name, usage_totals[name])
+    if usage_totals["input_tokens"]:
+        log.info(
+            f"Prompt cache for {stage} on {model}: {usage_totals['cached_input_tokens']} cached / "
+            f"{usage_totals['input_tokens'] - usage_totals['cached_input_tokens']} uncached input tokens "
+            f"({usage_totals['cached_input_tokens'] / usage_totals['input_tokens']:.0%} cached)"
+        )
 
-    # 取消worker任务
-    # pbar.close()
-    for worker_task in workers:
-        worker_task.cancel()
-    await asyncio.gather(*workers, return_exceptions=True)
-    await client.close()
+    if use_cache:
+        await loop.run_in_executor(None, prune_cache)
+        stats = get_cache_stats()
+        log.info(f"LLM cache totals: {stats['hits']} hits, {stats['misses']} misses, {stats['writes']} writes")
 
     return results, errors
 
@@ -100,26 +482,14 @@ def download_batch_results(results: list[dict], save_path: str):
             f.write(json.dumps(result) + "\n")
     log.info(f"Saved {len(results)} results to {save_path}")
 
-def add_estimated_batch_cost(requests: list[dict], model: str):
-    """Estimate and record the cost of the batch job using accurate pricing."""
-    # Per 1M token pricing in USD
-    pricing = {
-        "gpt-4.1": {"input": 0.0020, "output": 0.0080},
-        "gpt-4.1-mini": {"input": 0.0004, "output": 0.0016},
-        "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
-    }
-
-    discount_factor = 0.5  # 50% discount for batch jobs
-
-    # Default fallback pricing
-    model_pricing = pricing.get(model, {"input": 0.0010, "output": 0.0010})
+def add_estimated_batch_cost(requests: list[dict], model: str) -> float:
+    """
+    Log the predicted cost of a batch before it is submitted.
 
+    Nothing is charged here: the real spend is recorded from each response's usage
+    block once the batch has run.
+    """
     input_tokens = sum(req.get("meta", {}).get("estimated_tokens", 300) for req in requests)
-    output_tokens = len(requests) * 300  # Assumes ~300 output tokens per completion
-
-    input_cost = (input_tokens / 200_000) * model_pricing["input"] * discount_factor
-    output_cost = (output_tokens / 500_000) * model_pricing["output"] * discount_factor
-    estimated_cost = input_cost + output_cost
-
+    estimated_cost = estimate_cost(input_tokens, sum(expected_answers(req) for req in requests), model)
     log.info(f"Estimated cost for batch (input + output): ${estimated_cost:.4f}")
-    add_cost(estimated_cost)
+    return estimated_cost
@@ -1,10 +1,13 @@
 # gpt/filters.py
 
 import os
+import json
+import uuid
 from typing import List, Dict
-from utils.helpers import estimate_tokens, sanitize_text
+from utils.helpers import estimate_tokens_batch, sanitize_text
 from utils.logger import setup_logger
 from config.config_loader import get_config
+from scheduler.cost_tracker import estimate_cost
 
 log = setup_logger()
 config = get_config()
@@ -30,18 +33,148 @@ def load_filter_prompt_template():
 
 FILTER_PROMPT_TEMPLATE = load_filter_prompt_template()
 
+PROMPT_LAYOUT = config["openai"].get("prompt_layout", "post_first")
+FILTER_SYSTEM_PROMPT = "You are a marketing assistant scoring Reddit posts for product relevance."
+
+FILTER_PACK_SIZE = config["openai"].get("filter_pack_size", 1)
+FILTER_PACK_MAX_TOKENS = config["openai"].get("filter_pack_max_tokens", 6000)
+PACK_ID_PREFIX = "pack_"
+PACKED_FILTER_INSTRUCTIONS = (
+    "You will receive several Reddit posts, each introduced by a line '### Post ID: <id>'. "
+    "Score every post independently using the instructions above. "
+    "Respond with only a JSON array (without \"```json\") containing one object per post, in the same order; "
+    "each object has an \"id\" field with the post ID plus the fields described above."
+)
+
 # 不止是Post tile 和 Post body,还需要把原文加上
 def build_filter_prompt(post: dict) -> List[Dict]:
-    """Constructs the GPT-4.1 Mini prompt for a Reddit post using template."""
+    """
+    Constructs the GPT-4.1 Mini prompt for a Reddit post using template.
+
+    With `prompt_layout: static_first` the instructions come first, as an identical
+    prefix for every post that provider-side prefix/context caches can reuse.
+    """
+    post_text = f"Post title: {post['title']}\nPost body: {post['body']}"
+    if PROMPT_LAYOUT == "static_first":
+        return [
+            {"role": "system", "content": f"{FILTER_SYSTEM_PROMPT}\n\n{FILTER_PROMPT_TEMPLATE}"},
+            {"role": "user", "content": post_text}
+        ]
+    return [
+        {"role": "system", "content": FILTER_SYSTEM_PROMPT},
+        {"role": "user", "content": f"{post_text}\n\n{FILTER_PROMPT_TEMPLATE}"}
+    ]
+
+
+def build_packed_filter_prompt(posts: List[dict]) -> List[Dict]:
+    """Prompt scoring several posts in one request; the rubric is sent once per pack."""
+    posts_text = "\n\n".join(
+        f"### Post ID: {post['id']}\nPost title: {post['title']}\nPost body: {post['body']}" for post in posts
+    )
     return [
-        {"role": "system", "content": "You are a marketing assistant scoring Reddit posts for product relevance."},
-        {"role": "user", "content": f"Post title: {post['title']}\nPost body: {post['body']}\n\n{FILTER_PROMPT_TEMPLATE}"}
+        {"role": "system", "content": f"{FILTER_SYSTEM_PROMPT}\n\n{FILTER_PROMPT_TEMPLATE}\n\n{PACKED_FILTER_INSTRUCTIONS}"},
+        {"role": "user", "content": posts_text}
     ]
 
 
-def prepare_batch_payload(posts: List[dict]) -> List[Dict]:
-    """Returns list of payloads for batch submission."""
+def pack_filter_payload(cleaned: list, token_counts: list, pack_size: int) -> List[Dict]:
+    """Group posts into packed requests of up to `pack_size` posts and filter_pack_max_tokens tokens."""
     payload = []
+    group, group_tokens = [], 0
+
+    def flush():
+        if not group:
+            return
+        if len(group) == 1:
+            # A pack of one gets the single-post prompt, whose bare-object answer needs no ID matching
+            post_id, title, body = group[0]
+            payload.append({
+                "id": post_id,
+                "messages": build_filter_prompt({"title": title, "body": body}),
+                "meta": {"estimated_tokens": group_tokens}
+            })
+            return
+        posts = [{"id": post_id, "title": title, "body": body} for post_id, title, body in group]
+        payload.append({
+            "id": PACK_ID_PREFIX + uuid.uuid4().hex[:12],
+            "messages": build_packed_filter_prompt(posts),
+            "meta": {
+                "estimated_tokens": group_tokens,
+                "posts": posts  # Lets the runner re-send posts a packed response left out
+            }
+        })
+
+    for post, tokens in zip(cleaned, token_counts):
+        if group and (len(group) >= pack_size or group_tokens + tokens > FILTER_PACK_MAX_TOKENS):
+            flush()
+            group, group_tokens = [], 0
+        group.append(post)
+        group_tokens += tokens
+    flush()
+    return payload
+
+
+def _parse_json_content(content: str):
+    """Parse model output that may be wrapped in ```json fences or surrounded by prose."""
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("\n") + 1:] if text.lower().startswith("json") else text
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start = min((i for i in (text.find("["), text.find("{")) if i >= 0), default=-1)
+        end = max(text.rfind("]"), text.rfind("}"))
+        if start < 0 or end < start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+def unpack_filter_response(result: dict, pack_ids=None) -> Dict[str, dict]:
+    """
+    Map post ID -> scores for one filter result record, packed or single.
+
+    Packed answers are matched by their "id" field (a bare object with an "id" counts
+    as a one-element array); entries without a usable ID or that are not objects are
+    dropped, so the caller can re-send those posts. With `pack_ids` (the IDs of the
+    posts the pack was sent with) any other ID the model returned is dropped as well,
+    so a made-up ID can never score an unrelated post.
+    """
+    post_id = result["custom_id"]
+    content = result["response"]["choices"][0]["message"]["content"]
+    if not post_id.startswith(PACK_ID_PREFIX):
+        return {post_id: json.loads(content)}
+
+    parsed = _parse_json_content(content)
+    if isinstance(parsed, dict) and parsed.get("id") is not None:
+        parsed = [parsed]  # a single scores object instead of a one-element array
+    if isinstance(parsed, dict):
+        # Tolerate {"results": [...]} and {"<post id>": {...}} shapes
+        items = next((value for value in parsed.values() if isinstance(value, list)), None)
+        if items is None:
+            items = [dict(scores, id=key) for key, scores in parsed.items() if isinstance(scores, dict)]
+        parsed = items
+    unpacked = {}
+    for item in parsed if isinstance(parsed, list) else []:
+        if isinstance(item, dict) and item.get("id") is not None:
+            unpacked[str(item["id"]).strip()] = item
+    if pack_ids is not None:
+        foreign = unpacked.keys() - set(pack_ids)
+        if foreign:
+            log.warning(f"Packed filter response {post_id} answered for posts outside its pack, dropped: {sorted(foreign)}")
+            unpacked = {key: scores for key, scores in unpacked.items() if key not in foreign}
+    return unpacked
+
+
+def prepare_batch_payload(posts: List[dict], pack_size: int = None) -> List[Dict]:
+    """
+    Returns list of payloads for batch submission.
+
+    With `pack_size` (default openai.filter_pack_size) above 1, posts are packed
+    several to a request; see pack_filter_payload.
+    """
+    pack_size = pack_size or FILTER_PACK_SIZE
+    cleaned = []
     for post in posts:
         raw_title = post.get("title", "")
         raw_body = post.get("body", "")
@@ -50,30 +183,35 @@ def prepare_batch_payload(posts: List[dict]) -> List[Dict]:
 
         if not title or not body:
             continue  # skip malformed posts
+        cleaned.append((post["id"], title, body))
+
+    token_counts = estimate_tokens_batch(
+        [title + body for _, title, body in cleaned],
+        config["openai"].get("model_filter", "gpt-4o-mini")
+    )
+    if pack_size > 1:
+        return pack_filter_payload(cleaned, token_counts, pack_size)
 
+    payload = []
+    for (post_id, title, body), tokens in zip(cleaned, token_counts):
         messages = build_filter_prompt({"title": title, "body": body})
         payload.append({
-            "id": post["id"],
+            "id": post_id,
             "messages": messages,
             "meta": {
-                "estimated_tokens": estimate_tokens(title + body, config["openai"].get("model_filter", "gpt-4o-mini"))
+                "estimated_tokens": tokens
             }
         })
     return payload
 
 
-def estimate_batch_cost(posts: List[dict], model: str = "gpt-4o-mini", avg_tokens: int = 300) -> float:
-    """
-    Estimate cost of a filtering batch using actual model pricing.
+def estimate_batch_cost(batch: List[dict], model: str = None) -> float:
     """
-    pricing = {
-        "gpt-4.1": {"input": 0.0010},
-        "gpt-4.1-mini": {"input": 0.0002},
-        "gpt-4o-mini": {"input": 0.000075},
-    }
+    Estimate cost of a filtering batch from its prepared payload.
 
-    model_pricing = pricing.get(model, {"input": 0.0005})  # default fallback
-    total_tokens = len(posts) * avg_tokens
-    input_cost_per_1k = model_pricing["input"]
-
-    return (total_tokens / 1000) * input_cost_per_1k
\ No newline at end of file
+    Uses the configured model pricing, calibrated against measured usage.
+    """
+    model = model or config["openai"]["model_filter"]
+    input_tokens = sum(item.get("meta", {}).get("estimated_tokens", 300) for item in batch)
+    answers = sum(len(item.get("meta", {}).get("posts") or [item]) for item in batch)  # one per packed post
+    return estimate_cost(input_tokens, answers, model)
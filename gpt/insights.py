@@ -1,25 +1,16 @@
 # gpt/insights.py
 
-import os
 from typing import List, Dict, Any
 
-from utils.helpers import estimate_tokens, sanitize_text
+from utils.helpers import estimate_tokens_batch, sanitize_text
 from utils.logger import setup_logger
 from config.config_loader import get_config
-# Ark OpenAI compatible client
-from openai import OpenAI
-from volcenginesdkarkruntime import Ark
-
+from scheduler.cost_tracker import estimate_cost
 
 log = setup_logger()
 config = get_config()
 PROMPT_PATH = "gpt/prompts/insight_prompt.txt"
 CLUSTER_PROMPT_PATH = "gpt/prompts/cluster_prompt.txt"
-# Initialize Ark OpenAI client
-client = Ark(
-    base_url="https://ark.cn-beijing.volces.com/api/v3",
-    api_key=os.environ.get("ARK_API_KEY"),
-)
 
 
 def load_insight_prompt_template() -> str:
@@ -43,16 +34,26 @@ def load_insight_prompt_template() -> str:
 INSIGHT_PROMPT_TEMPLATE = load_insight_prompt_template()
 
 
+PROMPT_LAYOUT = config["openai"].get("prompt_layout", "post_first")
+INSIGHT_SYSTEM_PROMPT = "You are a SaaS strategist extracting pain points and marketing tags from Reddit posts."
+
+
 def build_insight_prompt(post: dict) -> List[Dict[str, str]]:
-    """Constructs the GPT-4.1 prompt for extracting deeper insights using template."""
+    """Constructs the GPT-4.1 prompt for extracting deeper insights using template (see build_filter_prompt for layouts)."""
+    post_text = f"Post title: {post['title']}\nPost body: {post['body']}"
+    if PROMPT_LAYOUT == "static_first":
+        return [
+            {"role": "system", "content": f"{INSIGHT_SYSTEM_PROMPT}\n\n{INSIGHT_PROMPT_TEMPLATE}"},
+            {"role": "user", "content": post_text}
+        ]
     return [
         {
             "role": "system",
-            "content": "You are a SaaS strategist extracting pain points and marketing tags from Reddit posts."
+            "content": INSIGHT_SYSTEM_PROMPT
         },
         {
             "role": "user",
-            "content": f"Post title: {post['title']}\nPost body: {post['body']}\n\n{INSIGHT_PROMPT_TEMPLATE}"
+            "content": f"{post_text}\n\n{INSIGHT_PROMPT_TEMPLATE}"
         }
     ]
 
@@ -77,23 +78,31 @@ def load_cluster_prompt_template() -> str:
     
 CLUSTER_PROMPT_TEMPLATE = load_cluster_prompt_template()
 
+CLUSTER_SYSTEM_PROMPT = "You are a SaaS strategist specializing in clustering user pain points from Reddit posts."
+
 def build_cluster_prompt(cluster: dict) -> List[Dict[str, str]]:
     """Constructs the GPT-4.1 prompt for extracting deeper clusters using template."""
+    cluster_text = f"Post title: {cluster['title']}\nCollected pain points:\n{cluster['pain_points']}"
+    if PROMPT_LAYOUT == "static_first":
+        return [
+            {"role": "system", "content": f"{CLUSTER_SYSTEM_PROMPT}\n\n{CLUSTER_PROMPT_TEMPLATE}"},
+            {"role": "user", "content": cluster_text}
+        ]
     return [
         {
             "role": "system",
-            "content": "You are a SaaS strategist specializing in clustering user pain points from Reddit posts."
+            "content": CLUSTER_SYSTEM_PROMPT
         },
         {
             "role": "user",
-            "content": f"Post title: {cluster['title']}\nCollected pain points:\n{cluster['pain_points']}\n\n{CLUSTER_PROMPT_TEMPLATE}"
+            "content": f"{cluster_text}\n\n{CLUSTER_PROMPT_TEMPLATE}"
         }
     ]
 
 def prepare_insight_batch(posts: List[dict]) -> List[Dict[str, Any]]:
     """Prepares GPT-4.1 insight batch payload."""
     model = config["openai"].get("model_deep", "gpt-4.1")
-    payload = []
+    cleaned = []
 
     for post in posts:
         raw_title = post.get("title", "")
@@ -103,13 +112,17 @@ def prepare_insight_batch(posts: List[dict]) -> List[Dict[str, Any]]:
 
         if not title or not body:
             continue  # skip malformed posts
+        cleaned.append((post["id"], title, body))
 
+    token_counts = estimate_tokens_batch([title + body for _, title, body in cleaned], model)
+    payload = []
+    for (post_id, title, body), tokens in zip(cleaned, token_counts):
         messages = build_insight_prompt({"title": title, "body": body})
         payload.append({
-            "id": post["id"],
+            "id": post_id,
             "messages": messages,
             "meta": {
-                "estimated_tokens": estimate_tokens(title + body, model)
+                "estimated_tokens": tokens
             }
         })
     return payload
@@ -137,12 +150,19 @@ def prepare_cluster_batch(posts: List[dict]) -> List[Dict[str, Any]]:
 
     # Step 2: 为每个 title 构建聚合任务
     # 构建 payload
-    for title_id, data in grouped_posts.items():
+    merged = {
+        title_id: "\n- " + "\n- ".join(data["pain_points"])
+        for title_id, data in grouped_posts.items()
+    }
+    token_counts = estimate_tokens_batch(
+        [data["post_title"] + merged[title_id] for title_id, data in grouped_posts.items()], model
+    )
+    for (title_id, data), tokens in zip(grouped_posts.items(), token_counts):
         pain_points = data["pain_points"]
         post_title = data["post_title"]
         post_title_id = data["post_title_id"]
 
-        merged_pain_points = "\n- " + "\n- ".join(pain_points)
+        merged_pain_points = merged[title_id]
         messages = build_cluster_prompt({
             "title": post_title,
             "pain_points": merged_pain_points
@@ -152,7 +172,7 @@ def prepare_cluster_batch(posts: List[dict]) -> List[Dict[str, Any]]:
             "id": post_title_id,  # ✅ 用主 post 的 id
             "messages": messages,
             "meta": {
-                "estimated_tokens": estimate_tokens(title + merged_pain_points, model),
+                "estimated_tokens": tokens,
                 "title": post_title,
                 "title_id": post_title_id,
                 "num_pain_points": len(pain_points),
@@ -160,16 +180,8 @@ def prepare_cluster_batch(posts: List[dict]) -> List[Dict[str, Any]]:
         })
     return payload
 
-def estimate_insight_cost(batch: List[Dict]) -> float:
-    """Estimate GPT-4.1 cost using real input token metadata."""
-    cost_per_1k_input = 0.0020
-    cost_per_1k_output = 0.0080
-    discount = 0.05  # Batch API discount
-
+def estimate_insight_cost(batch: List[Dict], model: str = None) -> float:
+    """Estimate insight cost from the payload's token metadata, calibrated against measured usage."""
+    model = model or config["openai"]["model_deep"]
     input_tokens = sum(item.get("meta", {}).get("estimated_tokens", 700) for item in batch)
-    output_tokens = len(batch) * 300  # assume output tokens
-
-    return (
-        (input_tokens / 1_000_000 * cost_per_1k_input) +
-        (output_tokens / 1_000_000 * cost_per_1k_output)
-    ) * discount
+    return estimate_cost(input_tokens, len(batch), model)
@@ -0,0 +1,166 @@
+# gpt/near_duplicates.py
+
+import hashlib
+import math
+import random
+import re
+import struct
+from config.config_loader import get_config
+from db.reader import find_near_duplicate_candidates, get_filter_scored_ids
+from db.writer import insert_near_dup_signatures, inherit_filter_scores
+from utils.helpers import sanitize_text
+from utils.logger import setup_logger
+
+log = setup_logger()
+config = get_config()
+
+NEAR_DUP_CONFIG = config.get("near_duplicates", {})
+NUM_PERM = NEAR_DUP_CONFIG.get("num_perm", 64)
+BANDS = NEAR_DUP_CONFIG.get("bands", 16)
+ROWS_PER_BAND = NUM_PERM // BANDS
+THRESHOLD = NEAR_DUP_CONFIG.get("threshold", 0.8)
+SHINGLE_SIZE = NEAR_DUP_CONFIG.get("shingle_size", 5)
+MAX_WORDS = 2000  # 超长文本只取前面部分计算签名
+
+# Universal hashing (a * x + b) mod p; fixed seed so signatures stay comparable across runs
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_rng = random.Random(1337)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+_WORD_PATTERN = re.compile(r"\w+")
+_URL_PATTERN = re.compile(r"https?://\S+")
+_COMMENT_MARKER = "comment: '''"
+
+def dedup_text(post: dict) -> str:
+    """
+    Sanitized text a near-duplicate is judged on.
+
+    Comment chunks are compared on their own comments: every chunk of a thread repeats
+    the same `parent post:` / `post summary: '''...'''` header, which would otherwise
+    make them all look alike.
+    """
+    body = sanitize_text(post.get("body", ""))
+    if post.get("type") == "comment":
+        start = body.find(_COMMENT_MARKER)
+        return body[start:] if start >= 0 else body
+    return f"{sanitize_text(post.get('title', ''))}\n{body}"
+
+def shingles(text: str) -> set:
+    words = _WORD_PATTERN.findall(_URL_PATTERN.sub("", text.lower()))[:MAX_WORDS]
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash(text: str) -> tuple | None:
+    """MinHash signature of the text's word shingles, or None for empty text."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+        for shingle in shingles(text)
+    ]
+    if not hashes:
+        return None
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes) & _MAX_HASH
+        for a, b in _PERMUTATIONS
+    )
+
+def band_buckets(signature: tuple) -> list[tuple[int, int]]:
+    """One (band, bucket) key per LSH band; similar signatures collide in at least one band."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(struct.pack(f"<{len(rows)}I", *rows), digest_size=8).digest()
+        keys.append((band, int.from_bytes(digest, "little") >> 1))  # fits SQLite's signed INTEGER
+    return keys
+
+def pack_signature(signature: tuple) -> bytes:
+    return struct.pack(f"<{len(signature)}I", *signature)
+
+def unpack_signature(blob: bytes) -> tuple:
+    return struct.unpack(f"<{len(blob) // 4}I", blob)
+
+def similarity(left: tuple, right: tuple) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    if len(left) != len(right):
+        return 0.0
+    return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+def find_duplicate(signature: tuple, keys: list, batch_buckets: dict, batch_signatures: dict) -> str | None:
+    """Best match above the threshold among indexed items and earlier items of this batch."""
+    candidates = {post_id: unpack_signature(blob) for post_id, blob in find_near_duplicate_candidates(keys).items()}
+    for key in keys:
+        for post_id in batch_buckets.get(key, ()):
+            candidates[post_id] = batch_signatures[post_id]
+
+    best_id, best_similarity = None, THRESHOLD
+    for post_id, candidate in candidates.items():
+        score = similarity(signature, candidate)
+        if score >= best_similarity:
+            best_id, best_similarity = post_id, score
+    return best_id
+
+def remove_near_duplicates(posts: list, pack_size: int = 1) -> tuple[list, list, list]:
+    """
+    Drop near-duplicates of already-indexed or earlier items before the LLM filter.
+
+    Duplicates of scored items inherit the source's scores right away (action: inherit).
+    Returns (kept posts, deferred (duplicate post, source_id) pairs, signature rows of the
+    kept items). Nothing is indexed yet: pass the pairs and rows to settle_near_duplicates
+    once this run's filter results are stored.
+    """
+    if not NEAR_DUP_CONFIG.get("enabled", False) or not posts:
+        return posts, [], []
+
+    kept, duplicates, index_rows = [], [], []
+    batch_buckets, batch_signatures = {}, {}
+    for post in posts:
+        signature = minhash(dedup_text(post))
+        if signature is None:
+            kept.append(post)
+            continue
+
+        keys = band_buckets(signature)
+        source_id = find_duplicate(signature, keys, batch_buckets, batch_signatures)
+        if source_id is not None:
+            duplicates.append((post, source_id))
+            continue
+
+        kept.append(post)
+        index_rows.append((post["id"], pack_signature(signature), keys))
+        batch_signatures[post["id"]] = signature
+        for key in keys:
+            batch_buckets.setdefault(key, []).append(post["id"])
+
+    inherited, deferred = [], []
+    if duplicates and NEAR_DUP_CONFIG.get("action", "inherit") == "inherit":
+        scored_sources = get_filter_scored_ids(source_id for _, source_id in duplicates)
+        inherited = [(post["id"], source_id) for post, source_id in duplicates if source_id in scored_sources]
+        deferred = [(post, source_id) for post, source_id in duplicates if source_id not in scored_sources]
+        inherit_filter_scores(inherited)
+
+    saved_requests = math.ceil(len(duplicates) / max(1, pack_size))
+    log.info(
+        f"Near-duplicates: skipped {len(duplicates)}/{len(posts)} items "
+        f"({len(inherited)} inherited scores now, {len(deferred)} after this run's filter), "
+        f"saved {saved_requests} LLM filter requests"
+    )
+    return kept, deferred, index_rows
+
+def settle_near_duplicates(deferred: list, index_rows: list) -> list:
+    """
+    Index the kept items that now carry filter scores and copy those scores onto their
+    deferred duplicates. Returns the duplicate posts whose source is still unscored
+    (deferred to a later run, pruned or failed) — they go through the filter themselves.
+    """
+    if not deferred and not index_rows:
+        return []
+    scored = get_filter_scored_ids([row[0] for row in index_rows] + [source_id for _, source_id in deferred])
+    # An unscored item must not become a source: its duplicates would never get a score
+    insert_near_dup_signatures([row for row in index_rows if row[0] in scored])
+    inherit_filter_scores([(post["id"], source_id) for post, source_id in deferred if source_id in scored])
+
+    unscored = [post for post, source_id in deferred if source_id not in scored]
+    if unscored:
+        log.info(f"Near-duplicates: {len(unscored)} items have no scored source; sending them to the filter")
+    return unscored
@@ -0,0 +1,148 @@
+# gpt/prefilter.py
+
+import math
+import os
+import re
+from collections import Counter
+from config.config_loader import get_config
+from db.reader import get_scored_posts
+from utils.helpers import load_json, save_json, sanitize_text
+from utils.logger import setup_logger
+
+log = setup_logger()
+config = get_config()
+
+PREFILTER_CONFIG = config.get("prefilter", {})
+MODEL_PATH = PREFILTER_CONFIG.get("model_path", "data/prefilter_model.json")
+MIN_WORDS = PREFILTER_CONFIG.get("min_words", 8)
+
+# Pain-point vocabulary: (pattern, weight). Hits add up; link-only and very short items score low.
+PAIN_PATTERNS = [
+    (r"\b(frustrat\w*|annoy\w*|struggl\w*|painful|nightmare|hate|tired of|fed up)\b", 1.5),
+    (r"\b(is there (a|any) (tool|way|app|service)|looking for (a|an)|alternative to|recommend\w*)\b", 1.5),
+    (r"\b(how (do|can|should) (i|we|you)|any (idea|tip|advice)s?|help me|stuck)\b", 1.0),
+    (r"\b(wish|would love|i need|we need|missing feature|doesn'?t support|can'?t find)\b", 1.0),
+    (r"\b(manual(ly)?|automat\w*|workflow|spreadsheet|script|integrat\w*|schedul\w*)\b", 0.5),
+    (r"\b(slow|broken|bug\w*|crash\w*|fail\w*|expensive|pricing|too costly)\b", 0.5),
+    (r"\?", 0.5),
+]
+_COMPILED_PATTERNS = [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in PAIN_PATTERNS]
+_URL_PATTERN = re.compile(r"https?://\S+")
+_TOKEN_PATTERN = re.compile(r"[a-z][a-z']+")
+
+_model = None
+
+def tokenize(text: str) -> set:
+    return set(_TOKEN_PATTERN.findall(text.lower()))
+
+def keyword_score(title: str, body: str) -> float:
+    """Rule-based pain-point score; 0 for removed, link-only or near-empty items."""
+    text = f"{title}\n{body}"
+    if body.strip() in ("[deleted]", "[removed]"):
+        return 0.0
+    words = _URL_PATTERN.sub("", text).split()
+    if len(words) < MIN_WORDS:
+        return 0.0
+    return sum(weight for pattern, weight in _COMPILED_PATTERNS if pattern.search(text))
+
+def load_model() -> dict | None:
+    """The trained model written by train_prefilter, if any."""
+    global _model
+    if _model is None and os.path.exists(MODEL_PATH):
+        _model = load_json(MODEL_PATH)
+    return _model
+
+def score_post(post: dict, model: dict = None) -> float:
+    """Pre-filter score: trained log-odds when a model exists, keyword score otherwise."""
+    title = sanitize_text(post.get("title", ""))
+    body = sanitize_text(post.get("body", ""))
+    base = keyword_score(title, body)
+    if not model:
+        return base
+    weights = model["weights"]
+    tokens = tokenize(f"{title} {body}")
+    return model["bias"] + model["keyword_weight"] * base + sum(weights.get(token, 0.0) for token in tokens)
+
+def apply_prefilter(posts: list, pack_size: int = 1) -> list:
+    """
+    Drop (or, with mode: deprioritise, reorder) obvious non-candidates before the LLM filter.
+
+    The threshold is the trained model's recall-target threshold, or prefilter.min_score
+    for the keyword scorer. Logs how many LLM filter requests were saved.
+    """
+    if not PREFILTER_CONFIG.get("enabled", False) or not posts:
+        return posts
+
+    model = load_model()
+    threshold = model["threshold"] if model else PREFILTER_CONFIG.get("min_score", 1.0)
+    scored = [(score_post(post, model), post) for post in posts]
+
+    if PREFILTER_CONFIG.get("mode", "drop") == "deprioritise":
+        # Highest scores first, so budget cuts and deferrals hit the weakest items
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        below = sum(1 for score, _ in scored if score < threshold)
+        log.info(f"Pre-filter: {below}/{len(posts)} items below threshold {threshold:.2f} moved to the back")
+        return [post for _, post in scored]
+
+    kept = [post for score, post in scored if score >= threshold]
+    dropped = len(posts) - len(kept)
+    saved_requests = math.ceil(dropped / max(1, pack_size))
+    log.info(
+        f"Pre-filter ({'trained' if model else 'keyword'} scorer, threshold {threshold:.2f}): kept {len(kept)}/{len(posts)} items, "
+        f"saved {saved_requests} LLM filter requests"
+    )
+    return kept
+
+def train_prefilter(recall_target: float = None, relevant_score: float = None) -> dict | None:
+    """
+    Fit token log-odds weights on past LLM relevance scores stored in `posts`.
+
+    The threshold is set so that `recall_target` of the past relevant posts would
+    have been kept; the model is written to prefilter.model_path.
+    """
+    recall_target = recall_target or PREFILTER_CONFIG.get("recall_target", 0.95)
+    relevant_score = relevant_score or PREFILTER_CONFIG.get("relevant_score", 7)
+
+    rows = get_scored_posts()
+    samples = [(f"{sanitize_text(title or '')} {sanitize_text(body or '')}", score >= relevant_score)
+               for title, body, score in rows]
+    positives = sum(1 for _, relevant in samples if relevant)
+    negatives = len(samples) - positives
+    if positives < 20 or negatives < 20:
+        log.warning(f"Not enough scored posts to train the pre-filter ({positives} relevant, {negatives} not)")
+        return None
+
+    relevant_counts, other_counts = Counter(), Counter()
+    for text, relevant in samples:
+        (relevant_counts if relevant else other_counts).update(tokenize(text))
+
+    # Smoothed log-odds of a token appearing in relevant vs. other posts
+    weights = {}
+    for token in relevant_counts.keys() | other_counts.keys():
+        if relevant_counts[token] + other_counts[token] < 3:
+            continue
+        weights[token] = math.log((relevant_counts[token] + 1) / (positives + 2)) - \
+            math.log((other_counts[token] + 1) / (negatives + 2))
+    weights = dict(sorted(weights.items(), key=lambda item: abs(item[1]), reverse=True)[:5000])
+
+    model = {"weights": weights, "bias": math.log(positives / negatives), "keyword_weight": 0.5, "threshold": 0.0}
+    scores = [(score_post({"title": "", "body": text}, model), relevant) for text, relevant in samples]
+    positive_scores = sorted(score for score, relevant in scores if relevant)
+    model["threshold"] = positive_scores[int((1 - recall_target) * len(positive_scores))]
+
+    kept_negatives = sum(1 for score, relevant in scores if not relevant and score >= model["threshold"])
+    model["trained_on"] = len(samples)
+    model["expected_drop_rate"] = round(1 - (positives * recall_target + kept_negatives) / len(samples), 3)
+
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    save_json(model, MODEL_PATH)
+    global _model
+    _model = model
+    log.info(
+        f"Trained pre-filter on {len(samples)} posts ({positives} relevant): threshold {model['threshold']:.2f} "
+        f"keeps {recall_target:.0%} of relevant posts and drops ~{model['expected_drop_rate']:.0%} of all items"
+    )
+    return model
+
+if __name__ == "__main__":
+    train_prefilter()
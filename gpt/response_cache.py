@@ -0,0 +1,126 @@
+# gpt/response_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from config.config_loader import get_config
+from utils.logger import setup_logger
+
+log = setup_logger()
+config = get_config()
+
+CACHE_PATH = config["openai"].get("cache_path", "data/llm_cache.sqlite")
+CACHE_TTL_DAYS = config["openai"].get("cache_ttl_days", 30)
+CACHE_MAX_ENTRIES = config["openai"].get("cache_max_entries", 50_000)
+CACHE_WRITE_BATCH = 50  # Responses buffered per write transaction
+_LOOKUP_CHUNK = 500  # Keys per SELECT, below SQLite's variable limit
+
+_conn = None
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+def _get_connection():
+    global _conn
+    if _conn is None:
+        Path(CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False, timeout=10)
+        _conn.execute("PRAGMA journal_mode=WAL;")
+        _conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            created_at REAL,
+            last_used REAL
+        );
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);")
+        _conn.commit()
+    return _conn
+
+def cache_key(model: str, messages: list, temperature) -> str:
+    """Content address of a chat completion request."""
+    payload = json.dumps([model, messages, temperature], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_cached_responses(model: str, requests: list[dict]) -> dict:
+    """
+    Stored responses for the requests identical to earlier ones, as {custom_id: response}.
+
+    One SELECT per chunk of keys and one transaction for the last_used updates.
+    """
+    keys = {req["custom_id"]: cache_key(model, req["messages"], req["temperature"]) for req in requests}
+    now = time.time()
+    rows = {}
+    with _lock:
+        try:
+            conn = _get_connection()
+            unique_keys = list(set(keys.values()))
+            for start in range(0, len(unique_keys), _LOOKUP_CHUNK):
+                chunk = unique_keys[start:start + _LOOKUP_CHUNK]
+                placeholders = ",".join("?" for _ in chunk)
+                for key, response, created_at in conn.execute(
+                    f"SELECT key, response, created_at FROM responses WHERE key IN ({placeholders})", chunk
+                ):
+                    if now - created_at <= CACHE_TTL_DAYS * 86400:
+                        rows[key] = response
+            if rows:
+                conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?", [(now, key) for key in rows])
+                conn.commit()
+        except sqlite3.Error as e:
+            log.warning(f"LLM cache read failed: {e}")
+            rows = {}
+        hits = {custom_id: json.loads(rows[key]) for custom_id, key in keys.items() if key in rows}
+        _stats["hits"] += len(hits)
+        _stats["misses"] += len(keys) - len(hits)
+    return hits
+
+def store_responses(model: str, entries: list[tuple[list, float, dict]]):
+    """Cache successful (messages, temperature, response) entries in one transaction."""
+    if not entries:
+        return
+    now = time.time()
+    rows = [
+        (cache_key(model, messages, temperature), model, json.dumps(response, ensure_ascii=False), now, now)
+        for messages, temperature, response in entries
+    ]
+    with _lock:
+        try:
+            conn = _get_connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            _stats["writes"] += len(rows)
+        except sqlite3.Error as e:
+            log.warning(f"LLM cache write failed: {e}")
+
+def prune_cache() -> int:
+    """Drop expired entries, then the least recently used ones above cache_max_entries."""
+    cutoff = time.time() - CACHE_TTL_DAYS * 86400
+    with _lock:
+        try:
+            conn = _get_connection()
+            removed = conn.execute("DELETE FROM responses WHERE created_at < ?", (cutoff,)).rowcount
+            removed += conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            """, (CACHE_MAX_ENTRIES,)).rowcount
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning(f"LLM cache prune failed: {e}")
+            return 0
+        _stats["evictions"] += removed
+    if removed:
+        log.info(f"Evicted {removed} LLM cache entries")
+    return removed
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters for this process."""
+    with _lock:
+        return dict(_stats)
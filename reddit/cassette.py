@@ -0,0 +1,172 @@
+# reddit/cassette.py
+
+import atexit
+import gzip
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from prawcore.requestor import Requestor
+from requests.structures import CaseInsensitiveDict
+from utils.logger import setup_logger
+
+log = setup_logger()
+
+# Record/replay of Reddit API traffic at the prawcore Requestor level.
+# scraper.cassette_mode "record" saves every listing/comment response to a gzipped JSONL
+# cassette; "replay" answers the same requests from it without touching the network, so the
+# scraper runs at full speed on production-shaped data. Token requests are never stored.
+
+CASSETTE_VERSION = 1
+DEFAULT_CASSETTE_PATH = "data/cassettes/reddit.jsonl.gz"
+ACCESS_TOKEN_PATH = "/api/v1/access_token"
+KEPT_HEADERS = ("content-type", "location")  # x-ratelimit-* is dropped so replays are not paced
+
+_cassettes = {}  # path -> Cassette
+_cassettes_lock = threading.Lock()
+
+class CassetteMissError(LookupError):
+    """A replayed run issued a request the cassette has no response for."""
+
+def _pairs(value) -> list:
+    """params/data (dict, list of pairs or None) as sorted [key, str(value)] pairs."""
+    if not value:
+        return []
+    items = value.items() if isinstance(value, dict) else value
+    return sorted([str(k), str(v)] for k, v in items)
+
+def request_key(method, url, params=None, data=None) -> str:
+    return json.dumps([method.upper(), url, _pairs(params), _pairs(data)])
+
+def build_response(method, url, entry) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.reason = entry.get("reason", "")
+    response.headers = CaseInsensitiveDict(entry.get("headers", {}))
+    response._content = entry["body"].encode("utf-8")
+    response.encoding = "utf-8"
+    response.url = url
+    response.request = requests.Request(method.upper(), url).prepare()
+    return response
+
+def token_response(method, url) -> requests.Response:
+    """Stand-in OAuth token so replays need no credentials."""
+    body = json.dumps({"access_token": "replay", "token_type": "bearer", "expires_in": 86400, "scope": "*"})
+    return build_response(method, url, {"status": 200, "headers": {"content-type": "application/json"}, "body": body})
+
+class Cassette:
+    """
+    One cassette file, shared by the requestors of every thread's praw client.
+
+    Requests are matched on method, URL, query parameters and form data. Identical
+    requests are answered in recorded order; once the recordings run out the last one
+    is repeated. A replayed request with no recording raises CassetteMissError.
+    """
+
+    def __init__(self, mode, path):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"scraper.cassette_mode must be record, replay or null, not {mode!r}")
+        self.mode = mode
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._recordings = {}
+        self.hits = 0
+        self.misses = 0
+        if self.mode == "record":
+            self._open_for_record()
+        else:
+            self._load()
+
+    def _open_for_record(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"cassette": CASSETTE_VERSION, "recorded_at": time.time()}) + "\n")
+        atexit.register(self.close)
+        log.info(f"Recording Reddit responses to {self.path}")
+
+    def record(self, key, response):
+        entry = {
+            "key": key,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "body": response.text,
+        }
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(entry) + "\n")
+
+    def _load(self):
+        header, entries = {}, 0
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if "cassette" in entry:
+                        header = entry
+                        continue
+                    self._recordings.setdefault(entry["key"], deque()).append(entry)
+                    entries += 1
+        except FileNotFoundError:
+            raise FileNotFoundError(f"No Reddit cassette at {self.path}; record one with scraper.cassette_mode: record") from None
+        except EOFError:
+            # The recording run was killed before the gzip trailer was written; keep what was read
+            log.warning(f"Cassette {self.path} is truncated; replaying the {entries} responses read")
+
+        age_days = (time.time() - header.get("recorded_at", time.time())) / 86400
+        log.info(f"Replaying {entries} Reddit responses from {self.path} (recorded {age_days:.1f} days ago)")
+        if age_days >= 1:
+            # Age windows are judged against the current time, so posts may have moved in or out of range
+            log.warning("Post age windows have shifted since recording; comment trees of newly in-range posts will miss")
+
+    def replay(self, method, url, key):
+        with self._lock:
+            recorded = self._recordings.get(key)
+            if not recorded:
+                self.misses += 1
+                raise CassetteMissError(f"No recorded Reddit response for {method.upper()} {url} in {self.path}")
+            self.hits += 1
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        return build_response(method, url, entry)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def open_cassette(mode, path=None) -> Cassette:
+    """The process-wide Cassette for `path`, opened (and, when recording, truncated) once."""
+    path = path or DEFAULT_CASSETTE_PATH
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None or cassette.mode != mode:
+            if cassette is not None:
+                cassette.close()
+            cassette = _cassettes[path] = Cassette(mode, path)
+    return cassette
+
+class CassetteRequestor(Requestor):
+    """prawcore Requestor that records responses to, or replays them from, the shared cassette."""
+
+    def __init__(self, *args, cassette_mode="replay", cassette_path=None, **kwargs):
+        cassette = open_cassette(cassette_mode, cassette_path)
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def request(self, method, url, timeout=None, **kwargs):
+        if url.endswith(ACCESS_TOKEN_PATH):
+            if self.cassette.mode == "replay":
+                return token_response(method, url)
+            return super().request(method, url, timeout=timeout, **kwargs)  # credentials stay out of the cassette
+
+        key = request_key(method, url, kwargs.get("params"), kwargs.get("data"))
+        if self.cassette.mode == "replay":
+            return self.cassette.replay(method, url, key)
+        response = super().request(method, url, timeout=timeout, **kwargs)
+        self.cassette.record(key, response)
+        return response
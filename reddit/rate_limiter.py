@@ -1,6 +1,8 @@
 # reddit/rate_limiter.py
+import sqlite3
+import threading
 import time
-from datetime import datetime, timezone
+from pathlib import Path
 from config.config_loader import get_config
 from utils.logger import setup_logger
 
@@ -8,36 +10,196 @@ log = setup_logger()
 config = get_config()
 
 class RedditRateLimiter:
-    """Simple rolling window limiter — allows up to N requests per 60 seconds."""
+    """
+    Token-bucket limiter — refills at N requests per 60 seconds, up to `burst` tokens.
 
-    def __init__(self, requests_per_minute=None):
-        self.limit = requests_per_minute or config["scraper"]["rate_limit_per_minute"]
-        self.window_start = datetime.now(timezone.utc)
+    Safe to share between threads. When `state_path` is set the bucket lives in a
+    small SQLite file, so several processes draw from the same budget. Reddit's
+    X-Ratelimit-* headers (see `attach`) can lower the refill rate and pause the
+    bucket until the server window resets.
+    """
+
+    def __init__(self, requests_per_minute=None, burst=None, state_path=None):
+        scraper_config = config["scraper"]
+        self.limit = requests_per_minute or scraper_config["rate_limit_per_minute"]
+        self.base_rate = self.limit / 60.0  # tokens per second
+        self.capacity = max(1, burst or scraper_config.get("rate_limit_burst", 5))
+        self.state_path = state_path or scraper_config.get("rate_limit_state_path")
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.capacity)
+        self._updated_at = time.time()
+        self._rate = self.base_rate
+        self._blocked_until = 0.0
+        self._conn = None
+
+        # Blocked-time accounting
         self.request_count = 0
-        log.info(f"Rate limiter initialized: {self.limit} requests/minute")
+        self.wait_count = 0
+        self.total_wait_seconds = 0.0
+
+        if self.state_path:
+            self._init_shared_state()
+        log.info(
+            f"Rate limiter initialized: {self.limit} requests/minute, burst {self.capacity}"
+            + (f", shared via {self.state_path}" if self.state_path else "")
+        )
 
     def wait(self):
-        now = datetime.now(timezone.utc)
-        elapsed = (now - self.window_start).total_seconds()
-
-        if elapsed > 60:
-            # Reset window
-            self.window_start = now
-            self.request_count = 0
-            # No need to wait, we're starting a new window
+        """Block until a request token is available."""
+        with self._lock:
+            if self.state_path:
+                wait_time = self._reserve_shared()
+            else:
+                wait_time = self._reserve_local()
             self.request_count += 1
-            return
+            if wait_time > 0:
+                self.wait_count += 1
+                self.total_wait_seconds += wait_time
 
-        if self.request_count >= self.limit:
-            # Calculate how long to wait until the current window ends
-            wait_time = max(0.1, 60 - elapsed)
-            log.debug(f"Rate limit hit. Sleeping for {wait_time:.2f} seconds...")
+        # Sleep outside the lock so other workers can queue up their reservations
+        # (waits are counted in stats(), not logged one by one)
+        if wait_time > 0:
             time.sleep(wait_time)
-            # Reset window after waiting
-            self.window_start = datetime.now(timezone.utc)
-            self.request_count = 1  # Count this request
+        return wait_time
+
+    def _take_token(self, tokens, updated_at, rate, blocked_until, now):
+        """Refill the bucket, reserve one token and return (tokens, wait_seconds)."""
+        tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * rate)
+        tokens -= 1
+        deficit_wait = -tokens / rate if tokens < 0 else 0.0
+        return tokens, max(deficit_wait, blocked_until - now, 0.0)
+
+    def _reserve_local(self):
+        now = time.time()
+        self._tokens, wait_time = self._take_token(
+            self._tokens, self._updated_at, self._rate, self._blocked_until, now
+        )
+        self._updated_at = now
+        return wait_time
+
+    def _init_shared_state(self):
+        Path(self.state_path).parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode so BEGIN IMMEDIATE controls the cross-process write lock
+        self._conn = sqlite3.connect(self.state_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limiter (
+            name TEXT PRIMARY KEY,
+            tokens REAL,
+            updated_at REAL,
+            rate REAL,
+            blocked_until REAL
+        );
+        """)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO rate_limiter (name, tokens, updated_at, rate, blocked_until) VALUES ('reddit', ?, ?, ?, 0)",
+            (float(self.capacity), time.time(), self.base_rate)
+        )
+
+    def _reserve_shared(self):
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, updated_at, rate, blocked_until = conn.execute(
+                "SELECT tokens, updated_at, rate, blocked_until FROM rate_limiter WHERE name = 'reddit'"
+            ).fetchone()
+            now = time.time()
+            tokens, wait_time = self._take_token(tokens, updated_at, rate, blocked_until, now)
+            conn.execute(
+                "UPDATE rate_limiter SET tokens = ?, updated_at = ? WHERE name = 'reddit'",
+                (tokens, now)
+            )
+            conn.execute("COMMIT")
+            return wait_time
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            log.warning(f"Shared rate limiter unavailable ({e}); falling back to local bucket")
+            return self._reserve_local()
+
+    def _update_shared(self, rate, blocked_until, now):
+        """Switch the shared bucket to `rate`, settling the refill accrued at the old rate first."""
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            tokens, updated_at, old_rate, old_blocked_until = conn.execute(
+                "SELECT tokens, updated_at, rate, blocked_until FROM rate_limiter WHERE name = 'reddit'"
+            ).fetchone()
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * old_rate)
+            conn.execute(
+                "UPDATE rate_limiter SET tokens = ?, updated_at = ?, rate = ?, blocked_until = ? WHERE name = 'reddit'",
+                (tokens, now, rate, max(old_blocked_until, blocked_until))
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            log.warning(f"Failed to store rate limit headers: {e}")
+
+    def update_from_headers(self, headers):
+        """Adapt the refill rate from Reddit's X-Ratelimit-Remaining/Reset headers."""
+        try:
+            remaining = float(headers["x-ratelimit-remaining"])
+            reset_seconds = max(1.0, float(headers["x-ratelimit-reset"]))
+        except (KeyError, TypeError, ValueError):
+            return
+
+        now = time.time()
+        # Spread what is left of the server window evenly, never above our own limit
+        rate = max(0.01, min(self.base_rate, remaining / reset_seconds))
+        blocked_until = now + reset_seconds if remaining < 1 else 0.0
+
+        with self._lock:
+            if self.state_path:
+                self._update_shared(rate, blocked_until, now)
+            # Settle the refill accrued at the old rate before switching
+            self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated_at) * self._rate)
+            self._updated_at = now
+            previous_rate, self._rate = self._rate, rate
+            # A pause set by another response stays until its window resets
+            self._blocked_until = max(self._blocked_until, blocked_until)
+
+        # Every response carries these headers; only log when the pace actually changes
+        if rate < self.base_rate and round(rate * 60) != round(previous_rate * 60):
+            log.debug(f"Reddit reports {remaining:.0f} requests left for {reset_seconds:.0f}s; pacing at {rate * 60:.1f}/min")
+
+    def attach(self, reddit, on_request=None):
+        """
+        Take a token before every HTTP request prawcore makes (listing pages, comment
+        trees, MoreComments expansions) and feed each response's rate limit headers back.
+
+        `on_request(waited_seconds)` is called once per request, e.g. for metrics.
+        """
+        prawcore_limiter = getattr(getattr(reddit, "_core", None), "_rate_limiter", None)
+        if prawcore_limiter is None:
+            log.warning("prawcore rate limiter not found; requests are not paced")
             return
 
-        # If we get here, we're under the limit in the current window
-        self.request_count += 1
+        original_call = prawcore_limiter.call
+        original_update = prawcore_limiter.update
+
+        def call(*args, **kwargs):
+            waited = self.wait()
+            if on_request is not None:
+                on_request(waited)
+            return original_call(*args, **kwargs)
+
+        def update(*args, **kwargs):
+            # prawcore passes the headers positionally (2.x) or as response_headers= (3.x+)
+            headers = kwargs.get("response_headers", args[0] if args else {})
+            self.update_from_headers(headers)
+            return original_update(*args, **kwargs)
+
+        prawcore_limiter.call = call
+        prawcore_limiter.update = update
 
+    def stats(self) -> dict:
+        """Return request and blocked-time counters for logging."""
+        with self._lock:
+            return {
+                "requests": self.request_count,
+                "waits": self.wait_count,
+                "wait_seconds": round(self.total_wait_seconds, 2),
+                "rate_per_minute": round(self._rate * 60, 2),
+            }
@@ -1,18 +1,23 @@
 # reddit/scraper.py
 
-import praw
 import datetime
 import os
 import socket
+import threading
 import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-from prawcore.exceptions import RequestException
-from db.reader import is_already_processed
-from db.writer import insert_post
+from db.reader import get_processed_ids, get_subreddit_cursors
+from db.writer import insert_posts
 from reddit.discovery import discover_adjacent_subreddits
 from config.config_loader import get_config
-from utils.logger import setup_logger
+from utils.logger import setup_logger, ProgressCounter
 from utils.helpers import load_json, save_json, truncate
+from utils.clients import get_reddit
+from utils.metrics import record as record_metric
 from reddit.rate_limiter import RedditRateLimiter
 
 socket.setdefaulttimeout(10)  # Set global 10s timeout for HTTP
@@ -20,63 +25,235 @@ socket.setdefaulttimeout(10)  # Set global 10s timeout for HTTP
 log = setup_logger()
 config = get_config()
 
-# Initialize Reddit API client
-reddit = praw.Reddit(
-    client_id=config["reddit"]["client_id"],
-    client_secret=config["reddit"]["client_secret"],
-    user_agent=config["reddit"]["user_agent"],
-    username=config["reddit"]["username"],
-    password=config["reddit"]["password"]
-)
-
-limiter = RedditRateLimiter(config["scraper"].get("rate_limit_per_minute", 60))
+# Replayed responses (scraper.cassette_mode: replay) cost no quota, so the limiter is lifted for them
+REPLAYING = config["scraper"].get("cassette_mode") == "replay"
+limiter = RedditRateLimiter(10**9 if REPLAYING else config["scraper"].get("rate_limit_per_minute", 60))
+_limiter_attached = weakref.WeakSet()  # clients whose responses already feed `limiter`
+_attach_lock = threading.Lock()
+_listing_pool = None  # long-lived, so its threads keep their praw clients between subreddits
+_request_context = threading.local()  # subreddit this thread is fetching, for per-request metrics
+MAX_WORKERS = config["scraper"].get("max_workers", 1)
 EXPLORATORY_FILE = "data/exploratory_subreddits.json"
+COMMENT_CHUNK_SIZE = 10       # Comments per chunk record sent to the filter stage
+COMMENT_DEDUP_WINDOW = 100    # Comments checked against history per query
+
+# Smallest `top` window that still covers max_post_age_days
+TOP_TIME_FILTERS = [("day", 1), ("week", 7), ("month", 31), ("year", 365)]
+
+def get_reddit_client():
+    """This thread's praw client (PRAW is not thread-safe), with the shared `limiter` fed from its responses."""
+    reddit = get_reddit()
+    with _attach_lock:
+        if reddit not in _limiter_attached:
+            # One token per HTTP request, paced from Reddit's X-Ratelimit-* response headers
+            limiter.attach(reddit, on_request=record_api_call)
+            _limiter_attached.add(reddit)
+    return reddit
+
+def record_api_call(waited):
+    subreddit_name = getattr(_request_context, "subreddit", None)
+    record_metric("scrape", "api_calls", 1, subreddit_name)
+    record_metric("scrape", "limiter_wait_seconds", waited, subreddit_name)
+
+def get_listing_pool() -> ThreadPoolExecutor:
+    global _listing_pool
+    with _attach_lock:
+        if _listing_pool is None:
+            _listing_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS * 3, thread_name_prefix="listing")
+    return _listing_pool
 
 def is_post_in_age_range(post, min_days, max_days) -> bool:
     post_date = datetime.datetime.fromtimestamp(post.created_utc)
     age_days = (datetime.datetime.utcnow() - post_date).days
     return min_days <= age_days <= max_days
 
-def fetch_posts_from_subreddit(subreddit_name, limit=200) -> list:
+def top_time_filter(max_days) -> str:
+    for name, span_days in TOP_TIME_FILTERS:
+        if max_days <= span_days:
+            return name
+    return "all"
+
+def stop_at_known_territory(listing, cursor, max_days):
+    """
+    Lazily walk a newest-first listing, stopping at the stored high-water mark or
+    once posts get older than max_days, so no further pages are requested.
+    """
+    oldest_created = time.time() - (max_days + 1) * 86400
+    known_created = cursor["newest_created_utc"] if cursor else None
+    for post in listing:
+        if known_created is not None and post.created_utc <= known_created:
+            log.debug(f"Reached known territory at {post.id}; stopping 'new' pagination")
+            return
+        if post.created_utc < oldest_created:
+            return
+        yield post
+
+def plan_listings(subreddit_name, limit, min_days, max_days, cursors) -> list:
+    """
+    Build the (name, make_listing) listings worth fetching for the age window.
+
+    `make_listing()` creates the listing generator on the calling thread's client,
+    so each fetch thread pages through its own praw instance.
+    """
+    def subreddit():
+        return get_reddit_client().subreddit(subreddit_name)
+
+    time_filter = top_time_filter(max_days)
+    listings = [("top", lambda: subreddit().top(time_filter=time_filter, limit=limit))]
+
+    hot_max_age = config["scraper"].get("hot_max_age_days")
+    if hot_max_age is not None and min_days > hot_max_age:
+        log.debug(f"Skipping hot listing: posts must be at least {min_days} days old")
+    else:
+        listings.append(("hot", lambda: subreddit().hot(limit=limit)))
+
+    new_cursor = cursors.get("new")
+    listings.append(("new", lambda: stop_at_known_territory(subreddit().new(limit=limit), new_cursor, max_days)))
+    return listings
+
+def listing_cursor_updates(subreddit_name, fetched, min_days, max_days) -> list:
+    """The newest in-window post seen on each listing, as insert_posts `cursors` tuples."""
+    cursors = []
+    for fetch_name, posts in fetched:
+        in_range = [p for p in posts if is_post_in_age_range(p, min_days, max_days)]
+        if not in_range:
+            continue
+        newest = max(in_range, key=lambda p: p.created_utc)
+        cursors.append((subreddit_name, fetch_name, newest.name, newest.created_utc))
+    return cursors
+
+def iter_comments(forest):
+    """Yield comments breadth-first (same order as CommentForest.list()) without flattening the tree."""
+    from praw.models import MoreComments
+    queue = deque(forest)
+    while queue:
+        comment = queue.popleft()
+        if isinstance(comment, MoreComments):
+            continue
+        yield comment
+        queue.extend(comment.replies)
+
+def expand_comment_tree(post):
+    """Fetch the comment forest, resolving up to `comment_replace_more_limit` MoreComments; returns it."""
+    more_limit = config["scraper"].get("comment_replace_more_limit", 0)
+    threshold = config["scraper"].get("comment_replace_more_threshold", 0)
+    # The tree fetch and each MoreComments expansion take a limiter token in the prawcore hook
+    post.comments.replace_more(limit=more_limit, threshold=threshold)
+    return post.comments
+
+def iter_comment_chunks(post, forest, subreddit_name, seen_ids, min_days, max_days):
+    """
+    Stream a post's comments into chunk records of COMMENT_CHUNK_SIZE comments each.
+
+    Comments are deduplicated against history one window at a time, and each chunk
+    body is joined from a list buffer rather than grown by string concatenation.
+    Chunks carry only a truncated summary of the post; the full text is in the post record.
+    """
+    max_comments = config["scraper"].get("max_comments_per_post")
+    post_header = compact_post_header(post)
+    comments = iter_comments(forest)
+    buffer = []
+    last_comment = None
+    accepted = 0
+
+    while True:
+        window = list(islice(comments, COMMENT_DEDUP_WINDOW))
+        if not window:
+            break
+        processed_ids = get_processed_ids(comment.id for comment in window)
+        for comment in window:
+            if comment.id in seen_ids:
+                continue
+            seen_ids.add(comment.id)
+
+            if not is_post_in_age_range(comment, min_days, max_days):
+                continue
+            if comment.id in processed_ids:
+                continue
+
+            buffer.append("comment: \'\'\'\n" + comment.body + "\'\'\'")
+            last_comment = comment
+            accepted += 1
+            if len(buffer) == COMMENT_CHUNK_SIZE:
+                yield comment_chunk_record(post, last_comment, subreddit_name, post_header, buffer)
+                buffer = []
+            if max_comments and accepted >= max_comments:
+                break
+        if max_comments and accepted >= max_comments:
+            break
+
+    if buffer:
+        yield comment_chunk_record(post, last_comment, subreddit_name, post_header, buffer)
+
+def compact_post_header(post) -> str:
+    """Parent reference plus a truncated post summary, shared by every comment chunk of the thread."""
+    summary_tokens = config["scraper"].get("comment_post_summary_tokens", 150)
+    summary = truncate(post.selftext, summary_tokens) if summary_tokens else ""
+    return f"parent post: {post.id}\npost summary: \'\'\'\n{summary}\'\'\'"
+
+def comment_chunk_record(post, comment, subreddit_name, post_header, buffer) -> dict:
+    return {
+        "id": comment.id,
+        "title": post.title,
+        "title_id": post.id,
+        "body": "\n".join([post_header] + buffer),
+        "created_utc": comment.created_utc,
+        "subreddit": subreddit_name,
+        "url": f"https://www.reddit.com{comment.permalink}",
+        "type": "comment"
+    }
+
+def fetch_posts_from_subreddit(subreddit_name, limit=200) -> tuple[list, list]:
+    """
+    Fetch one subreddit's new posts and comment chunks.
+
+    Returns (items, cursor updates); the caller passes the cursors to insert_posts so
+    they only advance once the items are stored.
+    """
     min_days = config["scraper"]["min_post_age_days"]
     max_days = config["scraper"]["max_post_age_days"]
     include_comments = config["scraper"].get("include_comments", False)
     results = []
+    cursors = []
     seen_ids = set()
 
     skipped_due_to_age = 0
     skipped_due_to_duplicate = 0
+    start_time = time.time()
+    _request_context.subreddit = subreddit_name
 
     try:
-        log.info(f"Fetching posts from r/{subreddit_name} using top, hot, and new...")
-        subreddit = reddit.subreddit(subreddit_name)
+        reddit = get_reddit_client()
         combined = []
 
-        for fetch_name, fetch_method in [("top", subreddit.top(time_filter="month", limit=limit)),
-                                         ("hot", subreddit.hot(limit=limit)),
-                                         ("new", subreddit.new(limit=limit))]:
-            limiter.wait()  # Apply rate limit per API fetch
-            posts = safe_fetch(fetch_method, fetch_name)
+        listings = plan_listings(subreddit_name, limit, min_days, max_days, get_subreddit_cursors(subreddit_name))
+        log.info(f"Fetching posts from r/{subreddit_name} using {', '.join(name for name, _ in listings)}...")
+
+        if MAX_WORKERS > 1:
+            # Fan out the three listings; map keeps top/hot/new ordering
+            fetched = list(get_listing_pool().map(lambda listing: rate_limited_fetch(*listing, subreddit_name), listings))
+        else:
+            fetched = [rate_limited_fetch(fetch_name, fetch_method, subreddit_name) for fetch_name, fetch_method in listings]
+
+        fetched = list(zip([name for name, _ in listings], fetched))
+        for _, posts in fetched:
             combined.extend(posts)
 
         log.info(f"Total fetched posts to process from r/{subreddit_name}: {len(combined)}")
-        start_time = time.time()
+        processed_ids = get_processed_ids(post.id for post in combined)
 
-        for i, post in enumerate(combined):
-            if i % 10 == 0:
-                log.info(f"Processing post #{i+1}/{len(combined)}")
+        progress = ProgressCounter(f"r/{subreddit_name}", total=len(combined))
 
+        for post in combined:
+            progress.add("processed")
             if post.id in seen_ids:
                 continue
             seen_ids.add(post.id)
 
-            created_at = datetime.datetime.fromtimestamp(post.created_utc)
-            log.debug(f"Post {post.id} at {created_at.isoformat()} — {post.title[:60]}")
-
             if not is_post_in_age_range(post, min_days, max_days):
                 skipped_due_to_age += 1
                 continue
-            if is_already_processed(post.id):
+            if post.id in processed_ids:
                 skipped_due_to_duplicate += 1
                 continue
 
@@ -90,45 +267,11 @@ def fetch_posts_from_subreddit(subreddit_name, limit=200) -> list:
                 "url": f"https://www.reddit.com{post.permalink}",
                 "type": "post"
             })
-            post_title_id =  post.id
             if include_comments:
                 try:
-                    limiter.wait()  # One API call to fetch all comments
-                    post.comments.replace_more(limit=0)
-                    post_body = "post: \'\'\'\n"+post.selftext+"\'\'\'"
-                    for comment_index, comment in enumerate(post.comments.list()):
-                        if comment.id in seen_ids:
-                            continue
-                        seen_ids.add(comment.id)
-
-                        if not is_post_in_age_range(comment, min_days, max_days):
-                            continue
-                        if is_already_processed(comment.id):
-                            continue
-                        post_body = post_body + "\ncomment: \'\'\'\n" + comment.body + "\'\'\'"
-                        if(comment_index%10==0):
-                            results.append({
-                                "id": comment.id,
-                                "title": post.title,
-                                "title_id": post_title_id,
-                                "body": post_body,
-                                "created_utc": comment.created_utc,
-                                "subreddit": subreddit_name,
-                                "url": f"https://www.reddit.com{comment.permalink}",
-                                "type": "comment"
-                            })
-                            post_body = "post: \'\'\'\n"+post.selftext+"\'\'\'"
-                    if(comment_index%10!=0):
-                        results.append({
-                                "id": comment.id,
-                                "title": post.title,
-                                "title_id": post_title_id,
-                                "body": post_body,
-                                "created_utc": comment.created_utc,
-                                "subreddit": subreddit_name,
-                                "url": f"https://www.reddit.com{comment.permalink}",
-                                "type": "comment"
-                            })
+                    # The post belongs to the listing thread's client; read its comments through this thread's own
+                    forest = expand_comment_tree(reddit.submission(id=post.id))
+                    results.extend(iter_comment_chunks(post, forest, subreddit_name, seen_ids, min_days, max_days))
                 except Exception as e:
                     log.warning(f"Failed to fetch comments for post {post.id}: {str(e)}")
 
@@ -136,11 +279,18 @@ def fetch_posts_from_subreddit(subreddit_name, limit=200) -> list:
             f"r/{subreddit_name} — Found {len(results)} new items | "
             f"Skipped {skipped_due_to_age} due to age | {skipped_due_to_duplicate} duplicates"
         )
+        cursors = listing_cursor_updates(subreddit_name, fetched, min_days, max_days)
     except Exception as e:
         log.error(f"Error fetching from r/{subreddit_name}: {str(e)}")
+        record_metric("scrape", "errors", 1, subreddit_name)
 
-    log.info(f"Finished processing posts from r/{subreddit_name} in {time.time() - start_time:.2f} seconds")
-    return results
+    elapsed = time.time() - start_time
+    record_metric("scrape", "wall_seconds", elapsed, subreddit_name)
+    record_metric("scrape", "items", len(results), subreddit_name)
+    record_metric("scrape", "skipped_age", skipped_due_to_age, subreddit_name)
+    record_metric("scrape", "skipped_duplicate", skipped_due_to_duplicate, subreddit_name)
+    log.info(f"Finished processing posts from r/{subreddit_name} in {elapsed:.2f} seconds")
+    return results, cursors
 
 def get_exploratory_subreddits():
     if not os.path.exists(EXPLORATORY_FILE):
@@ -166,7 +316,42 @@ def update_exploratory_subreddits(new_subreddits):
     save_json(data, EXPLORATORY_FILE)
     log.info(f"Updated exploratory subreddits: {', '.join(new_subreddits)}")
 
-def scrape_all_configured_subreddits() -> list:
+def scrape_subreddits(subreddits, limit, community_type="primary", on_posts=None) -> list:
+    """
+    Fetch a group of subreddits, concurrently when `scraper.max_workers` > 1.
+
+    All workers share the module-level `limiter`, so the global request budget is
+    unchanged. Results are inserted and returned in the configured subreddit order,
+    exactly as the sequential walk did.
+
+    With `on_posts`, each subreddit's posts are inserted and handed to the callback
+    as soon as that subreddit finishes, so downstream stages can start early.
+    """
+    def fetch(sub):
+        posts, cursors = fetch_posts_from_subreddit(sub, limit=limit)
+        if on_posts is not None:
+            insert_posts(posts, community_type=community_type, cursors=cursors)
+            if posts:
+                on_posts(posts)
+        return posts, cursors
+
+    if MAX_WORKERS > 1 and len(subreddits) > 1:
+        workers = min(MAX_WORKERS, len(subreddits))
+        log.info(f"Fetching {len(subreddits)} subreddits with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scraper") as pool:
+            per_subreddit = list(pool.map(fetch, subreddits))
+    else:
+        per_subreddit = [fetch(sub) for sub in subreddits]
+
+    scraped, cursors = [], []
+    for posts, subreddit_cursors in per_subreddit:
+        scraped.extend(posts)
+        cursors.extend(subreddit_cursors)
+    if on_posts is None:
+        insert_posts(scraped, community_type=community_type, cursors=cursors)
+    return scraped
+
+def scrape_all_configured_subreddits(on_posts=None) -> list:
     primary_subreddits = config["subreddits"]["primary"]
     primary_pct = config["subreddits"]["primary_percentage"]
     exploratory_pct = config["subreddits"]["exploratory_percentage"]
@@ -178,13 +363,7 @@ def scrape_all_configured_subreddits() -> list:
 
     log.info(f"Scraping {len(primary_subreddits)} primary subreddits...")
     per_primary_subreddit = max(1, primary_limit // len(primary_subreddits))
-    primary_posts = []
-
-    for sub in primary_subreddits:
-        posts = fetch_posts_from_subreddit(sub, limit=per_primary_subreddit)
-        for post in posts:
-            insert_post(post, community_type="primary")
-        primary_posts.extend(posts)
+    primary_posts = scrape_subreddits(primary_subreddits, per_primary_subreddit, community_type="primary", on_posts=on_posts)
 
     exploratory_subreddits = get_exploratory_subreddits()
 
@@ -201,20 +380,26 @@ def scrape_all_configured_subreddits() -> list:
     if exploratory_subreddits:
         log.info(f"Scraping {len(exploratory_subreddits)} exploratory subreddits...")
         per_exploratory = max(1, exploratory_limit_posts // len(exploratory_subreddits))
-
-        for sub in exploratory_subreddits:
-            posts = fetch_posts_from_subreddit(sub, limit=per_exploratory)
-            for post in posts:
-                insert_post(post, community_type="exploratory")
-            primary_posts.extend(posts)
+        primary_posts.extend(scrape_subreddits(exploratory_subreddits, per_exploratory, community_type="exploratory", on_posts=on_posts))
 
     log.info(f"Total items scraped: {len(primary_posts)}")
+    stats = limiter.stats()
+    log.info(
+        f"Rate limiter: {stats['requests']} requests, blocked {stats['waits']} times "
+        f"for {stats['wait_seconds']:.2f}s (current pace {stats['rate_per_minute']}/min)"
+    )
     return primary_posts
 
-def safe_fetch(generator, name):
+def rate_limited_fetch(name, make_listing, subreddit_name=None):
+    """Page through one listing; every page request takes a limiter token (see get_reddit_client)."""
+    _request_context.subreddit = subreddit_name
+    return safe_fetch(make_listing, name)
+
+def safe_fetch(make_listing, name):
+    from prawcore.exceptions import RequestException
     try:
         log.info(f"→ Fetching {name}...")
-        return list(generator)
+        return list(make_listing())
     except (RequestException, socket.timeout) as e:
         log.error(f"Timeout/error while fetching {name}: {e}")
         return []
@@ -222,9 +407,6 @@ def safe_fetch(generator, name):
         log.error(f"Unknown error while fetching {name}: {e}")
         return []
 
-from pytrends.request import TrendReq
-import pandas as pd
-
 def get_monthly_trends_with_yoy(keywords, geo="worldwide"):
     """
     获取关键词的 Google Trends 近5年趋势 (按月) + YoY 增长率
@@ -240,6 +422,10 @@ def get_monthly_trends_with_yoy(keywords, geo="worldwide"):
                 "yoy_growth": YoY 增长率 (pd.DataFrame)
               }
     """
+    # pytrends/pandas 只在这里用到，延迟导入
+    from pytrends.request import TrendReq
+    import pandas as pd
+
     pytrends = TrendReq(hl='en-US', tz=360,timeout=(10, 30))
     results = {}
 
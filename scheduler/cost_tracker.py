@@ -1,81 +1,270 @@
 # scheduler/cost_tracker.py
 
-import json
 import os
+import sqlite3
+import threading
+import time
+import uuid
 from datetime import datetime, timezone
+from pathlib import Path
 from config.config_loader import get_config
 from utils.logger import setup_logger
-from utils.helpers import save_json, load_json, ensure_directory_exists
+from utils.helpers import load_json
 
 log = setup_logger()
 config = get_config()
 
-# Constants for pricing (adjust if OpenAI changes their pricing)
-GPT4_MINI_INPUT_COST = 0.15  # $ per 1000 tokens
-GPT4_MINI_OUTPUT_COST = 0.60
-GPT4_INPUT_COST = 0.30
-GPT4_OUTPUT_COST = 0.60
+# Fallback pricing (USD per 1M tokens) for models missing from openai.pricing
+DEFAULT_PRICING = {"input": 0.30, "output": 0.60}
+DEFAULT_OUTPUT_TOKENS = 300
 
-COST_TRACKING_FILE = "data/cost_tracking.json"
+LEDGER_PATH = config["openai"].get("cost_ledger_path", "data/cost_ledger.sqlite")
+RESERVATION_TTL_SECONDS = config["openai"].get("budget_reservation_ttl_seconds", 6 * 3600)
+COST_TRACKING_FILE = "data/cost_tracking.json"  # Legacy JSON tracker, imported once into the ledger
+
+_conn = None
+_lock = threading.Lock()
+_current_run = None
 
 def get_current_month() -> str:
     """Returns the current UTC month as YYYY-MM."""
     return datetime.now(timezone.utc).strftime("%Y-%m")
 
+def _get_connection():
+    global _conn
+    if _conn is None:
+        Path(LEDGER_PATH).parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode so BEGIN IMMEDIATE controls the cross-process write lock
+        _conn = sqlite3.connect(LEDGER_PATH, check_same_thread=False, timeout=30, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL;")
+        _conn.executescript("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month TEXT,
+            stage TEXT,
+            model TEXT,
+            run_id TEXT,
+            requests INTEGER,
+            input_tokens INTEGER,
+            cached_input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER,
+            estimated_input_tokens INTEGER,
+            cost REAL,
+            created_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_ledger_run ON ledger(run_id);
+
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            month TEXT PRIMARY KEY,
+            spent REAL
+        );
+
+        CREATE TABLE IF NOT EXISTS model_stats (
+            model TEXT PRIMARY KEY,
+            requests INTEGER,
+            input_tokens INTEGER,
+            output_tokens INTEGER,
+            estimated_input_tokens INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS reservations (
+            id TEXT PRIMARY KEY,
+            month TEXT,
+            label TEXT,
+            amount REAL,
+            expires_at REAL
+        );
+        """)
+        columns = {row[1] for row in _conn.execute("PRAGMA table_info(ledger)")}
+        if "cached_input_tokens" not in columns:
+            _conn.execute("ALTER TABLE ledger ADD COLUMN cached_input_tokens INTEGER DEFAULT 0")
+    return _conn
+
+def _record(conn, month, stage, model, requests, input_tokens, output_tokens, estimated_input_tokens, cost,
+            cached_input_tokens=0):
+    """Append one ledger entry and roll it into the running totals. Caller holds the transaction."""
+    conn.execute("""
+        INSERT INTO ledger (month, stage, model, run_id, requests, input_tokens, cached_input_tokens,
+                            output_tokens, estimated_input_tokens, cost, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (month, stage, model, _current_run, requests, input_tokens, cached_input_tokens, output_tokens,
+          estimated_input_tokens, cost, time.time()))
+    conn.execute("""
+        INSERT INTO monthly_totals (month, spent) VALUES (?, ?)
+        ON CONFLICT(month) DO UPDATE SET spent = spent + excluded.spent
+    """, (month, cost))
+    if model and requests:
+        conn.execute("""
+            INSERT INTO model_stats (model, requests, input_tokens, output_tokens, estimated_input_tokens)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(model) DO UPDATE SET
+                requests = requests + excluded.requests,
+                input_tokens = input_tokens + excluded.input_tokens,
+                output_tokens = output_tokens + excluded.output_tokens,
+                estimated_input_tokens = estimated_input_tokens + excluded.estimated_input_tokens
+        """, (model, requests, input_tokens, output_tokens, estimated_input_tokens))
+
+def _transaction(write):
+    """Run `write(conn)` inside BEGIN IMMEDIATE, so concurrent pipelines serialise on the ledger."""
+    with _lock:
+        conn = _get_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = write(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+def _migrate_json_tracker(conn):
+    """Carry month totals and calibration stats over from data/cost_tracking.json."""
+    data = load_json(COST_TRACKING_FILE)
+    for month, spent in data.get("monthly_costs", {}).items():
+        _record(conn, month, "migrated", None, 0, 0, 0, 0, spent)
+    for model, stats in data.get("model_stats", {}).items():
+        conn.execute(
+            "INSERT OR IGNORE INTO model_stats (model, requests, input_tokens, output_tokens, estimated_input_tokens) VALUES (?, ?, ?, ?, ?)",
+            (model, stats.get("requests", 0), stats.get("input_tokens", 0),
+             stats.get("output_tokens", 0), stats.get("estimated_input_tokens", 0))
+        )
+
 def initialize_cost_tracking():
-    """Initialize the cost tracking file if it doesn't exist."""
-    ensure_directory_exists("data")
-    if not os.path.exists(COST_TRACKING_FILE):
-        data = {
-            "monthly_costs": {},
-            "current_month": get_current_month(),
-            "current_month_total": 0.0,
-            "monthly_budget": config["openai"]["monthly_budget_usd"]
-        }
-        save_json(data, COST_TRACKING_FILE)
-        log.info("Cost tracking initialized.")
-    return load_json(COST_TRACKING_FILE)
+    """Create the ledger, importing the legacy JSON tracker on first use."""
+    def write(conn):
+        if os.path.exists(COST_TRACKING_FILE) and conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0] == 0:
+            _migrate_json_tracker(conn)
+            return True
+        return False
+
+    if _transaction(write):
+        os.replace(COST_TRACKING_FILE, COST_TRACKING_FILE + ".migrated")
+        log.info(f"Imported {COST_TRACKING_FILE} into the cost ledger at {LEDGER_PATH}")
+    return {
+        "current_month": get_current_month(),
+        "current_month_total": month_to_date_spend(),
+        "monthly_budget": config["openai"]["monthly_budget_usd"]
+    }
 
-def track_api_usage(input_tokens: int, output_tokens: int, model: str) -> float:
-    """Track API usage and calculate costs."""
-    tracking_data = load_json(COST_TRACKING_FILE)
-    current_month = get_current_month()
+def get_model_pricing(model: str) -> dict:
+    """USD per 1M input/output tokens for a model, from openai.pricing."""
+    pricing = config["openai"].get("pricing", {})
+    return pricing.get(model) or pricing.get("default") or DEFAULT_PRICING
 
-    if tracking_data["current_month"] != current_month:
-        tracking_data["current_month"] = current_month
-        tracking_data["current_month_total"] = 0.0
+def usage_cost(input_tokens: int, output_tokens: int, model: str, cached_input_tokens: int = 0) -> float:
+    """Cost of a usage sample; cached input tokens use the model's cached_input price when it has one."""
+    pricing = get_model_pricing(model)
+    cached_price = pricing.get("cached_input", pricing["input"])
+    return (
+        (input_tokens - cached_input_tokens) * pricing["input"]
+        + cached_input_tokens * cached_price
+        + output_tokens * pricing["output"]
+    ) / 1_000_000
 
-    if "mini" in model.lower():
-        input_cost = (input_tokens / 1000) * GPT4_MINI_INPUT_COST
-        output_cost = (output_tokens / 1000) * GPT4_MINI_OUTPUT_COST
-    else:
-        input_cost = (input_tokens / 1000) * GPT4_INPUT_COST
-        output_cost = (output_tokens / 1000) * GPT4_OUTPUT_COST
+def start_run(run_id: str):
+    """Attribute the usage tracked from now on to `run_id`."""
+    global _current_run
+    _current_run = run_id
 
-    total_cost = input_cost + output_cost
+def get_run_usage(run_id: str = None) -> dict:
+    """Measured usage of a run (default: the current one) as {stage: {model: totals}}."""
+    run_id = run_id or _current_run
+    if not run_id:
+        return {}
+    with _lock:
+        rows = _get_connection().execute("""
+            SELECT stage, model, SUM(requests), SUM(input_tokens), SUM(cached_input_tokens), SUM(output_tokens), SUM(cost)
+            FROM ledger WHERE run_id = ? GROUP BY stage, model
+        """, (run_id,)).fetchall()
+    usage = {}
+    for stage, model, requests, input_tokens, cached_input_tokens, output_tokens, cost in rows:
+        usage.setdefault(stage, {})[model] = {
+            "requests": requests, "input_tokens": input_tokens, "cached_input_tokens": cached_input_tokens,
+            "output_tokens": output_tokens, "cost": cost
+        }
+    return usage
+
+def log_run_usage():
+    """Log the measured token usage and spend of the current run per stage and model."""
+    total = 0.0
+    for stage, models in get_run_usage().items():
+        for model, totals in models.items():
+            total += totals["cost"]
+            log.info(
+                f"Usage [{stage}] {model}: {totals['requests']} requests, {totals['input_tokens']} input "
+                f"({totals['cached_input_tokens']} cached) + {totals['output_tokens']} output tokens, ${totals['cost']:.4f}"
+            )
+    log.info(f"Measured spend for this run: ${total:.4f}")
 
-    tracking_data["monthly_costs"].setdefault(current_month, 0.0)
-    tracking_data["monthly_costs"][current_month] += total_cost
-    tracking_data["current_month_total"] += total_cost
+def track_api_usage(input_tokens: int, output_tokens: int, model: str, stage: str = "other",
+                    requests: int = 1, estimated_input_tokens: int = 0, cached_input_tokens: int = 0) -> float:
+    """
+    Record measured token usage (from the API's usage block) and its cost.
 
-    save_json(tracking_data, COST_TRACKING_FILE)
-    log.info(f"Tracked usage: {input_tokens} input + {output_tokens} output tokens. Cost: ${total_cost:.4f}")
+    Each call appends one ledger entry tagged with the month, stage, model and run;
+    the per-model totals also calibrate estimate_cost. `estimated_input_tokens` is
+    what the payload builders predicted for the same requests; `cached_input_tokens`
+    is the part of the input served from the provider's prompt cache. `requests` counts
+    answers, so a packed filter request scoring N posts counts N.
+    """
+    total_cost = usage_cost(input_tokens, output_tokens, model, cached_input_tokens)
+    try:
+        _transaction(lambda conn: _record(
+            conn, get_current_month(), stage, model, requests,
+            input_tokens, output_tokens, estimated_input_tokens, total_cost, cached_input_tokens
+        ))
+    except sqlite3.Error as e:
+        print(f"[SQLite track_api_usage Error] {e}")
+    log.info(f"Tracked {stage} usage on {model}: {input_tokens} input ({cached_input_tokens} cached) + {output_tokens} output tokens over {requests} answers. Cost: ${total_cost:.4f}")
 
     return total_cost
 
-def remaining_budget() -> float:
-    """Calculate remaining budget for the current month."""
-    tracking_data = load_json(COST_TRACKING_FILE)
-    current_month = get_current_month()
+def estimate_cost(estimated_input_tokens: int, requests: int, model: str) -> float:
+    """
+    Predict the cost of `requests` answers from the builders' token estimates.
+
+    Calibrated with the model's measured usage: input estimates are scaled by the
+    measured/estimated ratio and output tokens use the measured per-answer average
+    (a packed filter request of N posts is N answers, see batch_api.expected_answers).
+    """
+    with _lock:
+        stats = _get_connection().execute(
+            "SELECT requests, input_tokens, output_tokens, estimated_input_tokens FROM model_stats WHERE model = ?",
+            (model,)
+        ).fetchone()
+    input_tokens = estimated_input_tokens
+    output_tokens = requests * config["openai"].get("estimated_output_tokens", DEFAULT_OUTPUT_TOKENS)
+    if stats:
+        measured_requests, measured_input, measured_output, measured_estimate = stats
+        if measured_estimate:
+            input_tokens *= measured_input / measured_estimate
+        if measured_requests:
+            output_tokens = requests * measured_output / measured_requests
+    return usage_cost(input_tokens, output_tokens, model)
+
+def month_to_date_spend(month: str = None) -> float:
+    """Measured spend of a month (default: current), read from the running total."""
+    with _lock:
+        row = _get_connection().execute(
+            "SELECT spent FROM monthly_totals WHERE month = ?", (month or get_current_month(),)
+        ).fetchone()
+    return row[0] if row else 0.0
 
-    if tracking_data["current_month"] != current_month:
-        tracking_data["current_month"] = current_month
-        tracking_data["current_month_total"] = 0.0
-        save_json(tracking_data, COST_TRACKING_FILE)
+def _reserved(conn, month, now) -> float:
+    return conn.execute(
+        "SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE month = ? AND expires_at > ?", (month, now)
+    ).fetchone()[0]
 
-    budget = tracking_data.get("monthly_budget", config["openai"]["monthly_budget_usd"])
-    spent = tracking_data.get("current_month_total", 0.0)
-    return max(0.0, budget - spent)
+def remaining_budget() -> float:
+    """Budget left this month after measured spend and outstanding reservations."""
+    month = get_current_month()
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute("SELECT spent FROM monthly_totals WHERE month = ?", (month,)).fetchone()
+        reserved = _reserved(conn, month, time.time())
+    spent = row[0] if row else 0.0
+    return max(0.0, config["openai"]["monthly_budget_usd"] - spent - reserved)
 
 def can_process_batch(estimated_cost: float) -> bool:
     """Determine if a batch can be processed within budget."""
@@ -84,18 +273,50 @@ def can_process_batch(estimated_cost: float) -> bool:
         log.warning(f"Budget limit reached. Estimated cost ${estimated_cost:.2f}, remaining ${remaining:.2f}")
     return estimated_cost <= remaining
 
-def add_cost(estimated_cost: float):
-    """Add estimated cost to the current month's total."""
-    tracking_data = load_json(COST_TRACKING_FILE)
-    current_month = get_current_month()
+def reserve_budget(amount: float, label: str = "batch") -> str | None:
+    """
+    Atomically set aside `amount` of this month's budget before submitting a batch.
+
+    Returns a reservation ID, or None when the budget cannot cover it. Release the
+    reservation once the batch has run; its real spend is tracked from usage.
+    Reservations left behind by a crashed process expire after
+    budget_reservation_ttl_seconds.
+    """
+    month = get_current_month()
+    reservation_id = uuid.uuid4().hex
 
-    if tracking_data["current_month"] != current_month:
-        tracking_data["current_month"] = current_month
-        tracking_data["current_month_total"] = 0.0
+    def write(conn):
+        now = time.time()
+        conn.execute("DELETE FROM reservations WHERE expires_at <= ?", (now,))
+        row = conn.execute("SELECT spent FROM monthly_totals WHERE month = ?", (month,)).fetchone()
+        remaining = config["openai"]["monthly_budget_usd"] - (row[0] if row else 0.0) - _reserved(conn, month, now)
+        if amount > remaining:
+            return remaining
+        conn.execute(
+            "INSERT INTO reservations (id, month, label, amount, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (reservation_id, month, label, amount, now + RESERVATION_TTL_SECONDS)
+        )
+        return None
 
-    tracking_data["monthly_costs"].setdefault(current_month, 0.0)
-    tracking_data["monthly_costs"][current_month] += estimated_cost
-    tracking_data["current_month_total"] += estimated_cost
+    short = _transaction(write)
+    if short is not None:
+        log.warning(f"Budget limit reached. Estimated {label} cost ${amount:.2f}, remaining ${max(0.0, short):.2f}")
+        return None
+    return reservation_id
 
-    save_json(tracking_data, COST_TRACKING_FILE)
-    log.info(f"Added estimated cost: ${estimated_cost:.4f}")
+def release_reservation(reservation_id: str):
+    """Return a reservation's unspent hold to the budget."""
+    if not reservation_id:
+        return
+    try:
+        _transaction(lambda conn: conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,)))
+    except sqlite3.Error as e:
+        print(f"[SQLite release_reservation Error] {e}")
+
+def add_cost(estimated_cost: float):
+    """Add a cost to the current month's total (measured usage goes through track_api_usage)."""
+    try:
+        _transaction(lambda conn: _record(conn, get_current_month(), "manual", None, 0, 0, 0, 0, estimated_cost))
+    except sqlite3.Error as e:
+        print(f"[SQLite add_cost Error] {e}")
+    log.info(f"Added cost: ${estimated_cost:.4f}")
@@ -4,73 +4,264 @@ import json
 import uuid
 import os
 import glob
+import fcntl
 from datetime import datetime
 import time
 from reddit.scraper import scrape_all_configured_subreddits
-from db.writer import insert_post, update_post_filter_scores, update_post_insight, mark_insight_processed,update_post_cluster
-from db.reader import get_top_insights_from_today, get_posts_by_ids
+from db.writer import update_posts_filter_scores, update_posts_insight, mark_insights_processed, update_posts_cluster
+from db.reader import get_top_insights_from_today, get_posts_by_ids, get_high_potential_ids, load_history_cache
 from db.schema import create_tables
-from gpt.filters import prepare_batch_payload as prepare_filter_batch, estimate_batch_cost as estimate_filter_cost
+from gpt.filters import (
+    prepare_batch_payload as prepare_filter_batch, estimate_batch_cost as estimate_filter_cost, unpack_filter_response,
+    FILTER_PACK_SIZE
+)
+from gpt.prefilter import apply_prefilter
+from gpt.near_duplicates import remove_near_duplicates, settle_near_duplicates
 from gpt.insights import prepare_insight_batch, estimate_insight_cost,prepare_cluster_batch
 from gpt.batch_api import generate_batch_payload, process_batch_async, download_batch_results, add_estimated_batch_cost
 from db.cleaner import clean_old_entries
-from scheduler.cost_tracker import initialize_cost_tracking, can_process_batch
+from scheduler.cost_tracker import (
+    initialize_cost_tracking, can_process_batch, reserve_budget, release_reservation, start_run, log_run_usage
+)
 from config.config_loader import get_config
 from utils.logger import setup_logger
-from utils.helpers import ensure_directory_exists, sanitize_text
+from utils.helpers import ensure_directory_exists, sanitize_text, load_jsonl
+from utils.metrics import StageClock, start_run_metrics, flush_run_metrics, record as record_metric
 import asyncio
 log = setup_logger()
 config = get_config()
-async def submit_with_backoff(batch_items, model, generate_file_fn=None, label="filter") -> str | None:
+
+# Manifests of recovered work, still locked by this process until their items are resubmitted: label -> [(path, file)]
+_claims = {}
+
+async def submit_with_backoff(batch_items, model, generate_file_fn=None, label="filter", client=None, limiter=None) -> str | None:
     """
-    提交 Ark batch 请求，带退避重试。
+    提交 Ark 请求。失败的请求在 worker 队列内单独带抖动退避重试（见 process_batch_async），
+    只有最终仍失败的条目写入 data/deferred，留给下次运行重试。
+    结果在每个请求完成时追加写入 .partial 文件；进程中断后由 recover_interrupted_batches 续跑。
+    预估费用在提交前从预算中预留 (reserve_budget)，预算不足时整批推迟到下次运行。
     注意：generate_file_fn 在 Ark 模式下已无意义，这里保留参数只是为了兼容调用。
+    client/limiter 由长时间运行的阶段传入，在多个批次之间共享（见 process_batch_async）。
+    账本和清单文件的读写放在线程池里执行，不阻塞事件循环。
     """
-    delay = 10
-    max_retries = 20
+    loop = asyncio.get_running_loop()
+    log.info(f"Submitting {label} batch with {len(batch_items)} items...")
+    # Hold the predicted cost so concurrent sub-batches and pipelines cannot overspend together
+    estimated_cost = await loop.run_in_executor(None, add_estimated_batch_cost, batch_items, model)
+    reservation = await loop.run_in_executor(None, reserve_budget, estimated_cost, label)
+    if reservation is None:
+        log.error(f"Insufficient budget for {label} batch.")
+        await loop.run_in_executor(None, save_failed_batch, batch_items, label)
+        return None
+
+    try:
+        return await _submit_reserved(batch_items, model, label, client, limiter)
+    finally:
+        await loop.run_in_executor(None, release_reservation, reservation)
+
+def open_manifest(path, batch_items):
+    """Write a batch's request manifest and keep it locked while the batch runs."""
+    manifest = open_locked(path, "w")
+    write_jsonl(manifest, batch_items)
+    return manifest
+
+async def _submit_reserved(batch_items, model, label, client, limiter) -> str | None:
+    loop = asyncio.get_running_loop()
+    batch_id = uuid.uuid4().hex
+    manifest_path, partial_path, result_path = inflight_paths(label, batch_id)
+    # The lock tells recover_interrupted_batches in other pipelines that this batch is still running
+    manifest = await loop.run_in_executor(None, open_manifest, manifest_path, batch_items)
+
+    try:
+        requests = generate_batch_payload(batch_items, model)
+        use_cache = (config["openai"].get("cache_input", False)
+                     and label not in config["openai"].get("cache_bypass_stages", []))
+        results, errors = await process_batch_async(
+            requests, model, use_cache=use_cache, result_path=partial_path, stage=label,
+            client=client, limiter=limiter
+        )
+    except Exception as e:
+        log.error(f"❌ {label.capitalize()} batch failed: {str(e)}. Left in flight for the next run to resume.")
+        manifest.close()
+        return None
 
-    for attempt in range(1, max_retries + 1):
+    def finish():
+        # 保存结果: the streamed .partial file becomes the final result file
         try:
-            log.info(f"[Retry {attempt}/{max_retries}] Submitting {label} batch with {len(batch_items)} items...")
-
-            # 生成 batch_id
-            requests = generate_batch_payload(batch_items, model)
-
-            # 提交任务
-            results, errors = await process_batch_async(requests, model,max_workers=len(requests)//10 or 10)
-
-            if errors:
-                log.warning(f"Batch contains {len(errors)} errors. Retrying...")
-                if attempt >= max_retries:
-                    save_failed_batch(errors, label)
-                    return None
-                await asyncio.sleep(delay)
-                delay = min(delay * 2, 3600)
-                continue
-            # 保存结果
-            batch_id = uuid.uuid4().hex
-            result_path = f"data/batch_responses/{label}_result_{batch_id}.jsonl"
+            if results:
+                os.replace(partial_path, result_path)
+            elif os.path.exists(partial_path):
+                os.remove(partial_path)
+        except OSError as e:
+            log.warning(f"Could not move {partial_path} into place ({e}); writing the results from memory")
             download_batch_results(results, result_path)
-            log.info(f"{label.capitalize()} batch completed. Results saved to {result_path}")
-            return result_path
-        except Exception as e:
-            log.error(f"Error in {label} batch retry #{attempt}: {str(e)}")
-            await asyncio.sleep(delay)
-            delay = min(delay * 2, 3600)
+        remove_manifest(manifest_path, manifest)
+
+        if errors:
+            failed_ids = {error["custom_id"] for error in errors}
+            log.warning(f"{len(failed_ids)} {label} requests still failing after retries. Deferring them.")
+            save_failed_batch([item for item in batch_items if item.get("id") in failed_ids], label)
+
+    await loop.run_in_executor(None, finish)
+    if not results:
+        return None
 
-    # 全部失败
-    log.error(f"❌ {label.capitalize()} batch failed after {max_retries} retries. Deferring.")
-    save_failed_batch(batch_items, label)
-    return None
+    log.info(f"{label.capitalize()} batch completed. {len(results)} results saved to {result_path}")
+    return result_path
+
+def inflight_paths(label, batch_id) -> tuple[str, str, str]:
+    """(request manifest, streamed partial results, final results) for one submitted batch."""
+    return (
+        os.path.join("data/deferred", f"inflight_{label}_{batch_id}.jsonl"),
+        f"data/batch_responses/{label}_result_{batch_id}.jsonl.partial",
+        f"data/batch_responses/{label}_result_{batch_id}.jsonl",
+    )
+
+def open_locked(path, mode="r+"):
+    """
+    Open `path` holding an exclusive flock, or return None if it is missing or another
+    batch (in this or another process) holds the lock. The lock dies with the process.
+    """
+    if mode == "w":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        f = open(path, mode, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    # The owner may have finished (and removed the file) between our open and lock
+    if not os.path.exists(path) or not os.path.samestat(os.fstat(f.fileno()), os.stat(path)):
+        f.close()
+        return None
+    return f
+
+def write_jsonl(f, items):
+    """Replace the contents of an open file with `items`, one JSON object per line."""
+    f.seek(0)
+    f.truncate()
+    for item in items:
+        f.write(json.dumps(item) + "\n")
+    f.flush()
+
+def remove_manifest(path, f):
+    try:
+        os.remove(path)
+    except OSError as e:
+        log.warning(f"Failed to remove manifest {path}: {e}")
+    f.close()
+
+def settle_claims(label):
+    """The recovered items of a stage have been resubmitted (or re-deferred): drop their manifests."""
+    for path, f in _claims.pop(label, []):
+        remove_manifest(path, f)
+
+def release_claims():
+    """Unlock recovered manifests that were not resubmitted (budget, early exit); the next run resumes them."""
+    for label, claims in list(_claims.items()):
+        for path, f in claims:
+            f.close()
+            log.info(f"Kept unsent {label} items in {path} for the next run")
+    _claims.clear()
 
 def save_failed_batch(batch_items, label, folder="data/deferred"):
     os.makedirs(folder, exist_ok=True)
     out_path = os.path.join(folder, f"failed_{label}.jsonl")
-    with open(out_path, "w", encoding="utf-8") as f:
+    while True:
+        f = open(out_path, "a", encoding="utf-8")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)  # waits while load_deferred_batch is claiming the file
+        if os.path.exists(out_path) and os.path.samestat(os.fstat(f.fileno()), os.stat(out_path)):
+            break
+        f.close()  # claimed (renamed) meanwhile; append to a fresh file instead
+    with f:
         for item in batch_items:
             f.write(json.dumps(item) + "\n")
     log.warning(f"Deferred {len(batch_items)} {label} items to {out_path}")
 
+def load_deferred_batch(label, folder="data/deferred") -> list:
+    """
+    Claim the items deferred by earlier runs for a stage.
+
+    The file is renamed to a locked in-flight manifest rather than deleted, so the items
+    survive an early return or crash until settle_claims(label); new deferrals start a fresh file.
+    """
+    path = os.path.join(folder, f"failed_{label}.jsonl")
+    deferred = open_locked(path)
+    if deferred is None:
+        return []
+    manifest_path, _, _ = inflight_paths(label, uuid.uuid4().hex)
+    os.replace(path, manifest_path)
+    _claims.setdefault(label, []).append((manifest_path, deferred))
+    items = [item for item in load_jsonl(manifest_path) if "messages" in item]
+    log.info(f"Retrying {len(items)} deferred {label} items from {path}")
+    return items
+
+def recover_interrupted_batches(label) -> tuple[list, list, list]:
+    """
+    Finish off batches of a stage that were cut short (crash, Ctrl-C).
+
+    Manifests locked by a batch that is still running are left alone. Responses already
+    streamed to a .partial file are kept as a regular result file; the manifest keeps the
+    items still without a response, locked until settle_claims/release_claims.
+    Returns (items still without a response, answered items, result paths).
+    """
+    pending, answered_items, result_paths = [], [], []
+    prefix = f"inflight_{label}_"
+    for manifest_path in glob.glob(os.path.join("data/deferred", f"{prefix}*.jsonl")):
+        if any(path == manifest_path for path, _ in _claims.get(label, [])):
+            continue
+        manifest = open_locked(manifest_path)
+        if manifest is None:
+            continue  # another pipeline's batch is still running
+        batch_id = os.path.basename(manifest_path)[len(prefix):-len(".jsonl")]
+        _, partial_path, result_path = inflight_paths(label, batch_id)
+
+        records = load_jsonl(partial_path)
+        done_ids = {record["custom_id"] for record in records if "custom_id" in record}
+        if records:
+            # Rewrite rather than rename: drops a half-written last line
+            download_batch_results(records, result_path)
+            result_paths.append(result_path)
+        try:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        except OSError as e:
+            log.warning(f"Failed to remove {partial_path}: {e}")
+
+        items = load_jsonl(manifest_path)
+        remaining = [item for item in items if item.get("id") not in done_ids]
+        if remaining:
+            write_jsonl(manifest, remaining)  # kept until the items are resubmitted
+            _claims.setdefault(label, []).append((manifest_path, manifest))
+        else:
+            remove_manifest(manifest_path, manifest)
+
+        log.info(f"Resumed interrupted {label} batch {batch_id}: {len(done_ids)} answered, {len(remaining)} to resubmit")
+        pending.extend(remaining)
+        answered_items.extend(item for item in items if item.get("id") in done_ids)
+    return pending, answered_items, result_paths
+
+def resume_stage(batch, label) -> tuple[list, list, list]:
+    """
+    Fold deferred and interrupted work of a stage into its new batch.
+
+    Items that already have a response are dropped; returns (batch, recovered result paths,
+    the recovered items those results answer). Call settle_claims(label) once the batch
+    has been submitted.
+    """
+    pending, answered_items, result_paths = recover_interrupted_batches(label)
+    batch_ids = {item.get("id") for item in answered_items}
+    merged = []
+    for item in load_deferred_batch(label) + pending + batch:
+        if item.get("id") in batch_ids:
+            continue
+        batch_ids.add(item.get("id"))
+        merged.append(item)
+    return merged, result_paths, answered_items
+
 def is_valid_post(post):
     """Ensure post has valid title and body after sanitization."""
     title = sanitize_text(post.get("title", ""))
@@ -114,30 +305,165 @@ def clean_old_batch_files(folder="data/batch_responses", days_old=None):
                     log.warning(f"Failed to delete old file {path}: {e}")
     log.info(f"Cleaned up {deleted} old batch response files older than {days_old} days.")
 
-def get_high_potential_ids_from_filter_results(score_threshold=7.0):
-    high_ids = set()
+def weighted_filter_score(scores: dict) -> float:
     weights = config["scoring"]
-    for path in glob.glob("data/batch_responses/filter_result_*.jsonl"):
-        with open(path, "r") as f:
-            for line in f:
-                try:
+    return (
+        scores["relevance_score"] * weights["relevance_weight"] +
+        scores["emotional_intensity"] * weights["emotion_weight"] +
+        scores["pain_point_clarity"] * weights["pain_point_weight"]
+    )
+
+def pack_post_ids(batch) -> dict:
+    """Packed request ID -> IDs of the posts it was sent with."""
+    return {
+        item.get("id"): {post["id"] for post in item["meta"]["posts"]}
+        for item in batch if "posts" in item.get("meta", {})
+    }
+
+def ingest_filter_results(path, run_id, batch, score_threshold=7.0) -> set:
+    """
+    Store the scores of one filter result file, once, as soon as it is produced.
+
+    Every parsed result gets its weighted score and `run_id` written to `posts`;
+    returns the IDs at or above the threshold. `batch` is what was submitted: a
+    packed answer only counts for the posts of its own pack.
+    """
+    packs = pack_post_ids(batch)
+    scored = []
+    for result in load_jsonl(path):
+        try:
+            unpacked = unpack_filter_response(result, packs.get(result.get("custom_id"), ()))
+        except Exception as e:
+            log.error(f"Error parsing filter result line: {e}")
+            continue
+        for post_id, scores in unpacked.items():
+            try:
+                scored.append((post_id, scores, weighted_filter_score(scores)))
+            except Exception as e:
+                log.error(f"Error scoring filter result for {post_id}: {e}")
+    update_posts_filter_scores(scored, run_id=run_id)
+    return {post_id for post_id, _, weighted_score in scored if weighted_score >= score_threshold}
+
+async def submit_filter_batch(batch, model, client=None, limiter=None) -> list[str]:
+    """
+    Submit one filter sub-batch and return its result files.
+
+    Posts that a packed response left out (or answered unparseably) are re-sent as
+    single-item requests, so packing never silently drops a post.
+    """
+    result_path = await submit_with_backoff(
+        batch_items=batch,
+        model=model,
+        generate_file_fn=generate_batch_payload,
+        label="filter",
+        client=client,
+        limiter=limiter
+    )
+    if not result_path:
+        return []
+    return [result_path] + await resend_missing_posts([result_path], batch, model, client, limiter)
+
+def find_missing_posts(result_paths, batch) -> list:
+    """Posts of `batch` that its packed responses in `result_paths` left out."""
+    packs = pack_post_ids(batch)
+    answered_packs, scored_ids = set(), set()
+    for result_path in result_paths:
+        for result in load_jsonl(result_path):
+            answered_packs.add(result.get("custom_id"))
+            try:
+                scored_ids.update(unpack_filter_response(result, packs.get(result.get("custom_id"), ())))
+            except Exception as e:
+                log.warning(f"Unreadable packed filter response {result.get('custom_id')}: {e}")
+    return [
+        post
+        for item in batch if item.get("id") in answered_packs
+        for post in item.get("meta", {}).get("posts", []) if post["id"] not in scored_ids
+    ]
+
+async def resend_missing_posts(result_paths, batch, model, client=None, limiter=None) -> list[str]:
+    """Re-send, one per request, the posts of `batch` that its packed responses in `result_paths` left out."""
+    missing = await asyncio.get_running_loop().run_in_executor(None, find_missing_posts, result_paths, batch)
+    if not missing:
+        return []
+
+    log.warning(f"{len(missing)} posts missing from packed filter responses; re-sending them one per request")
+    single_path = await submit_with_backoff(
+        batch_items=prepare_filter_batch(missing, pack_size=1),
+        model=model,
+        generate_file_fn=generate_batch_payload,
+        label="filter",
+        client=client,
+        limiter=limiter
+    )
+    return [single_path] if single_path else []
+
+def read_insight_results(paths) -> tuple[list, list]:
+    """Parse insight result files into ([(post_id, insight)], [post_id])."""
+    insight_post_id = []
+    insights = []
+    try:
+        for insight_path in paths:
+            with open(insight_path, "r", encoding="utf-8") as f:
+                for line in f:
                     result = json.loads(line)
                     post_id = result["custom_id"]
                     content = result["response"]["choices"][0]["message"]["content"]
-                    scores = json.loads(content)
-                    weighted_score = (
-                        scores["relevance_score"] * weights["relevance_weight"] +
-                        scores["emotional_intensity"] * weights["emotion_weight"] +
-                        scores["pain_point_clarity"] * weights["pain_point_weight"]
-                    )
-                    if weighted_score >= score_threshold:
-                        high_ids.add(post_id)
-                        update_post_filter_scores(post_id, scores)
-                    # log.info(f"Path {path} Post {post_id} scored {weighted_score:.2f} (Threshold: {score_threshold})")
-                except Exception as e:
-                    log.error(f"Error parsing filter result line: {e}")
-                    continue
-    return high_ids
+                    try:
+                        insights.append((post_id, json.loads(content)))
+                        insight_post_id.append(post_id)
+                    except Exception as e:
+                        log.error(f"Error parsing insight for post {post_id}: {str(e)}")
+    except Exception as e:
+        log.error(f"Error reading insight results: {str(e)}")
+    return insights, insight_post_id
+
+def run_cluster_stage(insight_post_id):
+    """Step 6: cluster the pain points of the posts that just received insights."""
+    # 聚合相同title下的痛点，全部放在 Post Pain point 下面
+    # 1. 获取所有已经 insight_processed 的 comment 和 post
+    insight_post = get_posts_by_ids(insight_post_id, require_unprocessed=False)
+    # 2. 按 title 聚合同一个帖子下的所有 pain_point
+    cluster_batch, recovered_cluster_paths, _ = resume_stage(prepare_cluster_batch(insight_post), "cluster")
+    model_deep = config["openai"]["model_deep"]
+    cluster_batchs = split_batch_by_token_limit(cluster_batch, model_deep)
+    all_cluster_paths = list(recovered_cluster_paths)
+
+    for i, batch in enumerate(cluster_batchs):
+        log.info(f"Submitting insight sub-batch {i + 1}/{len(cluster_batchs)} with {len(batch)} entries...")
+        cluster_path = asyncio.run(submit_with_backoff(
+            batch_items=batch,
+            model=model_deep,
+            generate_file_fn=None,
+            label="cluster"
+        ))
+        if not cluster_path:
+            continue
+
+        all_cluster_paths.append(cluster_path)
+    settle_claims("cluster")
+    # 写入到数据库中
+    clusters = []
+    try:
+        for cluster_path in all_cluster_paths:
+            with open(cluster_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    result = json.loads(line)
+                    post_id = result["custom_id"]
+                    try:
+                        clusters.append((post_id, result["response"]["choices"][0]["message"]["content"]))
+                    except Exception as e:
+                        log.error(f"Error parsing insight for post {post_id}: {str(e)}")
+    except Exception as e:
+        log.error(f"Error reading insight results: {str(e)}")
+    update_posts_cluster(clusters)
+
+def log_top_posts():
+    output_limit = config["scoring"]["output_top_n"]
+    top_posts = get_top_insights_from_today(limit=output_limit)      
+    log.info(f"✅ Pipeline finished. Found {len(top_posts)} qualified leads.")
+ 
+    for i, post in enumerate(top_posts):
+        log.info(f"{i}. [{post['subreddit']}] {post['title']} — Pain Point: {post['pain_point']} | ROI: {post['roi_weight']} | Tags: {post['tags']} - {post['url']}")
 
 def run_daily_pipeline():
     log.info("\U0001F680 Starting Reddit scraping and analysis pipeline")
@@ -148,10 +474,40 @@ def run_daily_pipeline():
     clean_old_batch_files()
     create_tables()
     initialize_cost_tracking()
-
+    run_id = uuid.uuid4().hex
+    start_run(run_id)
+    start_run_metrics(run_id)
+    clock = StageClock()
+    try:
+        run_pipeline_steps(run_id, clock)
+    finally:
+        release_claims()
+        clock.stop()
+        flush_run_metrics()
+
+def run_pipeline_steps(run_id, clock):
+    """Steps 1-6 of one run; `clock` times each step for the run's metrics."""
+    clock.enter("clean")
     log.info("Step 1: Cleaning old database entries...")
     clean_old_entries()
 
+    if config["database"].get("history_cache", True):
+        log.info(f"Loaded {load_history_cache()} history IDs into the dedup cache.")
+
+    if config.get("pipeline", {}).get("streaming", False):
+        # Steps 2-5 overlap: scraped items flow straight into filter and insight
+        from scheduler.streaming import run_streaming_stages
+        clock.enter("streaming")
+        insight_post_id = run_streaming_stages(run_id)
+        if insight_post_id:
+            clock.enter("cluster")
+            log.info("Step 6: Clustering similar insights...")
+            run_cluster_stage(insight_post_id)
+            log_top_posts()
+        log_run_usage()
+        return
+
+    clock.enter("scrape")
     log.info("Step 2: Scraping Reddit posts...")
     scraped_posts = scrape_all_configured_subreddits()
     # 这里可以改成 从数据库中获取
@@ -162,39 +518,53 @@ def run_daily_pipeline():
     log.info(f"Found {len(scraped_posts)} posts before filtering invalid entries...")
     scraped_posts = [p for p in scraped_posts if is_valid_post(p)]
     log.info(f"{len(scraped_posts)} posts remain after sanitization/validation.")
+    record_metric("scrape", "valid_items", len(scraped_posts))
 
     if not scraped_posts:
         log.warning("No valid posts after sanitization. Exiting pipeline.")
         return
 
+    clock.enter("prefilter")
+    scraped_posts = apply_prefilter(scraped_posts, pack_size=FILTER_PACK_SIZE)
+    scraped_posts, near_duplicates, signature_rows = remove_near_duplicates(scraped_posts, pack_size=FILTER_PACK_SIZE)
+    record_metric("prefilter", "items", len(scraped_posts))
+    record_metric("prefilter", "near_duplicates", len(near_duplicates))
+    if not scraped_posts:
+        log.warning("No posts left after the pre-filter and near-duplicate check. Exiting pipeline.")
+        return
+
+    clock.enter("filter")
     log.info("Step 3: Preparing posts for filtering...")
-    filter_batch = prepare_filter_batch(scraped_posts)
-    filter_cost = estimate_filter_cost(scraped_posts)
+    model_filter = config["openai"]["model_filter"]
+    filter_batch, recovered_filter_paths, answered_items = resume_stage(prepare_filter_batch(scraped_posts), "filter")
+    recovered_filter_paths += asyncio.run(resend_missing_posts(recovered_filter_paths, answered_items, model_filter))
+    for path in recovered_filter_paths:
+        ingest_filter_results(path, run_id, answered_items)
+    filter_cost = estimate_filter_cost(filter_batch)
     log.info(f"Estimated cost for filtering: ${filter_cost:.2f}")
 
     if not can_process_batch(filter_cost):
         log.error("Insufficient budget for filtering. Exiting pipeline.")
         return
 
-    model_filter = config["openai"]["model_filter"]
     filter_batches = split_batch_by_token_limit(filter_batch, model_filter)
+    record_metric("filter", "items", len(scraped_posts))
 
     for i, batch in enumerate(filter_batches):
         log.info(f"Submitting sub-batch {i + 1}/{len(filter_batches)} with {len(batch)} entries...")
-        add_estimated_batch_cost(batch, model_filter)
-
-        results_path = asyncio.run(submit_with_backoff(
-            batch_items=batch,
-            model=model_filter,
-            generate_file_fn=generate_batch_payload,
-            label="filter"
-        ))
-
-        if not results_path:
-            continue  # move on to next batch
-
+        for results_path in asyncio.run(submit_filter_batch(batch, model_filter)):
+            ingest_filter_results(results_path, run_id, batch)
+    settle_claims("filter")
+    unscored_duplicates = settle_near_duplicates(near_duplicates, signature_rows)
+    if unscored_duplicates:
+        for batch in split_batch_by_token_limit(prepare_filter_batch(unscored_duplicates), model_filter):
+            for results_path in asyncio.run(submit_filter_batch(batch, model_filter)):
+                ingest_filter_results(results_path, run_id, batch)
+
+    clock.enter("insight")
     log.info("Step 4: Selecting high-potential posts from filter results...")
-    high_potential_ids = get_high_potential_ids_from_filter_results()
+    high_potential_ids = get_high_potential_ids(run_id)
+    record_metric("filter", "high_potential", len(high_potential_ids))
     if not high_potential_ids:
         log.info("No high-value posts found. Exiting pipeline.")
         return
@@ -204,7 +574,7 @@ def run_daily_pipeline():
         log.info("No new posts left for deep insight. Exiting pipeline.")
         return
 
-    insight_batch = prepare_insight_batch(deep_posts)
+    insight_batch, recovered_insight_paths, _ = resume_stage(prepare_insight_batch(deep_posts), "insight")
     insight_cost = estimate_insight_cost(insight_batch)
     log.info(f"Estimated cost for insight analysis: ${insight_cost:.2f}")
 
@@ -216,12 +586,10 @@ def run_daily_pipeline():
     log.info(f"Preparing {len(insight_batch)} posts for deep insight...")
     model_deep = config["openai"]["model_deep"]
     insight_batches = split_batch_by_token_limit(insight_batch, model_deep)
-    all_insight_paths = []
+    all_insight_paths = list(recovered_insight_paths)
 
     for i, batch in enumerate(insight_batches):
         log.info(f"Submitting insight sub-batch {i + 1}/{len(insight_batches)} with {len(batch)} entries...")
-        add_estimated_batch_cost(batch, model_deep)
-
         insight_path = asyncio.run(submit_with_backoff(
             batch_items=batch,
             model=model_deep,
@@ -233,71 +601,20 @@ def run_daily_pipeline():
             continue
 
         all_insight_paths.append(insight_path)
+    settle_claims("insight")
 
     log.info("Step 5: Updating posts with deep insights...")
-    insight_post_id = []
-    try:
-        for insight_path in all_insight_paths:
-            with open(insight_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    result = json.loads(line)
-                    post_id = result["custom_id"]
-                    content = result["response"]["choices"][0]["message"]["content"]
-                    try:
-                        insight = json.loads(content)
-                        update_post_insight(post_id, insight)
-                        mark_insight_processed(post_id)
-                        insight_post_id.append(post_id)
-                    except Exception as e:
-                        log.error(f"Error parsing insight for post {post_id}: {str(e)}")
-    except Exception as e:
-        log.error(f"Error reading insight results: {str(e)}")
+    insights, insight_post_id = read_insight_results(all_insight_paths)
+    update_posts_insight(insights)
+    mark_insights_processed(insight_post_id)
+    record_metric("insight", "items", len(insight_post_id))
 
+    clock.enter("cluster")
     log.info("Step 6: Clustering similar insights...")
-    # 聚合相同title下的痛点，全部放在 Post Pain point 下面
-    # 1. 获取所有已经 insight_processed 的 comment 和 post
-    insight_post = get_posts_by_ids(insight_post_id, require_unprocessed=False)
-    # 2. 按 title 聚合同一个帖子下的所有 pain_point
-    cluster_batch = prepare_cluster_batch(insight_post)
-    model_deep = config["openai"]["model_deep"]
-    cluster_batchs = split_batch_by_token_limit(cluster_batch, model_deep)
-    all_cluster_paths = []
-
-    for i, batch in enumerate(cluster_batchs):
-        log.info(f"Submitting insight sub-batch {i + 1}/{len(cluster_batchs)} with {len(batch)} entries...")
-        cluster_path = asyncio.run(submit_with_backoff(
-            batch_items=batch,
-            model=model_deep,
-            generate_file_fn=None,
-            label="cluster"
-        ))
-        if not cluster_path:
-            continue
+    run_cluster_stage(insight_post_id)
 
-        all_cluster_paths.append(cluster_path)
-    # 写入到数据库中
-    try:
-        for cluster_path in all_cluster_paths:
-            with open(cluster_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    result = json.loads(line)
-                    post_id = result["custom_id"]
-                    content = result["response"]["choices"][0]["message"]["content"]
-                    try:                        
-                        update_post_cluster(post_id, content)
-                        mark_insight_processed(post_id)
-                    except Exception as e:
-                        log.error(f"Error parsing insight for post {post_id}: {str(e)}")
-    except Exception as e:
-        log.error(f"Error reading insight results: {str(e)}")
-
-
-    output_limit = config["scoring"]["output_top_n"]
-    top_posts = get_top_insights_from_today(limit=output_limit)      
-    log.info(f"✅ Pipeline finished. Found {len(top_posts)} qualified leads.")
- 
-    for i, post in enumerate(top_posts):
-        log.info(f"{i}. [{post['subreddit']}] {post['title']} — Pain Point: {post['pain_point']} | ROI: {post['roi_weight']} | Tags: {post['tags']} - {post['url']}")
+    log_top_posts()
+    log_run_usage()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+# scheduler/streaming.py
+
+import asyncio
+import time
+from reddit.scraper import scrape_all_configured_subreddits
+from db.reader import get_posts_by_ids
+from db.writer import update_posts_insight, mark_insights_processed
+from gpt.filters import prepare_batch_payload as prepare_filter_batch, estimate_batch_cost as estimate_filter_cost, FILTER_PACK_SIZE
+from gpt.prefilter import apply_prefilter
+from gpt.near_duplicates import remove_near_duplicates, settle_near_duplicates
+from gpt.insights import prepare_insight_batch, estimate_insight_cost
+from gpt.batch_api import generate_batch_payload, create_batch_client, create_concurrency_limiter
+from scheduler.cost_tracker import can_process_batch
+from scheduler.runner import (
+    submit_with_backoff, submit_filter_batch, resend_missing_posts, resume_stage, settle_claims, is_valid_post,
+    split_batch_by_token_limit, ingest_filter_results, read_insight_results
+)
+from config.config_loader import get_config
+from utils.logger import setup_logger
+from utils.metrics import record as record_metric
+
+log = setup_logger()
+config = get_config()
+
+PIPELINE_CONFIG = config.get("pipeline", {})
+QUEUE_SIZE = PIPELINE_CONFIG.get("queue_size", 500)
+FILTER_MICRO_BATCH = PIPELINE_CONFIG.get("filter_micro_batch", 100)
+INSIGHT_MICRO_BATCH = PIPELINE_CONFIG.get("insight_micro_batch", 20)
+MICRO_BATCH_WAIT_SECONDS = PIPELINE_CONFIG.get("micro_batch_wait_seconds", 5)
+
+_DONE = None  # End-of-stream marker put on a queue by its producer
+
+async def collect_micro_batch(queue, size, wait_seconds) -> tuple[list, bool]:
+    """
+    Take up to `size` items, waiting at most `wait_seconds` after the first one arrives.
+
+    Returns (items, finished); finished once the end-of-stream marker has been read.
+    """
+    first = await queue.get()
+    if first is _DONE:
+        return [], True
+
+    items = [first]
+    deadline = time.monotonic() + wait_seconds
+    while len(items) < size:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout)
+        except asyncio.TimeoutError:
+            break
+        if item is _DONE:
+            return items, True
+        items.append(item)
+    return items, False
+
+def scrape_into(queue, loop) -> int:
+    """Scraper thread: push each valid post into `queue`, blocking while the queue is full."""
+    def on_posts(posts):
+        for post in posts:
+            if is_valid_post(post):
+                asyncio.run_coroutine_threadsafe(queue.put(post), loop).result()
+
+    try:
+        return len(scrape_all_configured_subreddits(on_posts=on_posts))
+    finally:
+        asyncio.run_coroutine_threadsafe(queue.put(_DONE), loop).result()
+
+def _ingest_high_scorers(result_path, run_id, batch) -> list:
+    return get_posts_by_ids(ingest_filter_results(result_path, run_id, batch), require_unprocessed=True)
+
+def _dedupe(posts) -> tuple[list, list, list]:
+    return remove_near_duplicates(apply_prefilter(posts, pack_size=FILTER_PACK_SIZE), pack_size=FILTER_PACK_SIZE)
+
+def _within_budget(estimate_fn, batch) -> bool:
+    return can_process_batch(estimate_fn(batch))
+
+# SQLite reads and writes run on the default executor so they never stall the event loop
+async def forward_high_scorers(result_path, run_id, batch, insight_queue, stats):
+    """Store the scores of one filter result file and queue its high scorers for insight."""
+    loop = asyncio.get_running_loop()
+    deep_posts = await loop.run_in_executor(None, _ingest_high_scorers, result_path, run_id, batch)
+    stats["high_potential"] += len(deep_posts)
+    for post in deep_posts:
+        await insight_queue.put(post)
+
+async def filter_stage(run_id, filter_queue, insight_queue, stats):
+    loop = asyncio.get_running_loop()
+    model_filter = config["openai"]["model_filter"]
+    # One client and limiter for the whole stream, so the learned concurrency carries across micro-batches
+    client, limiter = create_batch_client(), create_concurrency_limiter()
+    pending = []
+    over_budget = False
+    finished = False
+
+    async def submit(batch):
+        for sub_batch in split_batch_by_token_limit(batch, model_filter):
+            stats["filtered"] += sum(len(item.get("meta", {}).get("posts", [item])) for item in sub_batch)
+            for result_path in await submit_filter_batch(sub_batch, model_filter, client, limiter):
+                await forward_high_scorers(result_path, run_id, sub_batch, insight_queue, stats)
+
+    try:
+        try:
+            pending, recovered_paths, answered_items = await loop.run_in_executor(None, resume_stage, [], "filter")
+            recovered_paths += await resend_missing_posts(recovered_paths, answered_items, model_filter, client, limiter)
+            for path in recovered_paths:
+                await forward_high_scorers(path, run_id, answered_items, insight_queue, stats)
+        except Exception as e:
+            log.error(f"Recovering filter batches failed: {str(e)}")
+
+        while not finished:
+            posts, finished = await collect_micro_batch(filter_queue, FILTER_MICRO_BATCH, MICRO_BATCH_WAIT_SECONDS)
+            stats["scraped"] += len(posts)
+            if over_budget:
+                continue  # keep draining so the scraper never blocks on a full queue
+
+            try:
+                posts, near_duplicates, signature_rows = await loop.run_in_executor(None, _dedupe, posts)
+                resubmitting = bool(pending)
+                batch = pending + prepare_filter_batch(posts)
+                pending = []  # on failure the claimed manifest keeps them for the next run
+                if not batch:
+                    continue
+
+                if not await loop.run_in_executor(None, _within_budget, estimate_filter_cost, batch):
+                    log.error("Insufficient budget for filtering. Dropping the rest of the stream.")
+                    over_budget = True
+                    continue
+
+                await submit(batch)
+                if resubmitting:
+                    await loop.run_in_executor(None, settle_claims, "filter")
+                unscored_duplicates = await loop.run_in_executor(None, settle_near_duplicates, near_duplicates, signature_rows)
+                if unscored_duplicates:
+                    await submit(prepare_filter_batch(unscored_duplicates))
+            except Exception as e:
+                log.error(f"Filter micro-batch failed: {str(e)}")
+    finally:
+        await insight_queue.put(_DONE)
+        await client.close()
+
+async def insight_stage(insight_queue, insight_post_id, stats):
+    loop = asyncio.get_running_loop()
+    model_deep = config["openai"]["model_deep"]
+    client, limiter = create_batch_client(), create_concurrency_limiter()
+    pending = []
+    over_budget = False
+    finished = False
+
+    def store(paths):
+        insights, post_ids = read_insight_results(paths)
+        update_posts_insight(insights)
+        mark_insights_processed(post_ids)
+        insight_post_id.extend(post_ids)
+
+    try:
+        pending, recovered_paths, _ = await loop.run_in_executor(None, resume_stage, [], "insight")
+        await loop.run_in_executor(None, store, recovered_paths)
+    except Exception as e:
+        # Keep draining the queue regardless, or the filter stage would block on it
+        log.error(f"Recovering insight batches failed: {str(e)}")
+
+    try:
+        while not finished:
+            posts, finished = await collect_micro_batch(insight_queue, INSIGHT_MICRO_BATCH, MICRO_BATCH_WAIT_SECONDS)
+            if over_budget:
+                continue
+
+            try:
+                resubmitting = bool(pending)
+                batch = pending + prepare_insight_batch(posts)
+                pending = []  # on failure the claimed manifest keeps them for the next run
+                if not batch:
+                    continue
+
+                if not await loop.run_in_executor(None, _within_budget, estimate_insight_cost, batch):
+                    log.error("Insufficient budget for insight analysis. Dropping the rest of the stream.")
+                    over_budget = True
+                    continue
+
+                for sub_batch in split_batch_by_token_limit(batch, model_deep):
+                    insight_path = await submit_with_backoff(
+                        batch_items=sub_batch,
+                        model=model_deep,
+                        generate_file_fn=generate_batch_payload,
+                        label="insight",
+                        client=client,
+                        limiter=limiter
+                    )
+                    if insight_path:
+                        await loop.run_in_executor(None, store, [insight_path])
+                if resubmitting:
+                    await loop.run_in_executor(None, settle_claims, "insight")
+            except Exception as e:
+                log.error(f"Insight micro-batch failed: {str(e)}")
+    finally:
+        await client.close()
+    stats["insights"] = len(insight_post_id)
+
+async def _run_stages(run_id) -> list:
+    loop = asyncio.get_running_loop()
+    filter_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    insight_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    stats = {"scraped": 0, "filtered": 0, "high_potential": 0, "insights": 0}
+    insight_post_id = []
+
+    outcomes = await asyncio.gather(
+        loop.run_in_executor(None, scrape_into, filter_queue, loop),
+        filter_stage(run_id, filter_queue, insight_queue, stats),
+        insight_stage(insight_queue, insight_post_id, stats),
+        return_exceptions=True
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            log.error(f"Streaming stage failed: {str(outcome)}")
+
+    log.info(
+        f"Streamed {stats['scraped']} valid posts: {stats['filtered']} sent to filter, "
+        f"{stats['high_potential']} high-potential, {stats['insights']} insights stored."
+    )
+    for name, value in stats.items():
+        record_metric("streaming", name, value)
+    return insight_post_id
+
+def run_streaming_stages(run_id) -> list:
+    """
+    Steps 2-5 as one pipeline: scraping, filtering and insight run concurrently.
+
+    Scraped posts flow through bounded queues into filter micro-batches, and the high
+    scorers of each filter result go straight on to insight. Only this run's filter
+    results (plus recovered ones) feed insight; budget checks apply per micro-batch.
+    Returns the post IDs that received insights, for the clustering step.
+    """
+    log.info("Steps 2-5: Streaming scrape → filter → insight...")
+    start_time = time.time()
+    insight_post_id = asyncio.run(_run_stages(run_id))
+    log.info(f"Streaming stages finished in {time.time() - start_time:.2f} seconds")
+    return insight_post_id
@@ -1,7 +1,11 @@
 import asyncio
 import uuid
 import json
-from gpt.batch_api import generate_batch_payload, submit_batch_job, poll_batch_status, download_batch_results
+from config.config_loader import get_config
+from gpt.batch_api import generate_batch_payload, process_batch_async, download_batch_results
+
+# 手动冒烟脚本：python test_batch_step3.py
+# 不想消耗额度时先启动 `python -m bench.ark_server`，并把 openai.base_url 指向它打印的地址
 
 def make_dummy_post(i):
     return {
@@ -13,16 +17,15 @@ def make_dummy_post(i):
         "meta": {"estimated_tokens": 10}
     }
 
-async def test_batch():
+async def run_batch_smoke():
     # 构造10条测试数据
     posts = [make_dummy_post(i) for i in range(10)]
-    model = "ep-bi-20250825173518-q44dq"  # Ark模型名，可根据实际情况修改
-    batch_id = await generate_batch_payload(posts, model)
-    await submit_batch_job(batch_id)
-    batch_info = await poll_batch_status(batch_id, timeout_seconds=300)
-    print(f"Batch status: {batch_info['status']}")
+    model = get_config()["openai"]["model_filter"]  # Ark模型名，可根据实际情况修改
+    requests = generate_batch_payload(posts, model)
+    results, failed = await process_batch_async(requests, model, use_cache=False, stage="smoke")
+    print(f"Batch finished: {len(results)} succeeded, {len(failed)} failed")
     save_path = f"data/batch_responses/test_batch_{uuid.uuid4().hex}.jsonl"
-    await download_batch_results(batch_id, save_path)
+    download_batch_results(results, save_path)
     print(f"Results saved to {save_path}")
     # 打印部分结果
     with open(save_path, "r", encoding="utf-8") as f:
@@ -32,4 +35,4 @@ async def test_batch():
             print(json.loads(line))
 
 if __name__ == "__main__":
-    asyncio.run(test_batch())
+    asyncio.run(run_batch_smoke())
@@ -0,0 +1,78 @@
+# utils/clients.py
+
+import os
+import threading
+from config.config_loader import get_config
+
+# Shared API clients, built on first use so importing a module never opens a connection.
+# The SDK imports live inside the factories: praw, openai and the Ark SDK are slow to import.
+ARK_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
+def ark_base_url() -> str:
+    """openai.base_url if set (e.g. the bench/ark_server.py stand-in), else Ark's endpoint."""
+    return get_config()["openai"].get("base_url") or ARK_BASE_URL
+
+_clients = {}
+_clients_lock = threading.Lock()
+_thread_clients = threading.local()
+_generation = 0  # bumped by reset_clients so per-thread clients are rebuilt too
+
+def _shared(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_reddit():
+    """
+    This thread's praw.Reddit client.
+
+    PRAW is not thread-safe (its session and authorizer are unlocked), so every thread
+    gets its own client; callers share one RedditRateLimiter across them instead.
+    """
+    cached = getattr(_thread_clients, "reddit", None)
+    if cached is not None and cached[0] == _generation:
+        return cached[1]
+    reddit = _build_reddit()
+    _thread_clients.reddit = (_generation, reddit)
+    return reddit
+
+def _build_reddit():
+    import praw
+    reddit_config = get_config()["reddit"]
+    credentials = {name: reddit_config[name] for name in ("client_id", "client_secret", "user_agent", "username", "password")}
+    requestor = {}
+    scraper_config = get_config()["scraper"]
+    mode = scraper_config.get("cassette_mode")
+    if mode:
+        # Record to / replay from a local cassette (reddit/cassette.py) instead of plain HTTP
+        from reddit.cassette import CassetteRequestor
+        requestor = {
+            "requestor_class": CassetteRequestor,
+            "requestor_kwargs": {"cassette_mode": mode, "cassette_path": scraper_config.get("cassette_path")},
+        }
+        if mode == "replay":
+            credentials = {name: value or "replay-only" for name, value in credentials.items()}
+    return praw.Reddit(**credentials, **requestor)
+
+def get_openai():
+    """OpenAI-compatible client pointed at Ark."""
+    def build():
+        from openai import OpenAI
+        return OpenAI(base_url=ark_base_url(), api_key=os.environ.get("ARK_API_KEY"))
+    return _shared("openai", build)
+
+def create_async_ark(**kwargs):
+    """A new AsyncArk client; async clients are bound to their event loop, so they are not shared."""
+    from volcenginesdkarkruntime import AsyncArk
+    return AsyncArk(api_key=os.getenv("ARK_API_KEY"), base_url=ark_base_url(), **kwargs)
+
+def reset_clients():
+    """Drop the shared clients, e.g. after reload_config() changed credentials."""
+    global _generation
+    with _clients_lock:
+        _clients.clear()
+        _generation += 1
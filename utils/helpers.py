@@ -1,10 +1,12 @@
 # utils/helpers.py
 
-import tiktoken
+import math
 import os
 import json
 import re
+import threading
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 from config.config_loader import get_config
 from utils.logger import setup_logger
@@ -13,17 +15,72 @@ from utils.logger import setup_logger
 log = setup_logger()
 config = get_config()
 
-# Default tokenizer for GPT-4, GPT-3.5
+# Default tokenizer for GPT-4, GPT-3.5 (loaded on first use: tiktoken may download its BPE files)
 DEFAULT_ENCODING = "cl100k_base"
-ENCODER = tiktoken.get_encoding(DEFAULT_ENCODING)
 
-def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
-    """Estimate the number of tokens for a given text and model."""
+TOKEN_ESTIMATION = config["openai"].get("token_estimation", "exact")
+TOKEN_ESTIMATION_THREADS = config["openai"].get("token_estimation_threads", 8)
+TOKEN_CALIBRATION_FILE = "data/token_calibration.json"
+DEFAULT_CHARS_PER_TOKEN = 4.0
+_calibration = None
+_calibration_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_encoder(model: str):
+    """Memoized tiktoken encoder for a model; unknown models (e.g. Ark endpoint IDs) use cl100k_base."""
+    import tiktoken
     try:
-        enc = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
-        enc = tiktoken.get_encoding("cl100k_base")
-    return len(enc.encode(text))
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def estimate_tokens(text: str, model: str = "gpt-4o-mini", mode: str = None) -> int:
+    """Estimate the number of tokens for a given text and model."""
+    return estimate_tokens_batch([text], model, mode)[0]
+
+def estimate_tokens_batch(texts: list[str], model: str = "gpt-4o-mini", mode: str = None) -> list[int]:
+    """
+    Estimate token counts for many texts at once.
+
+    "exact" encodes with tiktoken's multi-threaded encode_batch; "fast" divides the
+    character count by the chars-per-token ratio measured from real API usage.
+    """
+    mode = mode or TOKEN_ESTIMATION
+    if mode == "fast":
+        ratio = chars_per_token(model)
+        return [math.ceil(len(text or "") / ratio) for text in texts]
+    encoded = get_encoder(model).encode_batch([text or "" for text in texts], num_threads=TOKEN_ESTIMATION_THREADS)
+    return [len(tokens) for tokens in encoded]
+
+def _load_calibration() -> dict:
+    global _calibration
+    if _calibration is None:
+        _calibration = load_json(TOKEN_CALIBRATION_FILE)
+    return _calibration
+
+def chars_per_token(model: str) -> float:
+    """Calibrated characters per prompt token for a model (DEFAULT_CHARS_PER_TOKEN until measured)."""
+    with _calibration_lock:
+        sample = _load_calibration().get(model)
+    if not sample or not sample.get("tokens"):
+        return DEFAULT_CHARS_PER_TOKEN
+    return sample["chars"] / sample["tokens"]
+
+def record_token_usage(model: str, chars: int, prompt_tokens: int):
+    """Fold a measured (prompt characters, prompt_tokens) sample into the fast-mode calibration."""
+    if chars <= 0 or prompt_tokens <= 0:
+        return
+    with _calibration_lock:
+        calibration = _load_calibration()
+        sample = calibration.setdefault(model, {"chars": 0, "tokens": 0})
+        sample["chars"] += chars
+        sample["tokens"] += prompt_tokens
+        # Halve old evidence now and then so the ratio follows prompt changes
+        if sample["tokens"] > 10_000_000:
+            sample["chars"] //= 2
+            sample["tokens"] //= 2
+        ensure_directory_exists(os.path.dirname(TOKEN_CALIBRATION_FILE))
+        save_json(calibration, TOKEN_CALIBRATION_FILE)
 
 def ensure_directory_exists(path: str):
     """Create a directory if it does not exist."""
@@ -42,6 +99,19 @@ def load_json(filename: str) -> dict:
     with open(filename, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def load_jsonl(filename: str) -> list:
+    """Load records from a JSONL file, skipping blank or truncated lines."""
+    if not os.path.exists(filename):
+        return []
+    records = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
 def format_datetime(dt: datetime = None) -> str:
     """Return timezone-aware datetime in ISO 8601 format (UTC)."""
     if dt is None:
@@ -54,10 +124,11 @@ def days_ago(days: int) -> datetime:
 
 def truncate(text: str, max_tokens: int = 1000) -> str:
     """Truncate a string to fit within a token limit."""
-    tokens = ENCODER.encode(text or "")
+    encoder = get_encoder(DEFAULT_ENCODING)
+    tokens = encoder.encode(text or "")
     if len(tokens) <= max_tokens:
         return text
-    return ENCODER.decode(tokens[:max_tokens])
+    return encoder.decode(tokens[:max_tokens])
 
 def sanitize_text(text: str) -> str:
     """Remove emojis and non-printable unicode characters from the input."""
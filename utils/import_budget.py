@@ -0,0 +1,69 @@
+# utils/import_budget.py
+
+import argparse
+import subprocess
+import sys
+from config.config_loader import get_config
+
+# Usage: python -m utils.import_budget [module ...]
+# Imports each module in a fresh interpreter with `-X importtime` and fails when
+# one exceeds its startup.import_budget_ms entry.
+
+DEFAULT_BUDGETS_MS = {"main": 300, "scheduler.runner": 300}
+
+def measure_import(module: str) -> tuple[float, list]:
+    """(cumulative import time in ms, [(ms, direct import)] slowest first) for one module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+
+    total_us = None
+    children, direct_imports = [], []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        us = int(cumulative)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # -X importtime indents two spaces per level
+        if depth == 1:
+            children.append((us / 1000, name.strip()))
+        elif depth == 0:
+            # Nested imports are printed before their importer
+            if name.strip() == module:
+                total_us = us
+                direct_imports = children
+            children = []
+    if total_us is None:
+        raise RuntimeError(f"no -X importtime entry for {module}")
+    direct_imports.sort(reverse=True)
+    return total_us / 1000, direct_imports
+
+def check_budgets(modules: list = None) -> bool:
+    budgets = get_config().get("startup", {}).get("import_budget_ms") or DEFAULT_BUDGETS_MS
+    ok = True
+    for module in modules or budgets:
+        budget = budgets.get(module)
+        try:
+            total_ms, direct_imports = measure_import(module)
+        except RuntimeError as e:
+            print(f"✗ {e}")
+            ok = False
+            continue
+        over = budget is not None and total_ms > budget
+        ok = ok and not over
+        limit = f"{budget} ms" if budget is not None else "no budget"
+        print(f"{'✗' if over else '✓'} {module}: {total_ms:.0f} ms ({limit})")
+        for ms, name in direct_imports[:5]:
+            print(f"    {ms:8.1f} ms  {name}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check module import times against startup.import_budget_ms")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: every module with a budget)")
+    args = parser.parse_args()
+    sys.exit(0 if check_budgets(args.modules) else 1)
@@ -1,41 +1,122 @@
 # utils/logger.py
 
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 from config.config_loader import get_config
 
-def setup_logger():
-    """Configure and return a logger instance."""
-    config = get_config()
-    log_level = getattr(logging, config.get("log_level", "INFO"))
+_listener = None
+_setup_lock = threading.Lock()
 
-    # Ensure log directory exists
-    os.makedirs("logs", exist_ok=True)
+def setup_logger():
+    """
+    Return the shared "Market" logger, configuring it on the first call.
 
-    # Create logger
+    Records go through a QueueHandler; a QueueListener thread does the console and
+    file I/O, so logging from scraper threads and the Ark workers never blocks on disk.
+    """
+    global _listener
     logger = logging.getLogger("Market")
-    logger.setLevel(log_level)
+    if _listener is not None:
+        return logger
+
+    with _setup_lock:
+        if _listener is not None:
+            return logger
 
-    # Clear existing handlers
-    logger.handlers = []
+        config = get_config()
+        log_level = getattr(logging, config.get("log_level", "INFO"))
 
-    # Create console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(log_level)
+        # Ensure log directory exists
+        os.makedirs("logs", exist_ok=True)
 
-    # Create file handler
-    today = datetime.now().strftime("%Y-%m-%d")
-    file_handler = logging.FileHandler(f"logs/cronlytic_{today}.log")
-    file_handler.setLevel(log_level)
+        logger.setLevel(log_level)
+        logger.propagate = False
 
-    # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
+        # Create console handler
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(log_level)
 
-    # Add handlers to logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+        # Create file handler
+        today = datetime.now().strftime("%Y-%m-%d")
+        file_handler = logging.FileHandler(f"logs/cronlytic_{today}.log")
+        file_handler.setLevel(log_level)
+
+        # Create formatter
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        console_handler.setFormatter(formatter)
+        file_handler.setFormatter(formatter)
+
+        # Handlers run on the listener thread; the logger only enqueues records
+        log_queue = queue.SimpleQueue()
+        logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+        _listener = logging.handlers.QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
 
     return logger
+
+def stop_logging():
+    """Flush queued records and stop the listener thread (registered with atexit)."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+            logging.getLogger("Market").handlers = []
+
+class ProgressCounter:
+    """
+    Aggregate per-item events of a hot loop into one log line per interval.
+
+    `add("processed")` is cheap and thread-safe; a summary of all counters is logged
+    at most every `interval` seconds (config log_progress_interval_seconds) and once
+    more by `flush()` at the end of the loop.
+    """
+
+    def __init__(self, label: str, total: int = None, interval: float = None, level: int = logging.INFO):
+        self.label = label
+        self.total = total
+        self.interval = interval if interval is not None else get_config().get("log_progress_interval_seconds", 10)
+        self.level = level
+        self.counts = {}
+        self.note = None
+        self._logger = setup_logger()
+        self._lock = threading.Lock()
+        self._last_emit = time.monotonic()
+
+    def add(self, key: str = "processed", n: int = 1, note: str = None):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+            if note is not None:
+                self.note = note
+            now = time.monotonic()
+            if now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+            message = self._summary()
+        self._logger.log(self.level, message)
+
+    def flush(self):
+        with self._lock:
+            if not self.counts:
+                return
+            self._last_emit = time.monotonic()
+            message = self._summary()
+        self._logger.log(self.level, message)
+
+    def _summary(self) -> str:
+        parts = []
+        for key, count in self.counts.items():
+            parts.append(f"{count}/{self.total} {key}" if key == "processed" and self.total else f"{count} {key}")
+        message = f"{self.label}: {', '.join(parts)}"
+        if self.note:
+            message += f" (last: {self.note})"
+        return message
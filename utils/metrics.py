@@ -0,0 +1,127 @@
+# utils/metrics.py
+
+import os
+import threading
+import time
+from datetime import datetime, UTC
+from config.config_loader import get_config
+from db.writer import insert_metrics
+from utils.logger import setup_logger
+
+log = setup_logger()
+config = get_config()
+
+METRICS_CONFIG = config.get("metrics", {})
+TEXTFILE_PATH = METRICS_CONFIG.get("textfile_path", "data/metrics/reddit_pipeline.prom")
+METRIC_PREFIX = "reddit_pipeline"
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+# Values of the current run, keyed by (stage, subreddit, name); counters add up, timers add wall seconds
+_values = {}
+_latencies = {}  # stage -> [seconds] of individual LLM requests
+_run = {"id": None, "started": None}
+_lock = threading.Lock()
+
+def start_run_metrics(run_id: str):
+    """Reset the collected values; everything recorded until flush_run_metrics belongs to `run_id`."""
+    with _lock:
+        _values.clear()
+        _latencies.clear()
+        _run["id"] = run_id
+        _run["started"] = time.time()
+
+def record(stage: str, name: str, value: float = 1, subreddit: str = None):
+    """Add `value` to a counter (items, api_calls, tokens, limiter_wait_seconds, ...)."""
+    key = (stage, subreddit or "", name)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+def observe_latency(stage: str, seconds: float):
+    with _lock:
+        _latencies.setdefault(stage, []).append(seconds)
+
+class StageClock:
+    """
+    Times the consecutive stages of a linear pipeline.
+
+    `enter(stage)` closes the running stage and starts the next one, so early returns
+    need no extra bookkeeping; call `stop()` (e.g. in a finally) to close the last one.
+    """
+
+    def __init__(self):
+        self.stage = None
+        self._started = None
+
+    def enter(self, stage: str):
+        self.stop()
+        self.stage = stage
+        self._started = time.monotonic()
+
+    def stop(self):
+        if self.stage is not None:
+            record(self.stage, "wall_seconds", time.monotonic() - self._started)
+            self.stage = None
+
+def quantile(sorted_values: list, q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def snapshot() -> list[tuple[str, str, str, float]]:
+    """(stage, subreddit, name, value) rows of the current run, latency percentiles included."""
+    with _lock:
+        rows = [(stage, subreddit, name, value) for (stage, subreddit, name), value in _values.items()]
+        latencies = {stage: sorted(values) for stage, values in _latencies.items() if values}
+        started = _run["started"]
+    for stage, values in latencies.items():
+        rows.append((stage, "", "llm_requests_timed", len(values)))
+        for q in LATENCY_QUANTILES:
+            rows.append((stage, "", f"llm_latency_p{int(q * 100)}_seconds", quantile(values, q)))
+    if started:
+        rows.append(("run", "", "wall_seconds", time.time() - started))
+    return sorted(rows)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def write_textfile(rows: list, path: str = None):
+    """Write the run's values in Prometheus text format (for node_exporter's textfile collector)."""
+    path = path or TEXTFILE_PATH
+    by_metric = {}
+    for stage, subreddit, name, value in rows:
+        labels = [f'stage="{_escape(stage)}"']
+        if subreddit:
+            labels.append(f'subreddit="{_escape(subreddit)}"')
+        by_metric.setdefault(f"{METRIC_PREFIX}_{name}", []).append((",".join(labels), value))
+
+    lines = [
+        f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Unix time the last run's metrics were written",
+        f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+        f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.0f}",
+    ]
+    for metric, samples in sorted(by_metric.items()):
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{{{labels}}} {value:.6g}" for labels, value in samples)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)  # the collector never sees a half-written file
+
+def flush_run_metrics() -> list:
+    """Store the run's metrics in SQLite and the Prometheus textfile, and log the stage timings."""
+    if not METRICS_CONFIG.get("enabled", True) or _run["id"] is None:
+        return []
+    rows = snapshot()
+    recorded_at = datetime.now(UTC).isoformat()
+    insert_metrics([(_run["id"], stage, subreddit, name, value, recorded_at) for stage, subreddit, name, value in rows])
+    try:
+        write_textfile(rows)
+    except OSError as e:
+        log.warning(f"Failed to write metrics textfile {TEXTFILE_PATH}: {e}")
+
+    timings = ", ".join(
+        f"{stage} {value:.1f}s" for stage, subreddit, name, value in rows if name == "wall_seconds" and not subreddit
+    )
+    log.info(f"Run {_run['id']} stage timings: {timings}")
+    return rows